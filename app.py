@@ -1,8 +1,8 @@
 import flask
 
-from data_layer import path_utils
-from presentation_layer import prov_routes, timing_routes
-from app_settings import SERVER_PORT, PLAIN_HTTP, INCLUDE_USAGE_STATISTICS
+from data_layer import path_utils, openehr_api, demographic_api
+from presentation_layer import prov_routes, timing_routes, metrics_routes
+from app_settings import SERVER_PORT, PLAIN_HTTP, INCLUDE_USAGE_STATISTICS, INCLUDE_METRICS
 
 server = flask.Flask(__name__)
 
@@ -11,7 +11,14 @@ server.register_blueprint(prov_routes.blueprint)
 if INCLUDE_USAGE_STATISTICS:
     server.register_blueprint(timing_routes.blueprint)
 
+if INCLUDE_METRICS:
+    server.register_blueprint(metrics_routes.blueprint)
+
 if __name__ == "__main__":
+    # Establish the connections to the upstream APIs before serving the first requests.
+    openehr_api.client.warm_up()
+    demographic_api.client.warm_up()
+
     if PLAIN_HTTP:
         # Simply run the server.
         server.run(host="0.0.0.0", port=SERVER_PORT)
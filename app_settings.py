@@ -4,18 +4,54 @@ PLAIN_HTTP = (os.environ.get("PLAIN_HTTP", "no").lower() == "yes")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "12001"))
 INCLUDE_USAGE_STATISTICS = (os.environ.get("INCLUDE_USAGE_STATISTICS", "no").lower() == "yes")
 USAGE_STATISTICS_MAX_SAMPLES = int(os.environ.get("USAGE_STATISTICS_MAX_SAMPLES", "1000"))
+INCLUDE_SERVER_TIMING = (os.environ.get("INCLUDE_SERVER_TIMING", "no").lower() == "yes")
+INCLUDE_METRICS = (os.environ.get("INCLUDE_METRICS", "no").lower() == "yes")
+PROV_ENGINE = os.environ.get("PROV_ENGINE", "prov_document")
+SHADOW_ENGINE = os.environ.get("SHADOW_ENGINE", "")
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", "0.01"))
+SHADOW_MAX_PENDING = int(os.environ.get("SHADOW_MAX_PENDING", "10"))
+DEFAULT_REQUEST_DEADLINE_SECONDS = float(os.environ.get("DEFAULT_REQUEST_DEADLINE_SECONDS", "60"))
+MAX_REQUEST_DEADLINE_SECONDS = float(os.environ.get("MAX_REQUEST_DEADLINE_SECONDS", "300"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "0"))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "16"))
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get("MAX_QUEUE_WAIT_SECONDS", "1"))
+SHED_RETRY_AFTER_SECONDS = int(os.environ.get("SHED_RETRY_AFTER_SECONDS", "1"))
+ADAPTIVE_UPSTREAM_CONCURRENCY = (os.environ.get("ADAPTIVE_UPSTREAM_CONCURRENCY", "no").lower() == "yes")
+UPSTREAM_INITIAL_CONCURRENCY = int(os.environ.get("UPSTREAM_INITIAL_CONCURRENCY", "4"))
+UPSTREAM_MIN_CONCURRENCY = int(os.environ.get("UPSTREAM_MIN_CONCURRENCY", "1"))
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "64"))
+UPSTREAM_BALANCING = os.environ.get("UPSTREAM_BALANCING", "least_outstanding")
+UPSTREAM_HASH_AFFINITY = (os.environ.get("UPSTREAM_HASH_AFFINITY", "no").lower() == "yes")
+UPSTREAM_EJECTION_FAILURES = int(os.environ.get("UPSTREAM_EJECTION_FAILURES", "5"))
+UPSTREAM_EJECTION_SECONDS = float(os.environ.get("UPSTREAM_EJECTION_SECONDS", "30"))
+UPSTREAM_WARM_CONNECTIONS = int(os.environ.get("UPSTREAM_WARM_CONNECTIONS", "0"))
+UPSTREAM_KEEPALIVE_SECONDS = float(os.environ.get("UPSTREAM_KEEPALIVE_SECONDS", "0"))
+UPSTREAM_WARMUP_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_WARMUP_TIMEOUT_SECONDS", "5"))
+UPSTREAM_CALL_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_CALL_TIMEOUT_SECONDS", "30"))
+UPSTREAM_HTTP2 = (os.environ.get("UPSTREAM_HTTP2", "no").lower() == "yes")
+UPSTREAM_HTTP2_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_HTTP2_MAX_CONNECTIONS", "2"))
+REVISION_HISTORY_CACHE_SIZE = int(os.environ.get("REVISION_HISTORY_CACHE_SIZE", "1000"))
+PROV_FRAGMENT_CACHE_SIZE = int(os.environ.get("PROV_FRAGMENT_CACHE_SIZE", "20000"))
+DOCUMENT_STORE_FOLDER = os.environ.get("DOCUMENT_STORE_FOLDER", "")
+DOCUMENT_STORE_MAX_BYTES = int(os.environ.get("DOCUMENT_STORE_MAX_BYTES", "1073741824"))
+DOCUMENT_STORE_MIN_DOCUMENT_BYTES = int(os.environ.get("DOCUMENT_STORE_MIN_DOCUMENT_BYTES", "262144"))
+DOCUMENT_STORE_GZIP = (os.environ.get("DOCUMENT_STORE_GZIP", "no").lower() == "yes")
+RESPONSE_COMPRESSION = (os.environ.get("RESPONSE_COMPRESSION", "no").lower() == "yes")
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_ZSTD_LEVEL = int(os.environ.get("RESPONSE_ZSTD_LEVEL", "3"))
 AUTH_USERNAME = os.environ.get("AUTH_USERNAME", "prov_user")
 AUTH_PASSWORD = os.environ.get("AUTH_PASSWORD", "prov_password")
 
 PUBLIC_OPENEHR_API_BASE_URI = os.environ.get("PUBLIC_OPENEHR_API_BASE_URI", "http://127.0.0.1:12000")
-PRIVATE_OPENEHR_API_BASE_URI = os.environ.get("PRIVATE_OPENEHR_API_BASE_URI", "http://127.0.0.1:8080/ehrbase/rest/openehr")
+PRIVATE_OPENEHR_API_BASE_URIS = [uri.strip() for uri in os.environ.get("PRIVATE_OPENEHR_API_BASE_URI", "http://127.0.0.1:8080/ehrbase/rest/openehr").split(",") if uri.strip()]
 OPENEHR_API_AUTH_USERNAME = os.environ.get("OPENEHR_API_AUTH_USERNAME", "ehrbase-admin")
 OPENEHR_API_AUTH_PASSWORD = os.environ.get("OPENEHR_API_AUTH_PASSWORD", "EvenMoreSecretPassword")
 VALIDATE_OPENEHR_API_CERTIFICATE = (os.environ.get("VALIDATE_OPENEHR_API_CERTIFICATE", "no").lower() == "yes")
 USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE = (os.environ.get("USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE", "no").lower() == "yes")
 
 PUBLIC_DEMOGRAPHIC_API_BASE_URI = os.environ.get("PUBLIC_DEMOGRAPHIC_API_BASE_URI", "http://127.0.0.1:12000")
-PRIVATE_DEMOGRAPHIC_API_BASE_URI = os.environ.get("PRIVATE_DEMOGRAPHIC_API_BASE_URI", "http://127.0.0.1:12002")
+PRIVATE_DEMOGRAPHIC_API_BASE_URIS = [uri.strip() for uri in os.environ.get("PRIVATE_DEMOGRAPHIC_API_BASE_URI", "http://127.0.0.1:12002").split(",") if uri.strip()]
 DEMOGRAPHIC_API_AUTH_USERNAME = os.environ.get("DEMOGRAPHIC_API_AUTH_USERNAME", "demographic_user")
 DEMOGRAPHIC_API_AUTH_PASSWORD = os.environ.get("DEMOGRAPHIC_API_AUTH_PASSWORD", "demographic_password")
 VALIDATE_DEMOGRAPHIC_API_CERTIFICATE = (os.environ.get("VALIDATE_DEMOGRAPHIC_API_CERTIFICATE", "no").lower() == "yes")
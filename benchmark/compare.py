@@ -0,0 +1,261 @@
+"""
+Performance regression gate, which compares benchmark runs against the baselines stored in `benchmark/baselines`.
+
+Each benchmark suite is run several times, and each of its metrics (latency percentiles, throughput, time and
+allocations per operation, peak memory...) is compared with the baseline through a bootstrap confidence interval of
+the ratio between the current mean and the baseline mean. A metric regresses only if the whole interval is worse than
+the tolerance, so noise in a single run does not fail the gate.
+
+Usage (from the root folder of the repository):
+```bash
+# records a baseline (e.g. on the main branch)
+python -m benchmark.compare record --suite micro --runs 5
+# checks the current tree against it (exits with status 1 on regressions)
+python -m benchmark.compare check --suite micro --runs 5
+```
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.services import ROOT_FOLDER
+
+BASELINES_FOLDER = os.path.join(ROOT_FOLDER, "benchmark", "baselines")
+
+# directions of the metrics.
+LOWER_IS_BETTER = "lower"
+HIGHER_IS_BETTER = "higher"
+
+def format_params(params : dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in params.items())
+
+def extract_micro_metrics(results : dict) -> dict:
+    metrics = {}
+    for result in results["results"]:
+        key = f"{result['name']}[{format_params(result['params'])}]"
+        metrics[f"{key}.time_per_operation"] = (result["time_per_operation"]["median"], LOWER_IS_BETTER)
+        metrics[f"{key}.peak_bytes_per_call"] = (result["allocations_per_call"]["peak_bytes"], LOWER_IS_BETTER)
+    return metrics
+
+def extract_memory_metrics(results : dict) -> dict:
+    metrics = {}
+    for result in results["scaling"]:
+        key = f"request[target_type={result['target_type']},versions={result['versions']}]"
+        metrics[f"{key}.peak_bytes"] = (result["peak_bytes"], LOWER_IS_BETTER)
+        metrics[f"{key}.retained_bytes"] = (result["retained_bytes"], LOWER_IS_BETTER)
+    if results["growth"] is not None:
+        metrics["growth.blocks_per_request"] = (results["growth"]["growth_blocks_per_request"], LOWER_IS_BETTER)
+    return metrics
+
+def extract_load_metrics(results : dict) -> dict:
+    metrics = {}
+    for run in results["runs"]:
+        level = f"rate={run['rate']}" if run["mode"] == "open" else f"concurrency={run['concurrency']}"
+        key = f"load[target_type={run['target_type']},versions={run['versions']},{level}]"
+        for percentile in ["p50", "p99", "p999"]:
+            if run["latency"][percentile] is not None:
+                metrics[f"{key}.{percentile}"] = (run["latency"][percentile], LOWER_IS_BETTER)
+        if run["rps"] is not None:
+            metrics[f"{key}.rps"] = (run["rps"], HIGHER_IS_BETTER)
+        metrics[f"{key}.error_rate"] = (run["error_rate"] or 0.0, LOWER_IS_BETTER)
+    return metrics
+
+# the benchmark suites: their module, the arguments used by the gate (short enough to be run several times) and the
+# function which extracts their metrics from their JSON results.
+SUITES = {
+    "micro": ("benchmark.micro", ["--sizes", "1,10,100,1000", "--min-time", "0.2", "--repeats", "3"], extract_micro_metrics),
+    "memory": ("benchmark.memory", ["--sizes", "10,100,1000", "--growth-requests", "0"], extract_memory_metrics),
+    "load": ("benchmark.load_test", ["--launch", "--rates", "20", "--concurrency", "4", "--history-lengths", "1,10", "--duration", "10"], extract_load_metrics)
+}
+
+def run_suite(suite : str, suite_args : list) -> dict:
+    """
+    Runs a benchmark suite once in a new process.
+
+    Returns:
+        A dictionary from metric name to a tuple with its value and its direction.
+    """
+
+    module, _, extract_metrics = SUITES[suite]
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, "results.json")
+        # the memory suite exits with status 1 when its own thresholds are exceeded, but still writes its results.
+        subprocess.run([sys.executable, "-m", module, *suite_args, "--output", output_path], cwd = ROOT_FOLDER, stdout = subprocess.DEVNULL)
+        if not os.path.exists(output_path):
+            raise RuntimeError(f"The {suite} suite did not write its results.")
+        with open(output_path) as output_file:
+            return extract_metrics(json.load(output_file))
+
+def run_suite_repeatedly(suite : str, suite_args : list, runs : int) -> dict:
+    """
+    Runs a benchmark suite several times.
+
+    Returns:
+        A dictionary from metric name to a dictionary with its direction and its samples (one per run).
+    """
+
+    metrics = {}
+    for run in range(runs):
+        print(f"Running the {suite} suite ({run + 1}/{runs})...")
+        for name, (value, direction) in run_suite(suite, suite_args).items():
+            metric = metrics.setdefault(name, { "direction": direction, "samples": [] })
+            metric["samples"].append(value)
+    return metrics
+
+def bootstrap_ratio_interval(baseline_samples : list, current_samples : list, confidence : float, resamples : int, seed : int = 0) -> tuple:
+    """
+    Computes a bootstrap confidence interval of the ratio between the mean of the current samples and the mean of the
+    baseline samples, resampling both with replacement.
+
+    Returns:
+        A tuple with the ratio of the means and the lower and upper bounds of the interval (`None` if the baseline mean is zero).
+    """
+
+    baseline_mean = statistics.mean(baseline_samples)
+    current_mean = statistics.mean(current_samples)
+    if baseline_mean == 0:
+        return None, None, None
+
+    generator = random.Random(seed)
+    ratios = []
+    for _ in range(resamples):
+        baseline_resample = statistics.mean(generator.choices(baseline_samples, k = len(baseline_samples)))
+        current_resample = statistics.mean(generator.choices(current_samples, k = len(current_samples)))
+        if baseline_resample != 0:
+            ratios.append(current_resample / baseline_resample)
+    ratios.sort()
+
+    tail = (1.0 - confidence) / 2.0
+    lower = ratios[int(tail * (len(ratios) - 1))]
+    upper = ratios[int(round((1.0 - tail) * (len(ratios) - 1)))]
+    return current_mean / baseline_mean, lower, upper
+
+def compare_metrics(baseline : dict, current : dict, tolerance : float, confidence : float, resamples : int) -> list:
+    """
+    Compares the metrics of the current runs with those of the baseline.
+
+    A metric regresses (or improves) if the whole confidence interval of its ratio is beyond the tolerance.
+
+    Returns:
+        A list with the comparison of each metric present in both.
+    """
+
+    comparisons = []
+    for name, baseline_metric in baseline.items():
+        if name not in current:
+            continue
+
+        direction = baseline_metric["direction"]
+        ratio, lower, upper = bootstrap_ratio_interval(baseline_metric["samples"], current[name]["samples"], confidence, resamples)
+        if ratio is None:
+            verdict = "unchanged"
+        elif direction == LOWER_IS_BETTER:
+            verdict = "regression" if lower > 1.0 + tolerance else "improvement" if upper < 1.0 - tolerance else "unchanged"
+        else:
+            verdict = "regression" if upper < 1.0 - tolerance else "improvement" if lower > 1.0 + tolerance else "unchanged"
+
+        comparisons.append({
+            "metric": name,
+            "direction": direction,
+            "baseline_mean": statistics.mean(baseline_metric["samples"]),
+            "current_mean": statistics.mean(current[name]["samples"]),
+            "ratio": ratio,
+            "interval": [lower, upper],
+            "verdict": verdict
+        })
+    return comparisons
+
+def get_machine() -> dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "processor": platform.processor()
+    }
+
+def get_baseline_path(suite : str) -> str:
+    return os.path.join(BASELINES_FOLDER, f"{suite}.json")
+
+def record(args):
+    suite_args = args.suite_args.split() if args.suite_args is not None else SUITES[args.suite][1]
+    baseline = {
+        "suite": args.suite,
+        "suite_args": suite_args,
+        "runs": args.runs,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": get_machine(),
+        "metrics": run_suite_repeatedly(args.suite, suite_args, args.runs)
+    }
+
+    os.makedirs(BASELINES_FOLDER, exist_ok = True)
+    with open(get_baseline_path(args.suite), "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent = 2)
+    print(f"Recorded the baseline of the {args.suite} suite ({len(baseline['metrics'])} metrics).")
+
+def check(args) -> bool:
+    with open(get_baseline_path(args.suite)) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline["machine"] != get_machine():
+        print(f"Warning: the baseline was recorded on another machine ({baseline['machine']['platform']}, Python {baseline['machine']['python']}); "
+              "record a local baseline for a meaningful comparison.")
+
+    # the suite is run with the arguments of the baseline, so that the same metrics are measured.
+    current = run_suite_repeatedly(args.suite, baseline["suite_args"], args.runs)
+    comparisons = compare_metrics(baseline["metrics"], current, args.tolerance, args.confidence, args.resamples)
+
+    for comparison in comparisons:
+        if comparison["verdict"] != "unchanged" or args.verbose:
+            lower, upper = comparison["interval"]
+            interval = f"[{lower:.3f}, {upper:.3f}]" if lower is not None else "n/a"
+            print(f"{comparison['verdict']:12} {comparison['metric']:80} ratio={comparison['ratio'] or 0:.3f} {args.confidence:.0%} CI={interval}")
+
+    regressions = [comparison for comparison in comparisons if comparison["verdict"] == "regression"]
+    improvements = [comparison for comparison in comparisons if comparison["verdict"] == "improvement"]
+    print(f"{len(comparisons)} metrics compared: {len(regressions)} regressions, {len(improvements)} improvements.")
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "suite": args.suite,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "machine": get_machine(),
+                "settings": vars(args),
+                "comparisons": comparisons
+            }, output_file, indent = 2)
+
+    return len(regressions) == 0
+
+def main():
+    parser = argparse.ArgumentParser(description = "Performance regression gate comparing benchmark runs against stored baselines.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    record_parser = subparsers.add_parser("record", help = "run a suite and store its results as the baseline")
+    record_parser.add_argument("--suite", choices = list(SUITES.keys()), required = True)
+    record_parser.add_argument("--runs", type = int, default = 5, help = "number of runs of the suite")
+    record_parser.add_argument("--suite-args", default = None, help = "arguments of the suite, replacing those of the gate")
+
+    check_parser = subparsers.add_parser("check", help = "run a suite and compare its results with the baseline")
+    check_parser.add_argument("--suite", choices = list(SUITES.keys()), required = True)
+    check_parser.add_argument("--runs", type = int, default = 5, help = "number of runs of the suite")
+    check_parser.add_argument("--tolerance", type = float, default = 0.05, help = "relative change tolerated before a metric regresses")
+    check_parser.add_argument("--confidence", type = float, default = 0.95, help = "confidence level of the intervals")
+    check_parser.add_argument("--resamples", type = int, default = 2000, help = "number of bootstrap resamples")
+    check_parser.add_argument("--verbose", action = "store_true", help = "print every metric, including unchanged ones")
+    check_parser.add_argument("--output", default = None, help = "path of the JSON comparison file")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    elif not check(args):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import copy
+from contextlib import contextmanager
+import json
+import os
+from urllib.parse import urlparse
+import uuid
+
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from data_layer import classifier, openehr_api, demographic_api
+from benchmark.services import ROOT_FOLDER
+
+FIXTURES_FOLDER = os.path.join(ROOT_FOLDER, "benchmark", "fixtures")
+
+# namespace of the deterministic identifiers of the replicated fixtures.
+FIXTURE_NAMESPACE = uuid.UUID("6f0b2a4e-3c1d-4e5f-9a8b-7c6d5e4f3a2b")
+
+# committers which are assigned in turn to the versions of a history, so that documents have several agents.
+COMMITTER_COUNT = 3
+
+# recorded VERSION fixture and system ID of each target type.
+TARGET_TYPE_FIXTURES = {
+    "EHR_STATUS": ("ehr_status_version", "local.ehrbase.org"),
+    "COMPOSITION": ("composition_version", "local.ehrbase.org"),
+    "patient": ("patient_version", "demographic.api")
+}
+
+def load_fixture(name : str) -> dict:
+    with open(os.path.join(FIXTURES_FOLDER, f"{name}.json")) as fixture_file:
+        return json.load(fixture_file)
+
+def make_id(*parts) -> str:
+    return str(uuid.uuid5(FIXTURE_NAMESPACE, "/".join(str(part) for part in parts)))
+
+def make_history(fixture : dict, object_id : str, system_id : str, length : int) -> tuple:
+    """
+    Replicates a recorded VERSION into a history of `length` versions of the same versioned object.
+
+    Each version has its own version ID and CONTRIBUTION, and keeps the format of the recorded OBJECT_REFs and committer.
+
+    Returns:
+        A tuple with the list of version IDs and a dictionary from version ID to VERSION.
+    """
+
+    version_ids = []
+    versions = {}
+    for index in range(length):
+        version_id = f"{object_id}::{system_id}::{index + 1}"
+        version = copy.deepcopy(fixture)
+        version["uid"]["value"] = version_id
+
+        contribution = version["contribution"]
+        contribution_key = "uid" if "uid" in contribution else "id"
+        contribution[contribution_key]["value"] = make_id("contribution", object_id, index)
+
+        committer = version["commit_audit"]["committer"]
+        if "name" in committer:
+            committer["name"] = f"{committer['name']} {index % COMMITTER_COUNT}"
+        elif "identifiers" in committer:
+            committer["identifiers"][0]["id"] = f"{committer['identifiers'][0]['id']}-{index % COMMITTER_COUNT}"
+
+        version_ids.append(version_id)
+        versions[version_id] = version
+    return version_ids, versions
+
+class FixtureAdapter(BaseAdapter):
+    """
+    A `requests` transport adapter which answers from pre-encoded JSON documents instead of the network.
+
+    Paths which are not registered are answered with 404.
+    """
+
+    def __init__(self, base_uri : str):
+        super().__init__()
+        self.base_path = urlparse(base_uri).path.rstrip("/")
+        self.documents = {}
+
+    def add_document(self, path : str, document):
+        self.documents[f"{self.base_path}{path}"] = json.dumps(document).encode("utf-8")
+
+    def send(self, request, **kwargs) -> Response:
+        content = self.documents.get(urlparse(request.url).path, None)
+
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        if content is None:
+            response.status_code = 404
+            response._content = b""
+        else:
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = content
+        return response
+
+    def close(self):
+        pass
+
+class FixtureUpstream:
+    """
+    Serves histories made from the recorded VERSION fixtures to the clients of the openEHR API and the demographic API,
+    in the same process and without network.
+
+    Usage:
+    ```python
+    upstream = FixtureUpstream()
+    target = upstream.add_history("COMPOSITION", 100)
+    with upstream.installed():
+        ... prov_controller.get_provenance(upstream.make_target_uri(target)) ...
+    ```
+    """
+
+    def __init__(self):
+        self.clients = {
+            "openehr": openehr_api.client,
+            "demographic": demographic_api.client
+        }
+        # one adapter for each replica of each upstream API.
+        self.adapters = {name: [FixtureAdapter(base_uri) for base_uri in client.base_uris] for name, client in self.clients.items()}
+        self.fixtures = {target_type: load_fixture(fixture_name) for target_type, (fixture_name, _) in TARGET_TYPE_FIXTURES.items()}
+
+    def add_history(self, target_type : str, length : int, key = None) -> dict:
+        """
+        Adds a versioned object of the given type with a history of `length` versions.
+
+        Parameters:
+            target_type - `EHR_STATUS`, `COMPOSITION` or `patient`.
+            length - the number of versions.
+            key - distinguishes objects with the same type and length.
+
+        Returns:
+            A dictionary with the type and the IDs of the object, in the format of `classifier.classify_uri`.
+        """
+
+        _, system_id = TARGET_TYPE_FIXTURES[target_type]
+        ehr_id = make_id("ehr", target_type, length, key)
+        object_id = make_id(target_type, length, key)
+        version_ids, versions = make_history(self.fixtures[target_type], object_id, system_id, length)
+        revision_history = [{ "version_id": { "value": version_id } } for version_id in version_ids]
+
+        if target_type == "EHR_STATUS":
+            target = { "type": target_type, "ehr_id": ehr_id }
+            adapters = self.adapters["openehr"]
+            base_path = f"/v1/ehr/{ehr_id}/versioned_ehr_status"
+        elif target_type == "COMPOSITION":
+            target = { "type": target_type, "ehr_id": ehr_id, "composition_id": object_id }
+            adapters = self.adapters["openehr"]
+            base_path = f"/v1/ehr/{ehr_id}/versioned_composition/{object_id}"
+        else:
+            target = { "type": target_type, "patient_id": object_id }
+            adapters = self.adapters["demographic"]
+            base_path = f"/v1/versioned_patient/{object_id}"
+
+        for adapter in adapters:
+            adapter.add_document(f"{base_path}/revision_history", revision_history)
+            for version_id in version_ids:
+                adapter.add_document(f"{base_path}/version/{version_id}", versions[version_id])
+        return target
+
+    def make_target_uri(self, target : dict) -> str:
+        """
+        Makes the public URI of a versioned object added with `add_history`.
+        """
+
+        if target["type"] == "EHR_STATUS":
+            return f"{classifier.openehr_api_base_uri}v1/ehr/{target['ehr_id']}/versioned_ehr_status"
+        elif target["type"] == "COMPOSITION":
+            return f"{classifier.openehr_api_base_uri}v1/ehr/{target['ehr_id']}/versioned_composition/{target['composition_id']}"
+        else:
+            return f"{classifier.demographic_api_base_uri}v1/versioned_patient/{target['patient_id']}"
+
+    @contextmanager
+    def installed(self):
+        """
+        Mounts the fixture adapters on the sessions of the upstream clients, and unmounts them on exit.
+        """
+
+        for name, client in self.clients.items():
+            for base_uri, adapter in zip(client.base_uris, self.adapters[name]):
+                client.session.mount(base_uri, adapter)
+        try:
+            yield self
+        finally:
+            for client in self.clients.values():
+                for base_uri in client.base_uris:
+                    client.session.adapters.pop(base_uri, None)
@@ -0,0 +1,165 @@
+"""
+Benchmark of the representations of the provenance: PROV-XML, compact PROV-JSON, PROV-JSON encoded with MessagePack,
+Turtle and N-Triples.
+
+For each representation and history length, it reports the time to encode a document on the service (from the cached
+fragments of its versions, see `prov_fragments`, and for PROV-XML, Turtle and N-Triples also with the `prov` package),
+its size (raw and gzip-encoded) and the time for a client to decode it into a generic structure (an element tree for
+PROV-XML, dictionaries for PROV-JSON and an `rdflib` graph for Turtle and N-Triples).
+
+The upstream APIs are replaced by the recorded VERSION fixtures, as in the microbenchmarks.
+
+Usage (from the root folder of the repository):
+```bash
+python -m benchmark.formats --sizes 10,100,1000,10000 --output formats_results.json
+```
+"""
+
+import argparse
+import gzip
+import json
+import platform
+import sys
+import time
+import xml.etree.ElementTree as etree
+
+import rdflib
+from rdflib.compare import isomorphic
+
+from business_layer import prov_engines, prov_formats, prov_fragments, prov_generation
+from benchmark.micro import serving_fixtures, measure_time
+from benchmark.fixture_upstream import TARGET_TYPE_FIXTURES, load_fixture, make_id, make_history
+
+# MessagePack is optional, on the service as on the clients.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def make_classification(target_type : str) -> dict:
+    if target_type == "EHR_STATUS":
+        return { "type": "EHR_STATUS", "ehr_id": make_id("ehr", 0) }
+    elif target_type == "COMPOSITION":
+        return { "type": "COMPOSITION", "ehr_id": make_id("ehr", 0), "composition_id": make_id("composition", 0) }
+    return { "type": "patient", "patient_id": make_id("patient", 0) }
+
+# the RDF representations, as tuples of their name, their `rdflib` format and their writer.
+RDF_REPRESENTATIONS = [
+    ("turtle", "turtle", prov_formats.write_turtle),
+    ("n-triples", "nt", prov_formats.write_n_triples)
+]
+
+def serialize_rdf_with_prov_document(classification : dict, rdf_format : str) -> bytes:
+    """
+    Serializes the provenance of a classified target to RDF with a `ProvDocument`, serialized by the `prov` package
+    (with `rdflib`).
+
+    `rdflib` refuses to serialize the IRIs of the committers whose names have spaces, as in the fixtures, so the names
+    are percent-encoded beforehand, as by `prov_formats.to_iri`.
+    """
+
+    version_ids = prov_generation.get_version_ids(classification)
+    version_tuples = (
+        (version_id, contribution_id, None if committer_name_or_id is None else committer_name_or_id.translate(prov_formats.IRI_ESCAPES))
+        for version_id, contribution_id, committer_name_or_id
+        in prov_generation.extract_version_tuples(version_ids, prov_generation.make_version_getter(classification))
+    )
+    doc = prov_generation.create_prov_document(prov_generation.ENTITY_TYPES[classification["type"]], version_ids, version_tuples)
+    return doc.serialize(format = "rdf", rdf_format = rdf_format).encode("utf-8")
+
+def parse_graph(content : bytes, rdf_format : str) -> rdflib.Graph:
+    return rdflib.Graph().parse(data = content, format = rdf_format)
+
+def get_representations(classification : dict) -> list:
+    """
+    Lists the representations which are benchmarked, as tuples of their name, their encoder and their decoder.
+    """
+
+    representations = [
+        ("xml (prov)", lambda: prov_engines.build_with_prov_document(classification).encode("ascii"), etree.fromstring),
+        ("xml (fragments)", lambda: prov_fragments.build_prov_xml(classification).encode("ascii"), etree.fromstring),
+        ("json", lambda: prov_formats.write_prov_json(classification), json.loads)
+    ]
+    if msgpack is not None and prov_formats.msgpack is not None:
+        representations.append(("msgpack", lambda: prov_formats.write_msgpack(classification), msgpack.unpackb))
+    for name, rdf_format, write in RDF_REPRESENTATIONS:
+        decode = lambda content, rdf_format = rdf_format: parse_graph(content, rdf_format)
+        representations.append((f"{name} (prov)", lambda rdf_format = rdf_format: serialize_rdf_with_prov_document(classification, rdf_format), decode))
+        representations.append((name, lambda write = write: write(classification), decode))
+    return representations
+
+def check_rdf_equivalence(classification : dict, rdf_format : str, write) -> bool:
+    """
+    Checks that the graph written by `prov_formats` is isomorphic to the graph serialized by the `prov` package.
+    """
+
+    return isomorphic(parse_graph(serialize_rdf_with_prov_document(classification, rdf_format), rdf_format),
+                      parse_graph(write(classification), rdf_format))
+
+def run_benchmark(args) -> dict:
+    results = []
+    equivalences = []
+    for target_type in args.targets.split(","):
+        fixture_name, system_id = TARGET_TYPE_FIXTURES[target_type]
+        fixture = load_fixture(fixture_name)
+        classification = make_classification(target_type)
+
+        for size in [int(size) for size in args.sizes.split(",")]:
+            version_ids, versions = make_history(fixture, make_id(target_type, size), system_id, size)
+            with serving_fixtures(version_ids, versions):
+                for name, encode, decode in get_representations(classification):
+                    # the first call renders and caches the fragments of the versions.
+                    content = encode()
+                    result = {
+                        "representation": name,
+                        "target_type": target_type,
+                        "versions": size,
+                        "bytes": len(content),
+                        "gzip_bytes": len(gzip.compress(content, compresslevel = 6)),
+                        "encode_time": measure_time(encode, 1, args.min_time, args.repeats),
+                        "decode_time": measure_time(lambda: decode(content), 1, args.min_time, args.repeats)
+                    }
+                    results.append(result)
+                    print(f"{name:17} target_type={target_type:11} versions={size:<6} size={result['bytes'] / 1024:10.1f}KiB "
+                          f"gzip={result['gzip_bytes'] / 1024:8.1f}KiB encode={1e3 * result['encode_time']['median']:9.3f}ms "
+                          f"decode={1e3 * result['decode_time']['median']:9.3f}ms")
+
+                for name, rdf_format, write in RDF_REPRESENTATIONS:
+                    equivalent = check_rdf_equivalence(classification, rdf_format, write)
+                    equivalences.append({"representation": name, "target_type": target_type, "versions": size, "equivalent": equivalent})
+                    print(f"{name:17} target_type={target_type:11} versions={size:<6} equivalent to the prov serialization: {equivalent}")
+
+    return {
+        "benchmark": "formats",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor()
+        },
+        "settings": vars(args),
+        "results": results,
+        "equivalences": equivalences
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark of the representations of the provenance.")
+    parser.add_argument("--targets", default = "EHR_STATUS,COMPOSITION,patient", help = "comma-separated target types")
+    parser.add_argument("--sizes", default = "10,100,1000,10000", help = "comma-separated numbers of versions")
+    parser.add_argument("--min-time", type = float, default = 1.0, help = "minimum measuring time of each operation, in seconds")
+    parser.add_argument("--repeats", type = int, default = 5, help = "number of timed repeats of each operation")
+    parser.add_argument("--output", default = None, help = "path of the JSON results file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+
+    if not all(equivalence["equivalent"] for equivalence in results["equivalences"]):
+        print("Some RDF representations are not equivalent to the serialization of the prov package.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+End-to-end load benchmark of `/provenance/service`.
+
+The benchmark drives the service either at fixed open-loop arrival rates (requests are sent on schedule,
+regardless of how many are still in flight, and latencies are measured from the scheduled time) or at fixed
+concurrency levels (closed loop), for each combination of target type and history length.
+
+Usage (from the root folder of the repository), starting the stand-in upstream and the service locally:
+```bash
+python -m benchmark.load_test --launch --rates 10,50 --concurrency 1,8 --duration 20 --output load_results.json
+```
+
+Or against a running service whose upstream is the stand-in upstream:
+```bash
+python -m benchmark.load_test --service-url http://127.0.0.1:12001 --service-pid <pid> --upstream-url http://127.0.0.1:12010
+```
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import platform
+import threading
+import time
+
+import requests
+
+from benchmark.statistics import summarize_latencies
+from benchmark.process_monitor import ProcessMonitor
+from benchmark.services import LocalServices
+
+# the target types, as named by the stand-in upstream catalog and by the service.
+CATALOG_TARGET_TYPES = {
+    "EHR_STATUS": "EHR_STATUS",
+    "COMPOSITION": "COMPOSITION",
+    "patient": "PERSON"
+}
+
+def make_target_uri(catalog_entry : dict, public_openehr_api_base_uri : str, public_demographic_api_base_uri : str) -> str:
+    """
+    Makes the public URI of a versioned object listed in the stand-in upstream catalog.
+    """
+
+    if catalog_entry["type"] == "EHR_STATUS":
+        return f"{public_openehr_api_base_uri}/v1/ehr/{catalog_entry['ehr_id']}/versioned_ehr_status"
+    elif catalog_entry["type"] == "COMPOSITION":
+        return f"{public_openehr_api_base_uri}/v1/ehr/{catalog_entry['ehr_id']}/versioned_composition/{catalog_entry['composition_id']}"
+    else:
+        return f"{public_demographic_api_base_uri}/v1/versioned_patient/{catalog_entry['patient_id']}"
+
+class LoadClient:
+    """
+    Sends provenance requests and records their outcome. Each thread has its own HTTP session.
+    """
+
+    def __init__(self, service_url : str, auth : tuple, timeout : float):
+        self.service_url = service_url
+        self.auth = auth
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def send(self, target_uri : str, scheduled_time : float) -> tuple:
+        """
+        Sends a request for the provenance of `target_uri`.
+
+        Returns:
+            A tuple with the latency (measured from `scheduled_time`), whether the request succeeded, and the completion time.
+        """
+
+        try:
+            response = self._get_session().get(
+                f"{self.service_url}/provenance/service",
+                params = { "target": target_uri },
+                auth = self.auth,
+                timeout = self.timeout
+            )
+            succeeded = response.status_code == 200
+        except requests.exceptions.RequestException:
+            succeeded = False
+
+        completion_time = time.monotonic()
+        return completion_time - scheduled_time, succeeded, completion_time
+
+def summarize_outcomes(outcomes : list, start_time : float) -> dict:
+    latencies = [latency for latency, _, _ in outcomes]
+    errors = sum(1 for _, succeeded, _ in outcomes if not succeeded)
+    elapsed = max(completion_time for _, _, completion_time in outcomes) - start_time if len(outcomes) > 0 else 0.0
+
+    summary = {
+        "requests": len(outcomes),
+        "errors": errors,
+        "error_rate": errors / len(outcomes) if len(outcomes) > 0 else None,
+        "rps": len(outcomes) / elapsed if elapsed > 0 else None,
+        "latency": summarize_latencies(latencies)
+    }
+    return summary
+
+def run_open_loop(client : LoadClient, target_uris : list, rate : float, duration : float, max_in_flight : int) -> dict:
+    """
+    Sends requests at a fixed arrival rate for `duration` seconds.
+
+    Requests which cannot be sent on schedule because `max_in_flight` requests are outstanding wait in a queue,
+    and that wait counts towards their latency.
+    """
+
+    request_count = max(1, int(rate * duration))
+    futures = []
+    with ThreadPoolExecutor(max_workers = max_in_flight) as executor:
+        start_time = time.monotonic()
+        for index in range(request_count):
+            scheduled_time = start_time + index / rate
+            delay = scheduled_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(client.send, target_uris[index % len(target_uris)], scheduled_time))
+        outcomes = [future.result() for future in futures]
+
+    return summarize_outcomes(outcomes, start_time)
+
+def run_closed_loop(client : LoadClient, target_uris : list, concurrency : int, duration : float) -> dict:
+    """
+    Keeps `concurrency` requests in flight for `duration` seconds.
+    """
+
+    outcomes = []
+    outcomes_lock = threading.Lock()
+    start_time = time.monotonic()
+    end_time = start_time + duration
+
+    def worker(worker_index):
+        index = worker_index
+        while time.monotonic() < end_time:
+            outcome = client.send(target_uris[index % len(target_uris)], time.monotonic())
+            with outcomes_lock:
+                outcomes.append(outcome)
+            index += concurrency
+
+    threads = [threading.Thread(target = worker, args = (worker_index,)) for worker_index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize_outcomes(outcomes, start_time)
+
+def run_monitored(service_pid : int, run):
+    """
+    Runs a load level, monitoring the service process if its PID is known.
+    """
+
+    if service_pid is None:
+        return run(), None
+
+    with ProcessMonitor(service_pid) as monitor:
+        summary = run()
+    return summary, monitor.get_report()
+
+def run_benchmark(args, service_url : str, auth : tuple, upstream_url : str, service_pid : int, public_openehr_api_base_uri : str, public_demographic_api_base_uri : str) -> dict:
+    catalog = requests.get(f"{upstream_url}/catalog").json()
+    client = LoadClient(service_url, auth, args.timeout)
+
+    scenarios = []
+    for target_type in args.targets.split(","):
+        for history_length in [int(value) for value in args.history_lengths.split(",")]:
+            entries = [entry for entry in catalog if entry["type"] == CATALOG_TARGET_TYPES[target_type] and entry["versions"] == history_length]
+            if len(entries) == 0:
+                print(f"No {target_type} with {history_length} versions in the catalog, skipping.")
+                continue
+            target_uris = [make_target_uri(entry, public_openehr_api_base_uri, public_demographic_api_base_uri) for entry in entries]
+            scenarios.append((target_type, history_length, target_uris))
+
+    runs = []
+    for target_type, history_length, target_uris in scenarios:
+        # warm up the connections of the service and of the client.
+        for target_uri in target_uris[:args.warmup]:
+            client.send(target_uri, time.monotonic())
+
+        load_levels = []
+        if args.rates:
+            load_levels += [("open", float(rate)) for rate in args.rates.split(",")]
+        if args.concurrency:
+            load_levels += [("closed", int(concurrency)) for concurrency in args.concurrency.split(",")]
+
+        for mode, level in load_levels:
+            if mode == "open":
+                summary, process = run_monitored(service_pid, lambda: run_open_loop(client, target_uris, level, args.duration, args.max_in_flight))
+            else:
+                summary, process = run_monitored(service_pid, lambda: run_closed_loop(client, target_uris, level, args.duration))
+
+            result = {
+                "target_type": target_type,
+                "versions": history_length,
+                "mode": mode,
+                "rate" if mode == "open" else "concurrency": level,
+                **summary,
+                "process": process
+            }
+            runs.append(result)
+
+            latency = summary["latency"]
+            print(f"{target_type:12} versions={history_length:<6} {mode:6} {level:<6} rps={summary['rps'] or 0:8.1f} "
+                  f"p50={1000 * (latency['p50'] or 0):8.1f}ms p99={1000 * (latency['p99'] or 0):8.1f}ms "
+                  f"p999={1000 * (latency['p999'] or 0):8.1f}ms errors={summary['error_rate'] or 0:.2%}"
+                  + (f" cpu={process['cpu_percent']:.0f}% rss={process['rss_max_bytes'] / 2**20:.0f}MiB" if process is not None else ""))
+
+    return {
+        "benchmark": "load_test",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor()
+        },
+        "settings": vars(args),
+        "runs": runs
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "End-to-end load benchmark of /provenance/service.")
+    parser.add_argument("--launch", action = "store_true", help = "start the stand-in upstream and the service locally")
+    parser.add_argument("--dataset", default = None, help = "with --launch, the dataset file served by the stand-in upstream (see fake_upstream/dataset.py)")
+    parser.add_argument("--service-url", default = "http://127.0.0.1:12001")
+    parser.add_argument("--service-pid", type = int, default = None, help = "PID of the service, to report its CPU and memory usage")
+    parser.add_argument("--upstream-url", default = "http://127.0.0.1:12010", help = "URL of the stand-in upstream (used for its catalog)")
+    parser.add_argument("--username", default = "prov_user")
+    parser.add_argument("--password", default = "prov_password")
+    parser.add_argument("--public-openehr-api-base-uri", default = "http://127.0.0.1:12000")
+    parser.add_argument("--public-demographic-api-base-uri", default = "http://127.0.0.1:12000")
+    parser.add_argument("--targets", default = "EHR_STATUS,COMPOSITION,patient", help = "comma-separated target types")
+    parser.add_argument("--history-lengths", default = "1,10,100", help = "comma-separated numbers of versions")
+    parser.add_argument("--rates", default = "10", help = "comma-separated open-loop arrival rates (requests per second)")
+    parser.add_argument("--concurrency", default = "1,8", help = "comma-separated closed-loop concurrency levels")
+    parser.add_argument("--duration", type = float, default = 10.0, help = "duration of each load level, in seconds")
+    parser.add_argument("--max-in-flight", type = int, default = 256, help = "maximum outstanding requests in open-loop mode")
+    parser.add_argument("--timeout", type = float, default = 60.0, help = "timeout of each request, in seconds")
+    parser.add_argument("--warmup", type = int, default = 3, help = "requests sent before measuring each scenario")
+    parser.add_argument("--output", default = None, help = "path of the JSON results file")
+    args = parser.parse_args()
+
+    if args.launch:
+        with LocalServices(dataset = args.dataset) as services:
+            results = run_benchmark(args, services.service_url, services.auth, services.upstream_url, services.service_pid, services.public_openehr_api_base_uri, services.public_demographic_api_base_uri)
+    else:
+        results = run_benchmark(args, args.service_url, (args.username, args.password), args.upstream_url, args.service_pid, args.public_openehr_api_base_uri, args.public_demographic_api_base_uri)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Memory benchmark of `/provenance/service`, isolated from the network.
+
+The service is driven in-process through the Flask test client, and the upstream APIs are served from the recorded
+VERSION fixtures (see `benchmark/fixture_upstream.py`). The benchmark has two parts:
+- scaling: the peak and retained memory of one request (measured with `tracemalloc`) and the growth of the resident
+  memory, for each target type and history length;
+- growth: the memory blocks still allocated after many requests (sessions, timing buffers, metrics, caches...), which
+  must not grow once the bounded structures are full.
+
+It exits with status 1 if the peak memory per version or the growth per request exceeds its threshold.
+
+Usage (from the root folder of the repository):
+```bash
+python -m benchmark.memory --sizes 10,100,1000,10000 --growth-requests 100000 --output memory_results.json
+```
+"""
+
+import os
+
+# usage statistics, metrics and Server-Timing keep state across requests, so they are enabled unless configured otherwise.
+# the settings are read when the service modules are imported, so they must be set before.
+for setting in ["INCLUDE_USAGE_STATISTICS", "INCLUDE_METRICS", "INCLUDE_SERVER_TIMING"]:
+    os.environ.setdefault(setting, "yes")
+
+import argparse
+import base64
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from app import server
+from app_settings import AUTH_USERNAME, AUTH_PASSWORD
+from benchmark.fixture_upstream import FixtureUpstream
+from benchmark.process_monitor import read_rss_bytes
+
+# history lengths below this one are dominated by the fixed cost of a request, so their memory per version is not checked.
+MIN_CHECKED_VERSIONS = 100
+
+def make_headers() -> dict:
+    credentials = base64.b64encode(f"{AUTH_USERNAME}:{AUTH_PASSWORD}".encode("utf-8")).decode("ascii")
+    return { "Authorization": f"Basic {credentials}" }
+
+def send_request(client, target_uri : str, headers : dict):
+    response = client.get("/provenance/service", query_string = { "target": target_uri }, headers = headers)
+    if response.status_code != 200:
+        raise RuntimeError(f"The request for {target_uri} failed with status {response.status_code}.")
+    return response
+
+def measure_request(client, target_uri : str, headers : dict) -> dict:
+    """
+    Measures the peak memory of one request (including its response) and the memory it leaves allocated.
+    """
+
+    gc.collect()
+    rss_before = read_rss_bytes(os.getpid())
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        response = send_request(client, target_uri, headers)
+        response_bytes = len(response.get_data())
+        del response
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peak_bytes": peak - baseline,
+        "retained_bytes": current - baseline,
+        "response_bytes": response_bytes,
+        "rss_growth_bytes": read_rss_bytes(os.getpid()) - rss_before
+    }
+
+def run_scaling(client, upstream : FixtureUpstream, headers : dict, args) -> tuple:
+    results = []
+    failures = []
+    for target_type in args.targets.split(","):
+        for size in [int(size) for size in args.sizes.split(",")]:
+            target_uri = upstream.make_target_uri(upstream.add_history(target_type, size))
+
+            # warms up the request path, so that lazily-created structures are not counted.
+            send_request(client, target_uri, headers)
+            measurement = measure_request(client, target_uri, headers)
+            measurement["peak_bytes_per_version"] = measurement["peak_bytes"] / size
+            results.append({ "target_type": target_type, "versions": size, **measurement })
+
+            print(f"{target_type:12} versions={size:<6} peak={measurement['peak_bytes'] / 2**20:9.2f}MiB "
+                  f"per_version={measurement['peak_bytes_per_version'] / 1024:8.2f}KiB retained={measurement['retained_bytes'] / 1024:8.1f}KiB "
+                  f"rss_growth={measurement['rss_growth_bytes'] / 2**20:8.2f}MiB response={measurement['response_bytes'] / 1024:9.1f}KiB")
+
+            if size >= MIN_CHECKED_VERSIONS and measurement["peak_bytes_per_version"] > args.max_peak_bytes_per_version:
+                failures.append(f"{target_type} with {size} versions: peak of {measurement['peak_bytes_per_version']:.0f} bytes per version "
+                                f"(threshold: {args.max_peak_bytes_per_version} bytes)")
+    return results, failures
+
+def run_growth(client, upstream : FixtureUpstream, headers : dict, args) -> tuple:
+    """
+    Sends `args.growth_requests` requests, cycling over targets of every type, and compares the number of memory blocks
+    allocated by Python (`sys.getallocatedblocks`, which is cheap enough to leave the requests untraced) after the warm-up
+    requests with the number at the end.
+
+    If the growth exceeds its threshold, `args.diagnostic_requests` more requests are traced with `tracemalloc` to locate it.
+    """
+
+    target_uris = []
+    for target_type in args.targets.split(","):
+        for key in range(args.growth_targets):
+            target_uris.append(upstream.make_target_uri(upstream.add_history(target_type, args.growth_versions, key = key)))
+
+    for index in range(args.growth_warmup):
+        send_request(client, target_uris[index % len(target_uris)], headers)
+    gc.collect()
+    start_blocks = sys.getallocatedblocks()
+    start_rss = read_rss_bytes(os.getpid())
+
+    checkpoints = []
+    checkpoint_interval = max(1, args.growth_requests // 10)
+    for index in range(args.growth_requests):
+        send_request(client, target_uris[index % len(target_uris)], headers)
+        if (index + 1) % checkpoint_interval == 0:
+            gc.collect()
+            checkpoint = {
+                "requests": index + 1,
+                "allocated_blocks": sys.getallocatedblocks() - start_blocks,
+                "rss_growth_bytes": read_rss_bytes(os.getpid()) - start_rss
+            }
+            checkpoints.append(checkpoint)
+            print(f"growth after {index + 1:7} requests: blocks={checkpoint['allocated_blocks']:+8} rss={checkpoint['rss_growth_bytes'] / 1024:+10.0f}KiB")
+
+    gc.collect()
+    growth_blocks = sys.getallocatedblocks() - start_blocks
+    growth_blocks_per_request = growth_blocks / args.growth_requests if args.growth_requests > 0 else 0.0
+
+    result = {
+        "requests": args.growth_requests,
+        "warmup_requests": args.growth_warmup,
+        "targets": len(target_uris),
+        "versions": args.growth_versions,
+        "growth_blocks": growth_blocks,
+        "growth_blocks_per_request": growth_blocks_per_request,
+        "rss_growth_bytes": read_rss_bytes(os.getpid()) - start_rss,
+        "checkpoints": checkpoints,
+        "top_growth": None
+    }
+
+    failures = []
+    if growth_blocks_per_request > args.max_growth_blocks_per_request:
+        result["top_growth"] = locate_growth(client, target_uris, headers, args.diagnostic_requests)
+        locations = "".join(f"\n    {entry['location']}: +{entry['size_diff_bytes']} bytes" for entry in result["top_growth"][:5])
+        failures.append(f"memory grew by {growth_blocks_per_request:.3f} blocks per request over {args.growth_requests} requests "
+                        f"(threshold: {args.max_growth_blocks_per_request} blocks){locations}")
+    return result, failures
+
+def locate_growth(client, target_uris : list, headers : dict, request_count : int) -> list:
+    """
+    Traces some requests with `tracemalloc` and lists the source lines whose allocations grew the most.
+    """
+
+    tracemalloc.start()
+    try:
+        gc.collect()
+        start_snapshot = tracemalloc.take_snapshot()
+        for index in range(request_count):
+            send_request(client, target_uris[index % len(target_uris)], headers)
+        gc.collect()
+        end_snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    return [
+        { "location": str(statistic.traceback), "size_diff_bytes": statistic.size_diff, "count_diff": statistic.count_diff }
+        for statistic in end_snapshot.compare_to(start_snapshot, "lineno")[:10]
+        if statistic.size_diff > 0
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description = "Memory benchmark of /provenance/service.")
+    parser.add_argument("--targets", default = "EHR_STATUS,COMPOSITION,patient", help = "comma-separated target types")
+    parser.add_argument("--sizes", default = "10,100,1000,10000", help = "comma-separated numbers of versions")
+    parser.add_argument("--max-peak-bytes-per-version", type = int, default = 16 * 1024, help = f"threshold of the peak memory per version, for histories of at least {MIN_CHECKED_VERSIONS} versions")
+    parser.add_argument("--growth-requests", type = int, default = 100000, help = "number of requests of the growth check (0 to skip it)")
+    parser.add_argument("--growth-warmup", type = int, default = 5000, help = "requests sent before the growth check, to fill the bounded structures")
+    parser.add_argument("--growth-targets", type = int, default = 10, help = "number of targets of each type used by the growth check")
+    parser.add_argument("--growth-versions", type = int, default = 2, help = "number of versions of the targets used by the growth check")
+    parser.add_argument("--max-growth-blocks-per-request", type = float, default = 0.01, help = "threshold of the growth of allocated memory blocks per request")
+    parser.add_argument("--diagnostic-requests", type = int, default = 1000, help = "requests traced to locate the growth when its threshold is exceeded")
+    parser.add_argument("--output", default = None, help = "path of the JSON results file")
+    args = parser.parse_args()
+
+    upstream = FixtureUpstream()
+    client = server.test_client()
+    headers = make_headers()
+
+    with upstream.installed():
+        scaling, failures = run_scaling(client, upstream, headers, args)
+        growth = None
+        if args.growth_requests > 0:
+            growth, growth_failures = run_growth(client, upstream, headers, args)
+            failures += growth_failures
+
+    results = {
+        "benchmark": "memory",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor()
+        },
+        "settings": vars(args),
+        "scaling": scaling,
+        "growth": growth,
+        "failures": failures
+    }
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+
+    if len(failures) > 0:
+        print("Memory thresholds exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Microbenchmarks of the CPU hot paths of the PROV service, isolated from the network.
+
+The upstream APIs are replaced by recorded VERSION fixtures (`benchmark/fixtures`), which are replicated to build
+histories of the requested lengths. For each operation the benchmark reports the time per operation and the memory
+allocated by one call (peak and retained, measured with `tracemalloc`).
+
+Usage (from the root folder of the repository):
+```bash
+python -m benchmark.micro --sizes 1,10,100,1000,10000 --output micro_results.json
+```
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+import xml.etree.ElementTree as etree
+from contextlib import contextmanager
+
+from data_layer import classifier, ids, openehr_api, demographic_api
+from business_layer import prov_generation, prov_fragments
+from benchmark.services import ROOT_FOLDER
+from benchmark.fixture_upstream import TARGET_TYPE_FIXTURES, load_fixture, make_id, make_history
+
+SCONE_SERIALIZER_FILE = os.path.join(ROOT_FOLDER, "docker", "scone", "scone_scripts", "provxml_replacement_serializer.py")
+
+@contextmanager
+def serving_fixtures(version_ids : list, versions : dict):
+    """
+    Replaces the functions of the data layer which are used by the builders, so that they serve a recorded history.
+    """
+
+    replacements = [
+        (openehr_api, "get_version_ids_of_ehr_status", lambda ehr_id: version_ids),
+        (openehr_api, "get_versioned_ehr_status_version_by_id", lambda ehr_id, version_id: versions[version_id]),
+        (openehr_api, "get_version_ids_of_composition", lambda ehr_id, composition_id: version_ids),
+        (openehr_api, "get_versioned_composition_version_by_id", lambda ehr_id, composition_id, version_id: versions[version_id]),
+        (demographic_api, "get_version_ids_of_patient", lambda patient_id: version_ids),
+        (demographic_api, "get_versioned_patient_version_by_id", lambda patient_id, version_id: versions[version_id])
+    ]
+
+    originals = [(module, name, getattr(module, name)) for module, name, _ in replacements]
+    for module, name, replacement in replacements:
+        setattr(module, name, replacement)
+    try:
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+def make_uri_corpora(size : int) -> dict:
+    """
+    Makes corpora of URIs with every pattern recognized by the classifier, and a corpus of URIs which are not recognized.
+    """
+
+    openehr = classifier.openehr_api_base_uri
+    demographic = classifier.demographic_api_base_uri
+
+    openehr_uris = []
+    demographic_uris = []
+    invalid_uris = []
+    for index in range(size):
+        ehr_id = make_id("ehr", index)
+        composition_id = make_id("composition", index)
+        patient_id = make_id("patient", index)
+        ehr_status_version_id = f"{make_id('ehr_status', index)}::local.ehrbase.org::1"
+        composition_version_id = f"{composition_id}::local.ehrbase.org::1"
+        patient_version_id = f"{patient_id}::demographic.api::1"
+
+        openehr_uris += [
+            f"{openehr}v1/ehr/{ehr_id}/ehr_status",
+            f"{openehr}v1/ehr/{ehr_id}/ehr_status/{ehr_status_version_id}",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_ehr_status",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_ehr_status/version",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_ehr_status/version/{ehr_status_version_id}",
+            f"{openehr}v1/ehr/{ehr_id}/composition/{composition_id}",
+            f"{openehr}v1/ehr/{ehr_id}/composition/{composition_version_id}",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_composition/{composition_id}",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_composition/{composition_id}/version",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_composition/{composition_id}/version/{composition_version_id}"
+        ]
+        demographic_uris += [
+            f"{demographic}v1/patient/{patient_id}",
+            f"{demographic}v1/patient/{patient_version_id}",
+            f"{demographic}v1/versioned_patient/{patient_id}",
+            f"{demographic}v1/versioned_patient/{patient_id}/version",
+            f"{demographic}v1/versioned_patient/{patient_id}/version/{patient_version_id}"
+        ]
+        invalid_uris += [
+            f"http://example.org/v1/ehr/{ehr_id}/ehr_status",
+            f"{openehr}v2/ehr/{ehr_id}/ehr_status",
+            f"{openehr}v1/ehr/{ehr_id}",
+            f"{openehr}v1/ehr/{ehr_id}/versioned_composition/{composition_id}/version/{composition_version_id}/extra",
+            f"{demographic}v1/versioned_patient/{patient_id}/revision_history/extra"
+        ]
+
+    return {
+        "openehr": openehr_uris,
+        "demographic": demographic_uris,
+        "invalid": invalid_uris
+    }
+
+def make_id_corpus(size : int) -> list:
+    """
+    Makes a corpus of version IDs, versioned object IDs and malformed identifiers.
+    """
+
+    corpus = []
+    for index in range(size):
+        object_id = make_id("object", index)
+        corpus += [
+            f"{object_id}::local.ehrbase.org::{index + 1}",
+            object_id,
+            f"{object_id}::local.ehrbase.org",
+            f"{object_id}::local.ehrbase.org::not-a-number",
+            f"not-a-uuid::local.ehrbase.org::{index + 1}"
+        ]
+    return corpus
+
+def load_scone_serializer():
+    """
+    Loads the replacement PROV-XML serializer of the SCONE image, which is a standalone script.
+    """
+
+    spec = importlib.util.spec_from_file_location("provxml_replacement_serializer", SCONE_SERIALIZER_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def measure_time(fn, operations_per_call : int, min_time : float, repeats : int) -> dict:
+    """
+    Measures the time per operation of a function.
+
+    The number of calls per repeat is calibrated so that each repeat lasts at least `min_time / repeats` seconds.
+    """
+
+    calls = 1
+    while True:
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= min_time / repeats or calls >= 2**20:
+            break
+        calls *= 2 if elapsed == 0 else max(2, min(10, int(min_time / repeats / elapsed) + 1))
+
+    times = [elapsed / (calls * operations_per_call)]
+    for _ in range(repeats - 1):
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        times.append((time.perf_counter() - start_time) / (calls * operations_per_call))
+
+    return {
+        "calls_per_repeat": calls,
+        "repeats": repeats,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times)
+    }
+
+def measure_allocations(fn) -> dict:
+    """
+    Measures the memory allocated by one call of a function: the peak of the memory allocated during the call and the
+    memory still allocated after it (including its result).
+    """
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        "peak_bytes": peak - baseline,
+        "retained_bytes": current - baseline
+    }
+
+def run_operation(name : str, params : dict, fn, operations_per_call : int, args) -> dict:
+    result = {
+        "name": name,
+        "params": params,
+        "operations_per_call": operations_per_call,
+        "time_per_operation": measure_time(fn, operations_per_call, args.min_time, args.repeats),
+        "allocations_per_call": measure_allocations(fn)
+    }
+
+    time_per_operation = result["time_per_operation"]
+    allocations = result["allocations_per_call"]
+    description = " ".join(f"{key}={value}" for key, value in params.items())
+    print(f"{name:32} {description:36} median={1e6 * time_per_operation['median']:12.2f}us min={1e6 * time_per_operation['min']:12.2f}us "
+          f"peak={allocations['peak_bytes'] / 1024:10.1f}KiB retained={allocations['retained_bytes'] / 1024:10.1f}KiB")
+    return result
+
+def run_benchmark(args) -> dict:
+    selected = set(args.operations.split(","))
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+
+    if "classify_uri" in selected:
+        for corpus_name, corpus in make_uri_corpora(args.corpus_size).items():
+            results.append(run_operation("classify_uri", { "corpus": corpus_name }, lambda: [classifier.classify_uri(uri) for uri in corpus], len(corpus), args))
+
+    if "is_version_id" in selected:
+        corpus = make_id_corpus(args.corpus_size)
+        results.append(run_operation("is_version_id", { "corpus": "mixed" }, lambda: [ids.is_version_id(id) for id in corpus], len(corpus), args))
+
+    builders = {
+        "EHR_STATUS": lambda: prov_generation.create_prov_document_of_ehr_status(make_id("ehr", 0)),
+        "COMPOSITION": lambda: prov_generation.create_prov_document_of_composition(make_id("ehr", 0), make_id("composition", 0)),
+        "patient": lambda: prov_generation.create_prov_document_of_patient(make_id("patient", 0))
+    }
+
+    classifications = {
+        "EHR_STATUS": { "type": "EHR_STATUS", "ehr_id": make_id("ehr", 0) },
+        "COMPOSITION": { "type": "COMPOSITION", "ehr_id": make_id("ehr", 0), "composition_id": make_id("composition", 0) },
+        "patient": { "type": "patient", "patient_id": make_id("patient", 0) }
+    }
+
+    scone_serializer = load_scone_serializer() if "map_namespaces" in selected else None
+
+    for target_type in args.targets.split(","):
+        fixture_name, system_id = TARGET_TYPE_FIXTURES[target_type]
+        build = builders[target_type]
+        fixture = load_fixture(fixture_name)
+        for size in sizes:
+            params = { "target_type": target_type, "versions": size }
+            version_ids, versions = make_history(fixture, make_id(target_type, size), system_id, size)
+
+            with serving_fixtures(version_ids, versions):
+                if "build" in selected:
+                    results.append(run_operation("create_prov_document", params, build, 1, args))
+                doc = build()
+
+                if "assemble_xml" in selected:
+                    # the first call renders and caches the fragments, so the measured calls only assemble them.
+                    assemble = lambda: prov_fragments.build_prov_xml(classifications[target_type])
+                    assemble()
+                    results.append(run_operation("assemble_xml", params, assemble, 1, args))
+
+            if "serialize_xml" in selected:
+                results.append(run_operation("serialize_xml", params, lambda: prov_generation.serialize_prov_document(doc), 1, args))
+
+            if scone_serializer is not None:
+                # the input of `map_namespaces` is the PROV-XML produced by the replacement serializer, before its namespaces are mapped.
+                xml_root = scone_serializer.ProvXMLSerializer(doc).serialize_bundle(bundle = doc)
+                xml_document = etree.tostring(xml_root).decode("utf-8")
+                prefix_to_url = {namespace.prefix: namespace.uri for namespace in [scone_serializer.XSD, scone_serializer.PROV, scone_serializer.XSI] + list(doc.get_registered_namespaces())}
+                results.append(run_operation("map_namespaces", params, lambda: scone_serializer.map_namespaces(xml_document, prefix_to_url), 1, args))
+
+    return {
+        "benchmark": "micro",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor()
+        },
+        "settings": vars(args),
+        "results": results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Microbenchmarks of the CPU hot paths of the PROV service.")
+    parser.add_argument("--operations", default = "classify_uri,is_version_id,build,serialize_xml,assemble_xml,map_namespaces", help = "comma-separated operations to measure")
+    parser.add_argument("--targets", default = "EHR_STATUS,COMPOSITION,patient", help = "comma-separated target types")
+    parser.add_argument("--sizes", default = "1,10,100,1000,10000", help = "comma-separated numbers of versions")
+    parser.add_argument("--corpus-size", type = int, default = 100, help = "number of identifiers used to make the URI and ID corpora")
+    parser.add_argument("--min-time", type = float, default = 1.0, help = "minimum measuring time of each operation, in seconds")
+    parser.add_argument("--repeats", type = int, default = 5, help = "number of timed repeats of each operation")
+    parser.add_argument("--output", default = None, help = "path of the JSON results file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def read_cpu_seconds(pid : int) -> float:
+    """
+    Reads the CPU time (user + system) consumed so far by a process, in seconds (Linux only).
+    """
+
+    with open(f"/proc/{pid}/stat") as stat_file:
+        # the command name may contain spaces, so the fields are counted after its closing parenthesis.
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+    user_ticks = int(fields[11])
+    system_ticks = int(fields[12])
+    return (user_ticks + system_ticks) / CLOCK_TICKS
+
+def read_rss_bytes(pid : int) -> int:
+    """
+    Reads the resident set size of a process, in bytes (Linux only).
+    """
+
+    with open(f"/proc/{pid}/statm") as statm_file:
+        return int(statm_file.read().split()[1]) * PAGE_SIZE
+
+class ProcessMonitor:
+    """
+    Samples the CPU usage and the resident memory of a process in a background thread.
+
+    Usage:
+    ```python
+    with ProcessMonitor(pid) as monitor:
+        ...
+    print(monitor.get_report())
+    ```
+    """
+
+    def __init__(self, pid : int, interval : float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self._rss_samples = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._start_cpu_seconds = None
+        self._end_time = None
+        self._end_cpu_seconds = None
+
+    def __enter__(self):
+        self._start_time = time.monotonic()
+        self._start_cpu_seconds = read_cpu_seconds(self.pid)
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._thread.join()
+        self._end_time = time.monotonic()
+        self._end_cpu_seconds = read_cpu_seconds(self.pid)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._rss_samples.append(read_rss_bytes(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def get_report(self) -> dict:
+        """
+        Gets the average CPU usage (100% = one core) and the mean and peak resident memory during the monitored period.
+        """
+
+        elapsed = self._end_time - self._start_time
+        cpu_seconds = self._end_cpu_seconds - self._start_cpu_seconds
+        return {
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": 100.0 * cpu_seconds / elapsed if elapsed > 0 else None,
+            "rss_mean_bytes": sum(self._rss_samples) / len(self._rss_samples) if len(self._rss_samples) > 0 else None,
+            "rss_max_bytes": max(self._rss_samples) if len(self._rss_samples) > 0 else None
+        }
@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+# root folder of the repository.
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_UPSTREAM_ENV_FILE = os.path.join(ROOT_FOLDER, "fake_upstream", ".env.fake_upstream")
+FAKE_UPSTREAM_CONFIG_FILE = os.path.join(ROOT_FOLDER, "fake_upstream", "config.json")
+
+def read_env_file(path : str) -> dict:
+    """
+    Reads a `.env` file (`KEY=VALUE` lines, `#` comments).
+    """
+
+    variables = {}
+    with open(path) as env_file:
+        for line in env_file:
+            line = line.split("#", 1)[0].strip()
+            if "=" in line:
+                key, value = line.split("=", 1)
+                variables[key.strip()] = value.strip()
+    return variables
+
+def wait_until_listening(url : str, timeout : float = 30.0):
+    """
+    Waits until an HTTP server answers at the given URL (with any status).
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url, timeout = 1.0)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+class LocalServices:
+    """
+    Starts the stand-in upstream and the PROV service as local processes, and stops them on exit.
+
+    Usage:
+    ```python
+    with LocalServices() as services:
+        ... services.service_url, services.service_pid ...
+    ```
+    """
+
+    def __init__(self, upstream_config : str = FAKE_UPSTREAM_CONFIG_FILE, upstream_port : int = 12010, env_file : str = FAKE_UPSTREAM_ENV_FILE, extra_env : dict = None, dataset : str = None):
+        self.upstream_config = upstream_config
+        self.dataset = dataset
+        self.upstream_port = upstream_port
+        self.env = dict(os.environ)
+        self.env.update(read_env_file(env_file))
+        if extra_env is not None:
+            self.env.update(extra_env)
+
+        self.upstream_url = f"http://127.0.0.1:{upstream_port}"
+        self.service_url = f"http://127.0.0.1:{self.env['SERVER_PORT']}"
+        self.auth = (self.env["AUTH_USERNAME"], self.env["AUTH_PASSWORD"])
+        self.public_openehr_api_base_uri = self.env["PUBLIC_OPENEHR_API_BASE_URI"]
+        self.public_demographic_api_base_uri = self.env["PUBLIC_DEMOGRAPHIC_API_BASE_URI"]
+
+        self._upstream_process = None
+        self._service_process = None
+
+    @property
+    def service_pid(self) -> int:
+        return self._service_process.pid
+
+    def __enter__(self):
+        upstream_command = [sys.executable, "-m", "fake_upstream.server", "--config", self.upstream_config, "--port", str(self.upstream_port)]
+        if self.dataset is not None:
+            upstream_command += ["--dataset", os.path.abspath(self.dataset)]
+        self._upstream_process = subprocess.Popen(
+            upstream_command,
+            cwd = ROOT_FOLDER
+        )
+        self._service_process = subprocess.Popen(
+            [sys.executable, "app.py"],
+            cwd = ROOT_FOLDER,
+            env = self.env,
+            stderr = subprocess.DEVNULL
+        )
+
+        try:
+            wait_until_listening(self.upstream_url)
+            wait_until_listening(self.service_url)
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in [self._service_process, self._upstream_process]:
+            if process is not None:
+                process.terminate()
+                process.wait()
@@ -0,0 +1,35 @@
+import math
+
+def percentile(sorted_values : list, p : float) -> float:
+    """
+    Computes a percentile of a sorted list of values with the nearest-rank method.
+
+    Parameters:
+        sorted_values - the values, in ascending order.
+        p - the percentile, between 0 and 100.
+
+    Returns:
+        The percentile, or `None` if there are no values.
+    """
+
+    if len(sorted_values) == 0:
+        return None
+
+    rank = math.ceil(p / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def summarize_latencies(latencies : list) -> dict:
+    """
+    Summarizes a list of latencies (in seconds).
+    """
+
+    sorted_latencies = sorted(latencies)
+    return {
+        "count": len(sorted_latencies),
+        "mean": sum(sorted_latencies) / len(sorted_latencies) if len(sorted_latencies) > 0 else None,
+        "p50": percentile(sorted_latencies, 50),
+        "p90": percentile(sorted_latencies, 90),
+        "p99": percentile(sorted_latencies, 99),
+        "p999": percentile(sorted_latencies, 99.9),
+        "max": sorted_latencies[-1] if len(sorted_latencies) > 0 else None
+    }
@@ -0,0 +1,155 @@
+"""
+Benchmark of the upstream transports: many concurrent version GETs sent by `UpstreamClient` over HTTP/1.1 (`requests`)
+and over HTTP/2 (`httpx`), against the stand-in upstream served over HTTPS with `hypercorn` (`--http2`).
+
+For each transport and concurrency level, it reports the throughput, the latency percentiles and the number of TLS
+handshakes, i.e. of connections established to the stand-in upstream.
+
+Usage (from the root folder of the repository):
+```bash
+python -m benchmark.transport --concurrency 10,50,200 --requests 2000 --output transport_results.json
+```
+"""
+
+import os
+
+# the connections are counted with the TLS handshake metrics, so the metrics are enabled unless configured otherwise.
+# the settings are read when the service modules are imported, so they must be set before.
+os.environ.setdefault("INCLUDE_METRICS", "yes")
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import requests
+import urllib3
+
+from benchmark.services import ROOT_FOLDER, FAKE_UPSTREAM_CONFIG_FILE, FAKE_UPSTREAM_ENV_FILE, read_env_file
+from benchmark.statistics import summarize_latencies
+from data_layer.metrics import UPSTREAM_TLS_HANDSHAKES, UPSTREAM_HTTP_VERSIONS
+from data_layer.upstream_client import UpstreamClient
+
+TRANSPORTS = {
+    "http1": False,
+    "http2": True
+}
+
+def wait_until_listening(url : str, timeout : float = 30.0):
+    """
+    Waits until the stand-in upstream answers over HTTPS (its certificate is self-signed, so it is not verified).
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url, timeout = 1.0, verify = False)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def get_version_paths(upstream_url : str, count : int) -> list:
+    """
+    Gets the paths (relative to the openEHR API) of the versions of the EHR_STATUS objects of the stand-in upstream,
+    longest histories first, repeated until there are `count` of them.
+    """
+
+    catalog = requests.get(f"{upstream_url}/catalog", verify = False).json()
+    ehr_statuses = sorted([entry for entry in catalog if entry["type"] == "EHR_STATUS"], key = lambda entry: -entry["versions"])
+
+    paths = []
+    for entry in ehr_statuses:
+        ehr_id = entry["ehr_id"]
+        revision_history = requests.get(f"{upstream_url}/openehr/v1/ehr/{ehr_id}/versioned_ehr_status/revision_history", verify = False).json()
+        for item in revision_history:
+            paths.append(f"/v1/ehr/{ehr_id}/versioned_ehr_status/version/{item['version_id']['value']}")
+        if len(paths) >= count:
+            break
+
+    return [paths[i % len(paths)] for i in range(count)]
+
+def run_scenario(name : str, use_http2 : bool, base_uri : str, env : dict, paths : list, concurrency : int) -> dict:
+    # each scenario has its own client (and metric labels), so that its connections are established from scratch.
+    client = UpstreamClient(
+        name = name,
+        base_uris = [base_uri],
+        username = env["OPENEHR_API_AUTH_USERNAME"],
+        password = env["OPENEHR_API_AUTH_PASSWORD"],
+        validate_certificate = False,
+        use_custom_certificate = False,
+        certificate_file_name = "openehr_api_ca_certificate.pem",
+        use_http2 = use_http2
+    )
+
+    def send(path : str) -> tuple:
+        start_time = time.perf_counter()
+        try:
+            response = client.get(path)
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        return time.perf_counter() - start_time, ok
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        outcomes = list(executor.map(send, paths))
+    duration = time.perf_counter() - start_time
+
+    latencies = [latency for latency, ok in outcomes if ok]
+    errors = len(outcomes) - len(latencies)
+    result = {
+        "transport": name.split("-")[0],
+        "concurrency": concurrency,
+        "requests": len(paths),
+        "errors": errors,
+        "throughput": len(latencies) / duration,
+        "latency": summarize_latencies(latencies),
+        "tls_handshakes": sum(UPSTREAM_TLS_HANDSHAKES.labels(name, resumed).get() for resumed in ["yes", "no"]),
+        "http_versions": {version: UPSTREAM_HTTP_VERSIONS.labels(name, version).get() for version in ["HTTP/1.1", "HTTP/2"]}
+    }
+    print(f"{result['transport']:6} concurrency {concurrency:4}: {result['throughput']:8.1f} req/s, "
+        f"p50 {result['latency']['p50'] * 1000:7.1f} ms, p99 {result['latency']['p99'] * 1000:7.1f} ms, "
+        f"{result['tls_handshakes']:4} TLS handshakes, {errors} errors")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark of the HTTP/1.1 and HTTP/2 upstream transports.")
+    parser.add_argument("--upstream-config", default = FAKE_UPSTREAM_CONFIG_FILE, help = "configuration file of the stand-in upstream")
+    parser.add_argument("--upstream-port", type = int, default = 12443)
+    parser.add_argument("--transports", default = "http1,http2", help = "comma-separated transports (http1, http2)")
+    parser.add_argument("--concurrency", default = "10,50,200", help = "comma-separated numbers of concurrent requests")
+    parser.add_argument("--requests", type = int, default = 2000, help = "number of version GETs of each scenario")
+    parser.add_argument("--output", default = None, help = "path of the JSON results file")
+    args = parser.parse_args()
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    env = read_env_file(FAKE_UPSTREAM_ENV_FILE)
+    upstream_url = f"https://127.0.0.1:{args.upstream_port}"
+
+    upstream = subprocess.Popen(
+        [sys.executable, "-m", "fake_upstream.server", "--config", args.upstream_config, "--port", str(args.upstream_port), "--http2"],
+        cwd = ROOT_FOLDER, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL
+    )
+    try:
+        wait_until_listening(f"{upstream_url}/catalog")
+        paths = get_version_paths(upstream_url, args.requests)
+
+        results = []
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            for transport in args.transports.split(","):
+                results.append(run_scenario(f"{transport}-{concurrency}", TRANSPORTS[transport], f"{upstream_url}/openehr", env, paths, concurrency))
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump({ "platform": platform.platform(), "results": results }, output_file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from app_settings import MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, MAX_QUEUE_WAIT_SECONDS
+from business_layer.metrics import PROV_ADMISSION_QUEUE_DEPTH, PROV_ADMISSION_WAIT, PROV_REQUESTS_SHED
+
+# reasons for shedding a request.
+QUEUE_FULL_REASON = "queue_full"
+WAIT_TIMEOUT_REASON = "wait_timeout"
+
+class AdmissionController:
+    """
+    Limits the number of requests processed at the same time.
+
+    A request which arrives when the limit is reached waits in a bounded queue for a short time; if the queue is full or
+    the wait times out, the request is shed, so that the caller can be answered immediately instead of waiting behind
+    requests which will time out anyway.
+    """
+
+    def __init__(self, max_concurrent : int, max_queued : int, max_wait : float):
+        """
+        Parameters:
+            max_concurrent - the maximum number of requests processed at the same time.
+            max_queued - the maximum number of requests waiting to be processed.
+            max_wait - the maximum time (in seconds) that a request waits to be processed.
+        """
+
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+
+    def try_acquire(self) -> bool:
+        """
+        Admits a request, waiting for a slot if needed.
+
+        Returns:
+            Whether the request has been admitted; if it has, `release` must be called once it has been processed.
+        """
+
+        with self._condition:
+            if self._in_flight < self.max_concurrent:
+                self._in_flight += 1
+                PROV_ADMISSION_WAIT.labels().observe(0.0)
+                return True
+
+            if self._queued >= self.max_queued:
+                PROV_REQUESTS_SHED.labels(QUEUE_FULL_REASON).inc()
+                return False
+
+            start_time = time.perf_counter()
+            self._queued += 1
+            PROV_ADMISSION_QUEUE_DEPTH.labels().set(self._queued)
+            try:
+                admitted = self._condition.wait_for(lambda: self._in_flight < self.max_concurrent, timeout = self.max_wait)
+            finally:
+                self._queued -= 1
+                PROV_ADMISSION_QUEUE_DEPTH.labels().set(self._queued)
+
+            if not admitted:
+                PROV_REQUESTS_SHED.labels(WAIT_TIMEOUT_REASON).inc()
+                return False
+
+            self._in_flight += 1
+            PROV_ADMISSION_WAIT.labels().observe(time.perf_counter() - start_time)
+            return True
+
+    def release(self):
+        """
+        Releases the slot of a processed request.
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+class NotAdmissionController:
+    """
+    A class which provided the same API as the AdmissionController class, but admits every request.
+    """
+
+    def try_acquire(self) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+if MAX_CONCURRENT_REQUESTS > 0:
+    admission_controller = AdmissionController(MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, MAX_QUEUE_WAIT_SECONDS)
+else:
+    admission_controller = NotAdmissionController()
@@ -0,0 +1,93 @@
+import zlib
+
+from app_settings import RESPONSE_GZIP_LEVEL, RESPONSE_ZSTD_LEVEL
+
+# zstd is optional: it needs the `zstandard` package (`pip install zstandard`).
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the content codings, as named in the `Accept-Encoding` and `Content-Encoding` headers.
+IDENTITY_ENCODING = "identity"
+GZIP_ENCODING = "gzip"
+ZSTD_ENCODING = "zstd"
+
+# the size of the chunks of the responses which are compressed.
+CHUNK_SIZE = 64 * 1024
+
+def get_available_encodings() -> list:
+    """
+    Lists the content codings which can be applied, most preferred first: zstd compresses PROV-XML about as well as gzip
+    in a fraction of the time.
+    """
+
+    if zstandard is not None:
+        return [ZSTD_ENCODING, GZIP_ENCODING]
+    return [GZIP_ENCODING]
+
+def negotiate_encoding(accept_encodings, encodings : list) -> str:
+    """
+    Chooses the content coding of a response.
+
+    Parameters:
+        accept_encodings - the parsed `Accept-Encoding` header of the request (`request.accept_encodings`).
+        encodings - the content codings which can be applied, most preferred first.
+
+    Returns:
+        The content coding with the highest quality for the client (the most preferred one among equals), or
+        `IDENTITY_ENCODING` if the client accepts none of them with a higher quality than the uncompressed content.
+    """
+
+    best_encoding = IDENTITY_ENCODING
+    best_quality = accept_encodings[IDENTITY_ENCODING]
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+def make_compressor(encoding : str):
+    """
+    Makes an object which compresses a stream with a content coding, chunk by chunk, with the `compress` and `flush`
+    methods of the `zlib` compression objects.
+    """
+
+    if encoding == GZIP_ENCODING:
+        # the window size of 16 + 15 bits makes `zlib` write the gzip header and trailer.
+        return zlib.compressobj(RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == ZSTD_ENCODING and zstandard is not None:
+        return zstandard.ZstdCompressor(level = RESPONSE_ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported content coding: {encoding}.")
+
+def compress_chunks(chunks, encoding : str):
+    """
+    Compresses a stream with a content coding, chunk by chunk, so that the compressed chunks can be sent while the next
+    ones are being compressed.
+
+    Parameters:
+        chunks - an iterable of `bytes`.
+        encoding - the content coding.
+
+    Returns:
+        A generator of the compressed chunks (without empty chunks).
+    """
+
+    compressor = make_compressor(encoding)
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    compressed_chunk = compressor.flush()
+    if compressed_chunk:
+        yield compressed_chunk
+
+def split_chunks(content : bytes):
+    """
+    Splits a content in chunks of `CHUNK_SIZE` bytes, without copying it.
+    """
+
+    view = memoryview(content)
+    for start in range(0, len(content), CHUNK_SIZE):
+        yield view[start:start + CHUNK_SIZE]
@@ -6,3 +6,9 @@ class InternalException(Exception):
 
 class NoSuchVersionedObjectException(Exception):
     pass
+
+class DeadlineExceededException(Exception):
+    pass
+
+class RequestCancelledException(Exception):
+    pass
@@ -0,0 +1,317 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from app_settings import DOCUMENT_STORE_FOLDER, DOCUMENT_STORE_MAX_BYTES, DOCUMENT_STORE_MIN_DOCUMENT_BYTES, DOCUMENT_STORE_GZIP
+from business_layer import compression, prov_formats
+from business_layer.metrics import PROV_DOCUMENT_STORE_LOOKUPS, PROV_DOCUMENT_STORE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# outcomes of the document lookups.
+HIT_OUTCOME = "hit"
+MISS_OUTCOME = "miss"
+
+# the extensions of the stored files: the document, by media type, and its copies with each content coding, which are
+# appended to the extension of the document.
+DOCUMENT_EXTENSIONS = {media_type: f".{name}" for media_type, name in prov_formats.FORMAT_NAMES.items()}
+VARIANT_EXTENSIONS = {
+    compression.GZIP_ENCODING: ".gz",
+    compression.ZSTD_ENCODING: ".zst"
+}
+# the extension of the files being written, which are renamed once complete.
+TEMPORARY_EXTENSION = ".tmp"
+# the age (in seconds) after which a temporary file is considered left behind by a process which stopped while writing it,
+# rather than being written by another process.
+STALE_TEMPORARY_FILE_SECONDS = 600
+
+def make_target_key(classification : dict) -> str:
+    """
+    Makes the key of the versioned object of a classified target, which is the same for all the URIs of the object.
+    """
+
+    classification_type = classification["type"]
+    if classification_type == "EHR_STATUS":
+        return f"EHR_STATUS/{classification['ehr_id']}"
+    elif classification_type == "COMPOSITION":
+        return f"COMPOSITION/{classification['ehr_id']}/{classification['composition_id']}"
+    elif classification_type == "patient":
+        return f"patient/{classification['patient_id']}"
+    raise ValueError(f"The URL class '{ classification_type }' is not supported!")
+
+def make_document_key(target_key : str, latest_version_id : str, media_type : str) -> str:
+    """
+    Makes the key of the document of a versioned object in a representation: the versions are never changed once
+    committed, so the document only changes when a new version is committed.
+    """
+
+    return hashlib.blake2b(f"{target_key}\n{latest_version_id}\n{media_type}".encode("utf-8"), digest_size = 16).hexdigest()
+
+class StoredDocument:
+    """
+    A rendered document in the document store.
+    """
+
+    def __init__(self, key : str, path : str, media_type : str, variant_paths : dict):
+        """
+        Parameters:
+            key - the key of the document (see `make_document_key`).
+            path - the path of the file.
+            media_type - the media type of the document (see `prov_formats`).
+            variant_paths - the paths of its stored copies, by content coding.
+        """
+
+        self.key = key
+        self.path = path
+        self.media_type = media_type
+        self.variant_paths = variant_paths
+
+class DocumentStore:
+    """
+    Stores the largest rendered documents in a folder, so that they are served from disk (with the
+    `sendfile` system call when the WSGI server supports it) instead of being built again.
+
+    The files are named after the key of their document (see `make_document_key`), so any file of the folder is current,
+    including those written by other processes. The copies of the documents with a content coding (e.g. gzip) are
+    stored next to them, either when the document is stored or the first time that they are requested. The least
+    recently used files are removed once the total size of the files exceeds the maximum size. Each process only knows
+    the sizes of the files that were in the folder when it started and of those that it has used since, so with several
+    processes the maximum size is approximate.
+    """
+
+    def __init__(self, folder : str, max_bytes : int, min_document_bytes : int, store_gzip : bool):
+        """
+        Parameters:
+            folder - the folder of the files, which is created if needed.
+            max_bytes - the maximum total size of the files.
+            min_document_bytes - the minimum size of a document to be stored; smaller documents are cheap to build.
+            store_gzip - whether a gzip-encoded copy of each document is stored with it.
+        """
+
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.min_document_bytes = min_document_bytes
+        self.store_gzip = store_gzip
+
+        self._lock = threading.Lock()
+        # the sizes of the files of each document, least recently used first.
+        self._sizes = OrderedDict()
+        self._total_bytes = 0
+        # the key of the latest stored document of each versioned object in each representation.
+        self._latest_keys = {}
+
+        os.makedirs(folder, exist_ok = True)
+        self._load()
+
+    def _load(self):
+        """
+        Indexes the files which are already in the folder, oldest first, and removes the stale temporary files.
+        """
+
+        files = []
+        for entry in os.scandir(self.folder):
+            extension = os.path.splitext(entry.name)[1]
+            if entry.is_file() and extension == TEMPORARY_EXTENSION:
+                self._remove_stale_temporary_file(entry)
+            elif entry.is_file() and extension in DOCUMENT_EXTENSIONS.values():
+                stat = entry.stat()
+                variants_size = sum(self._get_file_size(path) for path in self._get_variant_paths(entry.path).values())
+                files.append((stat.st_mtime, entry.name[:-len(extension)], stat.st_size + variants_size))
+
+        for _, key, size in sorted(files):
+            self._sizes[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _remove_stale_temporary_file(self, entry : os.DirEntry):
+        try:
+            if time.time() - entry.stat().st_mtime > STALE_TEMPORARY_FILE_SECONDS:
+                os.unlink(entry.path)
+                logger.info(f"Removed the stale temporary file {entry.path} from the document store.")
+        except FileNotFoundError:
+            pass
+
+    def _get_path(self, key : str, extension : str) -> str:
+        return os.path.join(self.folder, key + extension)
+
+    def _get_variant_paths(self, path : str) -> dict:
+        """
+        Gets the paths of the copies of a stored document which exist, by content coding.
+        """
+
+        variant_paths = {}
+        for encoding, extension in VARIANT_EXTENSIONS.items():
+            if os.path.exists(path + extension):
+                variant_paths[encoding] = path + extension
+        return variant_paths
+
+    def _get_file_size(self, path : str) -> int:
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def has_document(self, target_key : str, media_type : str) -> bool:
+        """
+        Tells whether the latest known document of a versioned object in a representation is stored. The versioned object
+        might have new versions since, so this is only a hint.
+        """
+
+        with self._lock:
+            key = self._latest_keys.get((target_key, media_type), None)
+            return key is not None and key in self._sizes
+
+    def get(self, target_key : str, latest_version_id : str, media_type : str) -> StoredDocument:
+        """
+        Gets the stored document of a versioned object in a representation.
+
+        Returns:
+            The stored document, or `None` if it is not stored.
+        """
+
+        key = make_document_key(target_key, latest_version_id, media_type)
+        path = self._get_path(key, DOCUMENT_EXTENSIONS[media_type])
+        if not os.path.exists(path):
+            # the file might have been evicted by another process.
+            self._forget(key)
+            PROV_DOCUMENT_STORE_LOOKUPS.labels(MISS_OUTCOME).inc()
+            return None
+
+        variant_paths = self._get_variant_paths(path)
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+            else:
+                size = self._get_file_size(path) + sum(self._get_file_size(variant_path) for variant_path in variant_paths.values())
+                self._sizes[key] = size
+                self._total_bytes += size
+            self._latest_keys[(target_key, media_type)] = key
+        PROV_DOCUMENT_STORE_LOOKUPS.labels(HIT_OUTCOME).inc()
+        return StoredDocument(key, path, media_type, variant_paths)
+
+    def put(self, target_key : str, latest_version_id : str, media_type : str, content : bytes) -> StoredDocument:
+        """
+        Stores the document of a versioned object in a representation, if it is large enough.
+
+        Parameters:
+            target_key - the key of the versioned object (see `make_target_key`).
+            latest_version_id - the ID of the latest version of the object, which is the last one in the document.
+            media_type - the media type of the document (see `prov_formats`).
+            content - the complete document.
+
+        Returns:
+            The stored document, or `None` if it is too small to be stored or could not be written.
+        """
+
+        if len(content) < self.min_document_bytes:
+            return None
+
+        key = make_document_key(target_key, latest_version_id, media_type)
+        path = self._get_path(key, DOCUMENT_EXTENSIONS[media_type])
+        variant_paths = {}
+        try:
+            size = 0
+            # the copy is written first, so that it exists whenever the document exists.
+            if self.store_gzip:
+                variant_paths[compression.GZIP_ENCODING] = path + VARIANT_EXTENSIONS[compression.GZIP_ENCODING]
+                size += self._write_file(variant_paths[compression.GZIP_ENCODING], compression.compress_chunks(compression.split_chunks(content), compression.GZIP_ENCODING))
+            size += self._write_file(path, [content])
+        except OSError:
+            logger.exception(f"Could not store the document of {target_key}.")
+            return None
+
+        with self._lock:
+            self._total_bytes += size - self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            self._latest_keys[(target_key, media_type)] = key
+            self._evict()
+        return StoredDocument(key, path, media_type, variant_paths)
+
+    def get_variant_path(self, stored_document : StoredDocument, encoding : str) -> str:
+        """
+        Gets the path of the copy of a stored document with a content coding, compressing the document (chunk by chunk,
+        from its file) and storing the copy if it is not stored yet.
+
+        Returns:
+            The path of the copy, or `None` if it could not be written.
+        """
+
+        variant_path = stored_document.variant_paths.get(encoding, None)
+        if variant_path is not None and os.path.exists(variant_path):
+            return variant_path
+
+        variant_path = stored_document.path + VARIANT_EXTENSIONS[encoding]
+        try:
+            with open(stored_document.path, "rb") as document_file:
+                chunks = iter(lambda: document_file.read(compression.CHUNK_SIZE), b"")
+                size = self._write_file(variant_path, compression.compress_chunks(chunks, encoding))
+        except OSError:
+            logger.exception(f"Could not store the {encoding} copy of the document {stored_document.key}.")
+            return None
+
+        stored_document.variant_paths[encoding] = variant_path
+        with self._lock:
+            if stored_document.key in self._sizes:
+                self._sizes[stored_document.key] += size
+                self._total_bytes += size
+                self._evict()
+        return variant_path
+
+    def _write_file(self, path : str, chunks) -> int:
+        # the file is renamed once written, so that it is never read partially written.
+        descriptor, temporary_path = tempfile.mkstemp(dir = self.folder, suffix = TEMPORARY_EXTENSION)
+        size = 0
+        try:
+            with os.fdopen(descriptor, "wb") as temporary_file:
+                for chunk in chunks:
+                    size += temporary_file.write(chunk)
+            os.replace(temporary_path, path)
+        except OSError:
+            os.unlink(temporary_path)
+            raise
+        return size
+
+    def _forget(self, key : str):
+        with self._lock:
+            self._total_bytes -= self._sizes.pop(key, 0)
+            PROV_DOCUMENT_STORE_BYTES.labels().set(self._total_bytes)
+
+    def _evict(self):
+        # must be called with the lock held.
+        while self._total_bytes > self.max_bytes and len(self._sizes) > 0:
+            key, size = self._sizes.popitem(last = False)
+            self._total_bytes -= size
+            # the files being served are still readable once unlinked.
+            for document_extension in DOCUMENT_EXTENSIONS.values():
+                for extension in ["", *VARIANT_EXTENSIONS.values()]:
+                    try:
+                        os.unlink(self._get_path(key, document_extension + extension))
+                    except FileNotFoundError:
+                        pass
+        PROV_DOCUMENT_STORE_BYTES.labels().set(self._total_bytes)
+
+class NotDocumentStore:
+    """
+    A class which provided the same API as the DocumentStore class, but does not store any document.
+    """
+
+    def has_document(self, target_key : str, media_type : str) -> bool:
+        return False
+
+    def get(self, target_key : str, latest_version_id : str, media_type : str) -> StoredDocument:
+        return None
+
+    def put(self, target_key : str, latest_version_id : str, media_type : str, content : bytes) -> StoredDocument:
+        return None
+
+    def get_variant_path(self, stored_document : StoredDocument, encoding : str) -> str:
+        return None
+
+if DOCUMENT_STORE_FOLDER:
+    stored_documents = DocumentStore(DOCUMENT_STORE_FOLDER, DOCUMENT_STORE_MAX_BYTES, DOCUMENT_STORE_MIN_DOCUMENT_BYTES, DOCUMENT_STORE_GZIP)
+else:
+    stored_documents = NotDocumentStore()
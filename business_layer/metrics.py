@@ -0,0 +1,28 @@
+from data_layer.metrics import registry
+
+# provenance requests
+PROV_REQUESTS = registry.counter("prov_requests", "Provenance requests by target type and HTTP status.", ["target_type", "status"])
+PROV_REQUEST_DURATION = registry.histogram("prov_request_duration_seconds", "Duration of provenance requests by target type.", ["target_type"])
+PROV_REQUESTS_IN_FLIGHT = registry.gauge("prov_requests_in_flight", "Provenance requests currently being processed.")
+
+# admission control of provenance requests
+PROV_ADMISSION_QUEUE_DEPTH = registry.gauge("prov_admission_queue_depth", "Provenance requests waiting to be admitted.")
+PROV_ADMISSION_WAIT = registry.histogram("prov_admission_wait_seconds", "Time waited by the admitted provenance requests before being processed.")
+PROV_REQUESTS_SHED = registry.counter("prov_requests_shed", "Provenance requests rejected by the admission control by reason (queue_full or wait_timeout).", ["reason"])
+
+# shadow execution of candidate provenance engines
+RATIO_BUCKETS = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 4.0, 10.0]
+SHADOW_RUNS = registry.counter("prov_shadow_runs", "Shadow runs of a candidate engine by engine and outcome (match, mismatch or error).", ["engine", "outcome"])
+SHADOW_DROPPED = registry.counter("prov_shadow_dropped", "Sampled requests not shadowed because too many shadow runs were pending.", ["engine"])
+SHADOW_LATENCY_RATIO = registry.histogram("prov_shadow_latency_ratio", "CPU time of a candidate engine relative to the current engine, on the same fetched versions.", ["engine"], buckets = RATIO_BUCKETS)
+SHADOW_MEMORY_RATIO = registry.histogram("prov_shadow_memory_ratio", "Peak memory of a candidate engine relative to the current engine, on the same fetched versions.", ["engine"], buckets = RATIO_BUCKETS)
+
+# PROV fragment cache
+PROV_FRAGMENT_LOOKUPS = registry.counter("prov_fragment_lookups", "Lookups of the PROV-XML fragments of versions by outcome (hit or miss).", ["outcome"])
+
+# on-disk document store
+PROV_DOCUMENT_STORE_LOOKUPS = registry.counter("prov_document_store_lookups", "Lookups of the rendered documents in the on-disk document store by outcome (hit or miss).", ["outcome"])
+PROV_DOCUMENT_STORE_BYTES = registry.gauge("prov_document_store_bytes", "Total size of the files of the on-disk document store known to this process.")
+
+# target type used when the target URI could not be classified.
+UNKNOWN_TARGET_TYPE = "unknown"
@@ -0,0 +1,4 @@
+from business_layer.metrics import registry
+
+def get_metrics() -> str:
+    return registry.render()
@@ -1,42 +1,190 @@
-import prov.model
+from collections import OrderedDict
+import hashlib
+import threading
 
-from data_layer import api_exceptions, classifier
+from app_settings import REVISION_HISTORY_CACHE_SIZE
+from data_layer import api_exceptions, classifier, openehr_api, demographic_api
+from data_layer.deadlines import deadlines
+from data_layer.timing import request_timed
 
-from business_layer import prov_generation, controller_exceptions
+from business_layer import prov_engines, prov_formats, controller_exceptions
+from business_layer.document_store import stored_documents, make_target_key
+from business_layer.shadow import shadow_executor
+
+def make_etag(version_ids : list, media_type : str = prov_formats.XML_MEDIA_TYPE) -> str:
+    """
+    Makes the entity tag of the provenance of a versioned object in a representation, which only depends on its versions
+    and, except for PROV-XML, is suffixed with the name of the representation.
+    """
+
+    etag = hashlib.blake2b("\n".join(version_ids).encode("utf-8"), digest_size = 16).hexdigest()
+    if media_type == prov_formats.XML_MEDIA_TYPE:
+        return etag
+    return f"{etag}-{prov_formats.FORMAT_NAMES[media_type]}"
+
+class LatestEntityTags:
+    """
+    Remembers the latest entity tag of the provenance of each versioned object in each representation (least recently
+    used first out), so that the conditional requests which will probably get a 304 (Not Modified) response are
+    recognized before the versions are fetched.
+    """
+
+    def __init__(self, max_entries : int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, target_key : str, media_type : str) -> str:
+        with self._lock:
+            return self._entries.get((target_key, media_type), None)
+
+    def put(self, target_key : str, media_type : str, etag : str):
+        with self._lock:
+            self._entries[(target_key, media_type)] = etag
+            self._entries.move_to_end((target_key, media_type))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+latest_etags = LatestEntityTags(REVISION_HISTORY_CACHE_SIZE)
+
+def render_provenance(classification : dict, version_ids : list, media_type : str) -> bytes:
+    """
+    Renders the provenance of a classified target in a representation: PROV-XML with the current engine (see
+    `prov_engines`), and the other representations directly from the versions (see `prov_formats`).
+
+    A complete PROV-XML rendering is also handed to the shadow executor (see `shadow`), which compares it with the output
+    of the candidate engine.
+    """
+
+    if media_type == prov_formats.XML_MEDIA_TYPE:
+        xml = prov_engines.ENGINES[prov_engines.CURRENT_ENGINE](classification, version_ids)
+        if not deadlines.is_truncated():
+            shadow_executor.submit(classification, version_ids, xml)
+        return xml.encode("ascii")
+    return prov_formats.WRITERS[media_type](classification, version_ids)
+
+def get_provenance(uri : str, is_known_etag = None, media_type : str = prov_formats.XML_MEDIA_TYPE) -> tuple:
+    """
+    Gets the provenance of the versioned object identified by a URI, unless the client already has it.
+
+    Parameters:
+        uri - the URI of the versioned object.
+        is_known_etag - a function which tells whether the client already has the provenance with a given entity tag
+            (e.g. from the `If-None-Match` header), if any.
+        media_type - the media type of the representation of the provenance (see `prov_formats`).
+
+    Returns:
+        A tuple with the provenance and its entity tag. The provenance is a `StoredDocument` if it is served from the
+        document store, its representation (`bytes`) otherwise, and `None` if the client already has it.
+    """
 
-def get_provenance(uri : str) -> prov.model.ProvDocument:
     classification = classifier.classify_uri(uri)
     if classification is None:
         raise controller_exceptions.InvalidURIException(f"Invalid URI: {uri}.")
 
+    if is_known_etag is None:
+        is_known_etag = lambda etag: False
+
     classification_type = classification["type"]
-    if classification_type == "EHR_STATUS":
-        ehr_id = classification["ehr_id"]
-        return get_provenance_of_ehr_status(ehr_id)
-    elif classification_type == "COMPOSITION":
-        ehr_id = classification["ehr_id"]
-        composition_id = classification["composition_id"]
-        return get_provenance_of_composition(ehr_id, composition_id)
-    elif classification_type == "patient":
-        patient_id = classification["patient_id"]
-        return get_provenance_of_patient(patient_id)
+    request_timed.set_target_type(classification_type)
+
+    try:
+        if classification_type == "EHR_STATUS":
+            return get_provenance_of_ehr_status(classification, is_known_etag, media_type)
+        elif classification_type == "COMPOSITION":
+            return get_provenance_of_composition(classification, is_known_etag, media_type)
+        elif classification_type == "patient":
+            return get_provenance_of_patient(classification, is_known_etag, media_type)
+    except api_exceptions.DeadlineExceededException:
+        raise controller_exceptions.DeadlineExceededException(f"The provenance of {uri} could not be gathered before the deadline of the request!")
+    except api_exceptions.RequestCancelledException:
+        raise controller_exceptions.RequestCancelledException(f"The request for the provenance of {uri} has been cancelled!")
 
     raise controller_exceptions.InternalException(f"The URL class '{ classification_type }' is not supported!")
 
-def get_provenance_of_ehr_status(ehr_id : str) -> prov.model.ProvDocument:
+def is_stored(uri : str, media_type : str = prov_formats.XML_MEDIA_TYPE) -> bool:
+    """
+    Tells whether the provenance of the versioned object identified by a URI, in a representation, is probably served
+    from the document store.
+    """
+
+    classification = classifier.classify_uri(uri)
+    return classification is not None and stored_documents.has_document(make_target_key(classification), media_type)
+
+def is_probably_not_modified(uri : str, is_known_etag, media_type : str = prov_formats.XML_MEDIA_TYPE) -> bool:
+    """
+    Tells whether the client probably already has the provenance of the versioned object identified by a URI, in a
+    representation, i.e. whether it knows the latest entity tag of that provenance (see `get_provenance`).
+    """
+
+    classification = classifier.classify_uri(uri)
+    if classification is None:
+        return False
+
+    etag = latest_etags.get(make_target_key(classification), media_type)
+    return etag is not None and is_known_etag(etag)
+
+def build_provenance(classification : dict, version_ids : list, is_known_etag, media_type : str) -> tuple:
+    """
+    Builds the provenance of a classified target from its revision history, unless the client already has it.
+
+    The revision history of the versioned object is fetched first, so that the document is not built if the client
+    already has it.
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, from its revision history.
+        is_known_etag - a function which tells whether the client already has the provenance with a given entity tag.
+        media_type - the media type of the representation of the provenance (see `prov_formats`).
+
+    Returns:
+        A tuple with the provenance (as in `get_provenance`) and its entity tag.
+    """
+
+    request_timed.set_version_count(len(version_ids))
+
+    etag = make_etag(version_ids, media_type)
+    latest_etags.put(make_target_key(classification), media_type, etag)
+    if is_known_etag(etag):
+        return None, etag
+
+    if len(version_ids) == 0:
+        return render_provenance(classification, version_ids, media_type), etag
+
+    target_key = make_target_key(classification)
+    stored_document = stored_documents.get(target_key, version_ids[-1], media_type)
+    if stored_document is not None:
+        return stored_document, etag
+
+    content = render_provenance(classification, version_ids, media_type)
+    # the partial documents are not stored, since they lack some versions.
+    if not deadlines.is_truncated():
+        stored_document = stored_documents.put(target_key, version_ids[-1], media_type, content)
+        if stored_document is not None:
+            return stored_document, etag
+    return content, etag
+
+def get_provenance_of_ehr_status(classification : dict, is_known_etag, media_type : str) -> tuple:
+    ehr_id = classification["ehr_id"]
     try:
-        return prov_generation.create_prov_document_of_ehr_status(ehr_id)
+        version_ids = openehr_api.get_version_ids_of_ehr_status(ehr_id)
+        return build_provenance(classification, version_ids, is_known_etag, media_type)
     except api_exceptions.NotFoundException:
         raise controller_exceptions.NoSuchVersionedObjectException(f"No such EHR {ehr_id}!")
 
-def get_provenance_of_composition(ehr_id : str, composition_id : str) -> prov.model.ProvDocument:
+def get_provenance_of_composition(classification : dict, is_known_etag, media_type : str) -> tuple:
+    ehr_id = classification["ehr_id"]
+    composition_id = classification["composition_id"]
     try:
-        return prov_generation.create_prov_document_of_composition(ehr_id, composition_id)
+        version_ids = openehr_api.get_version_ids_of_composition(ehr_id, composition_id)
+        return build_provenance(classification, version_ids, is_known_etag, media_type)
     except api_exceptions.NotFoundException:
         raise controller_exceptions.NoSuchVersionedObjectException(f"No such composition {composition_id} or no such EHR {ehr_id}!")
 
-def get_provenance_of_patient(patient_id : str) -> prov.model.ProvDocument:
+def get_provenance_of_patient(classification : dict, is_known_etag, media_type : str) -> tuple:
+    patient_id = classification["patient_id"]
     try:
-        return prov_generation.create_prov_document_of_patient(patient_id)
+        version_ids = demographic_api.get_version_ids_of_patient(patient_id)
+        return build_provenance(classification, version_ids, is_known_etag, media_type)
     except api_exceptions.NotFoundException:
         raise controller_exceptions.NoSuchVersionedObjectException(f"No such patient {patient_id}!")
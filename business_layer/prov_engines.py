@@ -0,0 +1,38 @@
+from app_settings import PROV_ENGINE
+from business_layer import prov_generation, prov_fragments
+
+def build_with_prov_document(classification : dict, version_ids : list = None) -> str:
+    """
+    Builds the PROV-XML of a classified target with a `ProvDocument`, serialized by the `prov` package.
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The PROV-XML representation of the provenance of the target.
+    """
+
+    classification_type = classification["type"]
+    if classification_type == "EHR_STATUS":
+        doc = prov_generation.create_prov_document_of_ehr_status(classification["ehr_id"], version_ids)
+    elif classification_type == "COMPOSITION":
+        doc = prov_generation.create_prov_document_of_composition(classification["ehr_id"], classification["composition_id"], version_ids)
+    elif classification_type == "patient":
+        doc = prov_generation.create_prov_document_of_patient(classification["patient_id"], version_ids)
+    else:
+        raise ValueError(f"The URL class '{ classification_type }' is not supported!")
+
+    return prov_generation.serialize_prov_document(doc)
+
+# the engines which build the PROV-XML of a classified target. Each one is a function from the classification (and the
+# version IDs of the target, if already fetched) to the PROV-XML.
+ENGINES = {
+    "prov_document": build_with_prov_document,
+    "prov_fragments": prov_fragments.build_prov_xml
+}
+
+# the engine which serves the responses.
+if PROV_ENGINE not in ENGINES:
+    raise ValueError(f"Unknown provenance engine: {PROV_ENGINE}. The engines are: {', '.join(ENGINES.keys())}.")
+CURRENT_ENGINE = PROV_ENGINE
@@ -0,0 +1,297 @@
+import json
+
+from business_layer import prov_generation, prov_fragments
+from data_layer.timing import timed, request_timed
+from business_layer.timing import BUILD_STAGE, WRITE_PROV_JSON_MEASUREMENT, WRITE_MSGPACK_MEASUREMENT, WRITE_TURTLE_MEASUREMENT, WRITE_N_TRIPLES_MEASUREMENT
+
+# MessagePack is optional: it needs the `msgpack` package (`pip install msgpack`).
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# the media types of the representations of the provenance.
+XML_MEDIA_TYPE = "text/xml"
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/vnd.msgpack"
+TURTLE_MEDIA_TYPE = "text/turtle"
+N_TRIPLES_MEDIA_TYPE = "application/n-triples"
+
+# the names of the representations, used in the entity tags and in the names of the stored files.
+FORMAT_NAMES = {
+    XML_MEDIA_TYPE: "xml",
+    JSON_MEDIA_TYPE: "json",
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    TURTLE_MEDIA_TYPE: "ttl",
+    N_TRIPLES_MEDIA_TYPE: "nt"
+}
+
+def get_available_media_types() -> list:
+    """
+    Lists the media types of the representations which can be served, the default one (PROV-XML) first.
+    """
+
+    if msgpack is not None:
+        return [XML_MEDIA_TYPE, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, TURTLE_MEDIA_TYPE, N_TRIPLES_MEDIA_TYPE]
+    return [XML_MEDIA_TYPE, JSON_MEDIA_TYPE, TURTLE_MEDIA_TYPE, N_TRIPLES_MEDIA_TYPE]
+
+def make_prov_json(entity_type : str, fragments) -> dict:
+    """
+    Makes the PROV-JSON structure of a document from the fragments of its versions (see `prov_fragments.fetch_fragments`),
+    with the same records, record identifiers and order as the serialization of the same document by the `prov` package.
+
+    Parameters:
+        entity_type - the PROV type of the versions (e.g. `openehr:EHR_STATUS`).
+        fragments - an iterable of the fragments, from the oldest version to the newest.
+
+    Returns:
+        The PROV-JSON structure, with only the record types which have records.
+    """
+
+    entities = {}
+    activities = {}
+    generations = {}
+    agents = {}
+    attributions = {}
+    associations = {}
+    derivations = {}
+    usages = {}
+    relation_count = 0
+
+    for fragment in fragments:
+        version_id, contribution_id, committer_name_or_id = fragment.version_tuple
+        entity = f"openehr:{version_id}"
+        activity = f"openehr:{contribution_id}"
+
+        entities[entity] = {"prov:type": entity_type}
+        # a contribution has at most one version of each versioned object, so the activities are not repeated.
+        activities[activity] = {"prov:type": "openehr:CONTRIBUTION"}
+        relation_count += 1
+        generations[f"_:id{relation_count}"] = {"prov:entity": entity, "prov:activity": activity}
+
+        if committer_name_or_id is not None:
+            agent = f"openehr:committer_{committer_name_or_id}"
+            if agent not in agents:
+                agents[agent] = {"prov:type": "openehr:PARTY_IDENTIFIED"}
+            attributions[f"_:id{relation_count + 1}"] = {"prov:entity": entity, "prov:agent": agent}
+            associations[f"_:id{relation_count + 2}"] = {"prov:activity": activity, "prov:agent": agent}
+            relation_count += 2
+
+        if fragment.previous_version_id is not None:
+            previous_entity = f"openehr:{fragment.previous_version_id}"
+            derivations[f"_:id{relation_count + 1}"] = {"prov:generatedEntity": entity, "prov:usedEntity": previous_entity}
+            usages[f"_:id{relation_count + 2}"] = {"prov:activity": activity, "prov:entity": previous_entity}
+            relation_count += 2
+
+    document = {"prefix": {"openehr": prov_generation.OPENEHR_NAMESPACE}}
+    for name, records in [("entity", entities), ("activity", activities), ("wasGeneratedBy", generations), ("agent", agents),
+                          ("wasAttributedTo", attributions), ("wasAssociatedWith", associations),
+                          ("wasDerivedFrom", derivations), ("used", usages)]:
+        if len(records) > 0:
+            document[name] = records
+    return document
+
+# the IRIs of the RDF representations, as written by the RDF serializer of the `prov` package (with `rdflib`).
+PROV_NAMESPACE = "http://www.w3.org/ns/prov#"
+RDF_TYPE_IRI = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+XSD_STRING_IRI = "<http://www.w3.org/2001/XMLSchema#string>"
+
+# the characters which are not allowed in the IRIs of N-Triples and Turtle, which are percent-encoded. `rdflib` refuses
+# to serialize such IRIs (e.g. of a committer whose name has a space).
+IRI_ESCAPES = str.maketrans({character: f"%{ord(character):02X}" for character in '<>"{}|^`\\' + "".join(map(chr, range(0x21)))})
+
+def to_iri(identifier : str) -> str:
+    """
+    Writes the IRI of an identifier of the `openehr` namespace (e.g. the ID of a version), as in `openehr:{identifier}`.
+    """
+
+    return f"<{(prov_generation.OPENEHR_NAMESPACE + identifier).translate(IRI_ESCAPES)}>"
+
+def to_string_literal(value : str) -> str:
+    # the literals are the PROV types of the records, which need no escaping.
+    return f'"{value}"^^{XSD_STRING_IRI}'
+
+def generate_n_triples(entity_type : str, fragments):
+    """
+    Writes the N-Triples of a document from the fragments of its versions (see `prov_fragments.fetch_fragments`), version
+    by version, with the same triples as the RDF serialization of the same document by the `prov` package.
+
+    Parameters:
+        entity_type - the PROV type of the versions (e.g. `openehr:EHR_STATUS`).
+        fragments - an iterable of the fragments, from the oldest version to the newest.
+
+    Returns:
+        A generator of the triples of each version.
+    """
+
+    rdf_type = RDF_TYPE_IRI
+    entity_class = f"<{PROV_NAMESPACE}Entity>"
+    activity_class = f"<{PROV_NAMESPACE}Activity>"
+    agent_class = f"<{PROV_NAMESPACE}Agent>"
+    was_generated_by = f"<{PROV_NAMESPACE}wasGeneratedBy>"
+    was_attributed_to = f"<{PROV_NAMESPACE}wasAttributedTo>"
+    was_associated_with = f"<{PROV_NAMESPACE}wasAssociatedWith>"
+    was_derived_from = f"<{PROV_NAMESPACE}wasDerivedFrom>"
+    used = f"<{PROV_NAMESPACE}used>"
+    entity_type_literal = to_string_literal(entity_type)
+    contribution_literal = to_string_literal("openehr:CONTRIBUTION")
+    party_literal = to_string_literal("openehr:PARTY_IDENTIFIED")
+
+    agents = set()
+    for fragment in fragments:
+        version_id, contribution_id, committer_name_or_id = fragment.version_tuple
+        entity = to_iri(version_id)
+        activity = to_iri(contribution_id)
+
+        triples = (
+            f"{entity} {rdf_type} {entity_class} .\n"
+            f"{entity} {rdf_type} {entity_type_literal} .\n"
+            f"{activity} {rdf_type} {activity_class} .\n"
+            f"{activity} {rdf_type} {contribution_literal} .\n"
+            f"{entity} {was_generated_by} {activity} .\n"
+        )
+
+        if committer_name_or_id is not None:
+            agent = to_iri(f"committer_{committer_name_or_id}")
+            if committer_name_or_id not in agents:
+                agents.add(committer_name_or_id)
+                triples += f"{agent} {rdf_type} {agent_class} .\n{agent} {rdf_type} {party_literal} .\n"
+            triples += f"{entity} {was_attributed_to} {agent} .\n{activity} {was_associated_with} {agent} .\n"
+
+        if fragment.previous_version_id is not None:
+            previous_entity = to_iri(fragment.previous_version_id)
+            triples += f"{entity} {was_derived_from} {previous_entity} .\n{activity} {used} {previous_entity} .\n"
+
+        yield triples
+
+# the prefixes of the Turtle representation.
+TURTLE_HEADER = f"@prefix prov: <{PROV_NAMESPACE}> .\n@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n"
+
+def generate_turtle(entity_type : str, fragments):
+    """
+    Writes the Turtle of a document from the fragments of its versions (see `prov_fragments.fetch_fragments`), version
+    by version, with the same triples as the RDF serialization of the same document by the `prov` package. Unlike the
+    `rdflib` serializer, the triples are not grouped by subject across the versions, so nothing is kept in memory but
+    the committers already declared.
+
+    Parameters:
+        entity_type - the PROV type of the versions (e.g. `openehr:EHR_STATUS`).
+        fragments - an iterable of the fragments, from the oldest version to the newest.
+
+    Returns:
+        A generator of the prefixes, then of the statements of each version.
+    """
+
+    entity_types = f'prov:Entity, "{entity_type}"^^xsd:string'
+    agents = set()
+
+    yield TURTLE_HEADER
+    for fragment in fragments:
+        version_id, contribution_id, committer_name_or_id = fragment.version_tuple
+        entity = to_iri(version_id)
+        activity = to_iri(contribution_id)
+
+        entity_statement = f"\n{entity} a {entity_types} ;\n    prov:wasGeneratedBy {activity}"
+        activity_statement = f'\n{activity} a prov:Activity, "openehr:CONTRIBUTION"^^xsd:string'
+        agent_statement = ""
+
+        if committer_name_or_id is not None:
+            agent = to_iri(f"committer_{committer_name_or_id}")
+            if committer_name_or_id not in agents:
+                agents.add(committer_name_or_id)
+                agent_statement = f'\n{agent} a prov:Agent, "openehr:PARTY_IDENTIFIED"^^xsd:string .\n'
+            entity_statement += f" ;\n    prov:wasAttributedTo {agent}"
+            activity_statement += f" ;\n    prov:wasAssociatedWith {agent}"
+
+        if fragment.previous_version_id is not None:
+            previous_entity = to_iri(fragment.previous_version_id)
+            entity_statement += f" ;\n    prov:wasDerivedFrom {previous_entity}"
+            activity_statement += f" ;\n    prov:used {previous_entity}"
+
+        yield f"{entity_statement} .\n{activity_statement} .\n{agent_statement}"
+
+def fetch_fragments(classification : dict, version_ids : list) -> tuple:
+    """
+    Gets the PROV type of the versions of a classified target and a generator of their fragments (see
+    `prov_fragments.fetch_fragments`), fetching the IDs of the versions if needed.
+    """
+
+    if version_ids is None:
+        version_ids = prov_generation.get_version_ids(classification)
+    request_timed.set_version_count(len(version_ids))
+    return prov_generation.ENTITY_TYPES[classification["type"]], prov_fragments.fetch_fragments(classification, version_ids)
+
+def fetch_prov_json(classification : dict, version_ids : list) -> dict:
+    return make_prov_json(*fetch_fragments(classification, version_ids))
+
+@timed.measure(WRITE_PROV_JSON_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def write_prov_json(classification : dict, version_ids : list = None) -> bytes:
+    """
+    Writes the compact PROV-JSON (without whitespace) of a classified target.
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The UTF-8 encoded PROV-JSON.
+    """
+
+    return json.dumps(fetch_prov_json(classification, version_ids), separators = (",", ":"), ensure_ascii = False).encode("utf-8")
+
+@timed.measure(WRITE_MSGPACK_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def write_msgpack(classification : dict, version_ids : list = None) -> bytes:
+    """
+    Writes the PROV-JSON structure of a classified target encoded with MessagePack.
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The MessagePack encoding.
+    """
+
+    return msgpack.packb(fetch_prov_json(classification, version_ids))
+
+@timed.measure(WRITE_TURTLE_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def write_turtle(classification : dict, version_ids : list = None) -> bytes:
+    """
+    Writes the Turtle of a classified target (see `generate_turtle`).
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The UTF-8 encoded Turtle.
+    """
+
+    return "".join(generate_turtle(*fetch_fragments(classification, version_ids))).encode("utf-8")
+
+@timed.measure(WRITE_N_TRIPLES_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def write_n_triples(classification : dict, version_ids : list = None) -> bytes:
+    """
+    Writes the N-Triples of a classified target (see `generate_n_triples`).
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The UTF-8 encoded N-Triples.
+    """
+
+    return "".join(generate_n_triples(*fetch_fragments(classification, version_ids))).encode("utf-8")
+
+# the writers of the representations other than PROV-XML, which is built by the current engine (see `prov_engines`).
+WRITERS = {
+    JSON_MEDIA_TYPE: write_prov_json,
+    MSGPACK_MEDIA_TYPE: write_msgpack,
+    TURTLE_MEDIA_TYPE: write_turtle,
+    N_TRIPLES_MEDIA_TYPE: write_n_triples
+}
@@ -0,0 +1,233 @@
+from collections import OrderedDict
+import threading
+from xml.sax.saxutils import escape
+
+from app_settings import PROV_FRAGMENT_CACHE_SIZE
+from business_layer import prov_generation
+from business_layer.metrics import PROV_FRAGMENT_LOOKUPS
+from data_layer.timing import timed, request_timed
+from business_layer.timing import BUILD_STAGE, ASSEMBLE_PROV_XML_MEASUREMENT
+
+# outcomes of the fragment lookups.
+HIT_OUTCOME = "hit"
+MISS_OUTCOME = "miss"
+
+# the PROV-XML of a document, as serialized by the `prov` package.
+DOCUMENT_START = (
+    "<?xml version='1.0' encoding='ASCII'?>\n"
+    f'<prov:document xmlns:openehr="{prov_generation.OPENEHR_NAMESPACE}" xmlns:prov="http://www.w3.org/ns/prov#" '
+    'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+)
+DOCUMENT_HEADER = DOCUMENT_START + ">\n"
+DOCUMENT_FOOTER = "</prov:document>\n"
+EMPTY_DOCUMENT = DOCUMENT_START + "/>\n"
+
+# the escaping of the attribute values by `lxml`, which serializes the documents of the `prov` package.
+ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+def to_attribute(value : str) -> str:
+    """
+    Escapes a value of an XML attribute, replacing the non-ASCII characters with character references.
+    """
+
+    return escape(value, ATTRIBUTE_ENTITIES).encode("ascii", "xmlcharrefreplace").decode("ascii")
+
+def render_element(name : str, attributes : str, children : list) -> str:
+    lines = [f"  <prov:{name}{attributes}>\n"]
+    lines.extend(f"    {child}\n" for child in children)
+    lines.append(f"  </prov:{name}>\n")
+    return "".join(lines)
+
+def render_type(prov_type : str) -> str:
+    return f'<prov:type xsi:type="xsd:string">{prov_type}</prov:type>'
+
+def render_ref(name : str, identifier : str) -> str:
+    return f'<prov:{name} prov:ref="{identifier}"/>'
+
+class Fragment:
+    """
+    The pre-serialized PROV-XML records of a version, which only depend on the version and on its previous version.
+
+    The agent of the committer is declared by the first version that it committed in a document, so its element is kept
+    apart and only inserted by the assembler on its first use. The fragment also keeps the tuple of the version and the ID
+    of the previous version, from which the other formats are written (see `prov_formats`).
+    """
+
+    __slots__ = ("version_tuple", "previous_version_id", "head", "agent", "tail")
+
+    def __init__(self, version_tuple : tuple, previous_version_id : str, head : str, agent : str, tail : str):
+        self.version_tuple = version_tuple
+        self.previous_version_id = previous_version_id
+        self.head = head
+        self.agent = agent
+        self.tail = tail
+
+    @property
+    def committer(self) -> str:
+        return self.version_tuple[2]
+
+def render_fragment(entity_type : str, version_tuple : tuple, previous_version_id : str) -> Fragment:
+    """
+    Renders the PROV-XML records of a version, in the order in which `prov_generation.create_prov_document` adds them.
+
+    Parameters:
+        entity_type - the PROV type of the versions (e.g. `openehr:EHR_STATUS`).
+        version_tuple - the tuple of the version (see `prov_generation.extract_version_tuple`).
+        previous_version_id - the ID of the previous version, or `None` for the first version.
+
+    Returns:
+        The fragment of the version.
+    """
+
+    version_id, contribution_id, committer_name_or_id = version_tuple
+    entity = to_attribute(f"openehr:{version_id}")
+    activity = to_attribute(f"openehr:{contribution_id}")
+
+    head = (
+        render_element("entity", f' prov:id="{entity}"', [render_type(entity_type)])
+        + render_element("activity", f' prov:id="{activity}"', [render_type("openehr:CONTRIBUTION")])
+        + render_element("wasGeneratedBy", "", [render_ref("entity", entity), render_ref("activity", activity)])
+    )
+
+    agent = None
+    tail = ""
+    if committer_name_or_id is not None:
+        committer = to_attribute(f"openehr:committer_{committer_name_or_id}")
+        agent = render_element("agent", f' prov:id="{committer}"', [render_type("openehr:PARTY_IDENTIFIED")])
+        tail += (
+            render_element("wasAttributedTo", "", [render_ref("entity", entity), render_ref("agent", committer)])
+            + render_element("wasAssociatedWith", "", [render_ref("activity", activity), render_ref("agent", committer)])
+        )
+
+    if previous_version_id is not None:
+        previous_entity = to_attribute(f"openehr:{previous_version_id}")
+        tail += (
+            render_element("wasDerivedFrom", "", [render_ref("generatedEntity", entity), render_ref("usedEntity", previous_entity)])
+            + render_element("used", "", [render_ref("activity", activity), render_ref("entity", previous_entity)])
+        )
+
+    return Fragment(version_tuple, previous_version_id, head, agent, tail)
+
+def assemble_document(fragments) -> str:
+    """
+    Assembles the PROV-XML of a document from the fragments of its versions, declaring each agent once.
+
+    The output is identical to the serialization of the same document by the `prov` package.
+    """
+
+    parts = [DOCUMENT_HEADER]
+    agents = set()
+    for fragment in fragments:
+        parts.append(fragment.head)
+        if fragment.committer is not None and fragment.committer not in agents:
+            agents.add(fragment.committer)
+            parts.append(fragment.agent)
+        parts.append(fragment.tail)
+
+    if len(parts) == 1:
+        return EMPTY_DOCUMENT
+    parts.append(DOCUMENT_FOOTER)
+    return "".join(parts)
+
+class FragmentCache:
+    """
+    Caches the fragments of the versions (least recently used first out), keyed by the IDs of the version and of its
+    previous version.
+
+    The versions of the upstream APIs never change once committed, so the cached fragments never become stale, and the
+    versions whose fragments are cached are not fetched again.
+    """
+
+    def __init__(self, max_entries : int):
+        """
+        Parameters:
+            max_entries - the maximum number of cached fragments.
+        """
+
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key : tuple) -> Fragment:
+        with self._lock:
+            fragment = self._entries.get(key, None)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+        PROV_FRAGMENT_LOOKUPS.labels(MISS_OUTCOME if fragment is None else HIT_OUTCOME).inc()
+        return fragment
+
+    def put(self, key : tuple, fragment : Fragment):
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+class NotFragmentCache:
+    """
+    A class which provided the same API as the FragmentCache class, but does not cache any fragment.
+    """
+
+    def get(self, key : tuple) -> Fragment:
+        return None
+
+    def put(self, key : tuple, fragment : Fragment):
+        pass
+
+if PROV_FRAGMENT_CACHE_SIZE > 0:
+    fragments = FragmentCache(PROV_FRAGMENT_CACHE_SIZE)
+else:
+    fragments = NotFragmentCache()
+
+def fetch_fragments(classification : dict, version_ids : list):
+    """
+    Gets the fragments of the versions of a classified target, rendering and caching the fragments of the versions which
+    are not cached yet.
+
+    If the deadline of the request passes and the request accepts a partial response, only the fragments of the versions
+    fetched so far are returned (see `prov_generation.fetch_versions`).
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target.
+
+    Returns:
+        A generator of the fragments, from the oldest version to the newest.
+    """
+
+    entity_type = prov_generation.ENTITY_TYPES[classification["type"]]
+    get_version = prov_generation.reuse_fetched_versions(prov_generation.make_version_getter(classification))
+    previous_version_ids = dict(zip(version_ids[1:], version_ids[:-1]))
+
+    def get_fragment(version_id : str) -> Fragment:
+        previous_version_id = previous_version_ids.get(version_id, None)
+        key = (version_id, previous_version_id)
+        fragment = fragments.get(key)
+        if fragment is None:
+            version_tuple = prov_generation.extract_version_tuple(version_id, get_version(version_id))
+            fragment = render_fragment(entity_type, version_tuple, previous_version_id)
+            fragments.put(key, fragment)
+        return fragment
+
+    for _, fragment in prov_generation.fetch_versions(version_ids, get_fragment):
+        yield fragment
+
+@timed.measure(ASSEMBLE_PROV_XML_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def build_prov_xml(classification : dict, version_ids : list = None) -> str:
+    """
+    Builds the PROV-XML of a classified target from the fragments of its versions (see `fetch_fragments`).
+
+    Parameters:
+        classification - the classification of the target URI (see `classifier.classify_uri`).
+        version_ids - the IDs of the versions of the target, if already fetched.
+
+    Returns:
+        The PROV-XML representation of the provenance of the target.
+    """
+
+    if version_ids is None:
+        version_ids = prov_generation.get_version_ids(classification)
+    request_timed.set_version_count(len(version_ids))
+
+    return assemble_document(fetch_fragments(classification, version_ids))
@@ -1,60 +1,132 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from prov.model import ProvDocument
 
-from data_layer import openehr_api, demographic_api, rm_utils
+from data_layer import api_exceptions, openehr_api, demographic_api, rm_utils
+from data_layer.deadlines import deadlines
+from data_layer.timing import timed, request_timed
+from business_layer.timing import BUILD_STAGE, SERIALIZE_STAGE, CREATE_PROV_DOCUMENT_OF_EHR_STATUS_MEASUREMENT, CREATE_PROV_DOCUMENT_OF_COMPOSITION_MEASUREMENT, CREATE_PROV_DOCUMENT_OF_PATIENT_MEASUREMENT, SERIALIZE_PROV_DOCUMENT_MEASUREMENT
+
+OPENEHR_NAMESPACE = "http://schemas.openehr.org/v2"
+
+# the PROV types of the versions of each target type.
+ENTITY_TYPES = {
+    "EHR_STATUS": "openehr:EHR_STATUS",
+    "COMPOSITION": "openehr:COMPOSITION",
+    "patient": "openehr:PERSON"
+}
 
-def create_prov_document_of_ehr_status(ehr_id):
+# the versions already fetched in the current context (thread), by version ID (see `using_fetched_versions`).
+_fetched_versions = ContextVar("fetched_versions", default=None)
+
+@contextmanager
+def using_fetched_versions(versions : dict):
     """
-    Creates the PROV document of the EHR Status of a given EHR.
+    Builds the provenance in a block of code from versions already fetched (by version ID) rather than fetching them
+    again, e.g. to run several engines on the same target (see `shadow`).
+    """
+
+    token = _fetched_versions.set(versions)
+    try:
+        yield
+    finally:
+        _fetched_versions.reset(token)
+
+def reuse_fetched_versions(get_version):
+    """
+    Wraps a function which fetches a version by its ID, so that it returns the versions already fetched in the current
+    context (see `using_fetched_versions`) instead of fetching them again.
+    """
+
+    versions = _fetched_versions.get()
+    if versions is None:
+        return get_version
+    return lambda version_id: versions[version_id] if version_id in versions else get_version(version_id)
+
+def fetch_versions(version_ids : list, get_version):
+    """
+    Fetches the versions of a versioned object one by one.
+
+    If the deadline of the request passes while the versions are being fetched and the request accepts a partial
+    response, the remaining versions are skipped and the request is marked as truncated.
 
     Parameters:
-        ehr_id - the ID of the EHR.
+        version_ids - the IDs of the versions, from the oldest to the newest.
+        get_version - a function which fetches the version with a given ID.
 
     Returns:
-        The provenance document.
+        A generator of tuples with the ID of each fetched version and the version.
     """
 
-    # creates the provenance document
-    doc = ProvDocument()
+    for version_id in version_ids:
+        try:
+            version = get_version(version_id)
+        except api_exceptions.DeadlineExceededException as e:
+            if not deadlines.truncate():
+                raise e
+            return
+        yield version_id, version
 
-    # PROV uses namespaces like XML.
-    # All used namespaces must be declared explicitly, except the standard ones.
-    doc.add_namespace("openehr", "http://schemas.openehr.org/v2")
+def extract_version_tuple(version_id : str, version : dict) -> tuple:
+    """
+    Extracts what the provenance of a version depends on.
 
-    agents = set()
-    version_ids = openehr_api.get_version_ids_of_ehr_status(ehr_id)
-    for i in range(0, len(version_ids)):
-        version_id = version_ids[i]
+    Returns:
+        A tuple with the ID of the version, the ID of its contribution and the name or ID of its committer (`None` if the
+        committer is not identified).
+    """
 
-        version = openehr_api.get_versioned_ehr_status_version_by_id(ehr_id, version_id)
-        contribution_id = rm_utils.extract_contribution_id_from_version(version)
-        committer_name_or_id = rm_utils.extract_committer_name_or_id_from_version(version)
+    return version_id, rm_utils.extract_contribution_id_from_version(version), rm_utils.extract_committer_name_or_id_from_version(version)
 
-        doc.entity(f"openehr:{version_id}", other_attributes = {"prov:type": "openehr:EHR_STATUS"})
-        doc.activity(f"openehr:{contribution_id}", other_attributes = {"prov:type": "openehr:CONTRIBUTION"})
-        doc.wasGeneratedBy(entity = f"openehr:{version_id}", activity = f"openehr:{contribution_id}")
+def extract_version_tuples(version_ids : list, get_version):
+    """
+    Fetches the versions of a versioned object one by one (see `fetch_versions`) and extracts their tuples (see
+    `extract_version_tuple`).
 
-        if committer_name_or_id is not None:
-            if committer_name_or_id not in agents:
-                agents.add(committer_name_or_id)
-                doc.agent(f"openehr:committer_{committer_name_or_id}", other_attributes = {"prov:type": "openehr:PARTY_IDENTIFIED"})
+    Returns:
+        A generator of the tuples of the fetched versions.
+    """
 
-            doc.wasAttributedTo(entity = f"openehr:{version_id}", agent = f"openehr:committer_{committer_name_or_id}")
-            doc.wasAssociatedWith(activity = f"openehr:{contribution_id}", agent = f"openehr:committer_{committer_name_or_id}")
+    for version_id, version in fetch_versions(version_ids, reuse_fetched_versions(get_version)):
+        yield extract_version_tuple(version_id, version)
 
-        if i > 0:
-            previous_version_id = version_ids[i - 1]
-            doc.wasDerivedFrom(f"openehr:{version_id}", f"openehr:{previous_version_id}")
-            doc.used(f"openehr:{contribution_id}", f"openehr:{previous_version_id}")
+def make_version_getter(classification : dict):
+    """
+    Makes a function which fetches a version of a classified target by its ID.
+    """
 
-    return doc
+    classification_type = classification["type"]
+    if classification_type == "EHR_STATUS":
+        return lambda version_id: openehr_api.get_versioned_ehr_status_version_by_id(classification["ehr_id"], version_id)
+    elif classification_type == "COMPOSITION":
+        return lambda version_id: openehr_api.get_versioned_composition_version_by_id(classification["ehr_id"], classification["composition_id"], version_id)
+    elif classification_type == "patient":
+        return lambda version_id: demographic_api.get_versioned_patient_version_by_id(classification["patient_id"], version_id)
+    raise ValueError(f"The URL class '{ classification_type }' is not supported!")
 
-def create_prov_document_of_composition(ehr_id, composition_id):
+def get_version_ids(classification : dict) -> list:
     """
-    Creates the PROV document of a COMPOSITION of a given EHR.
+    Lists the version IDs of a classified target.
+    """
+
+    classification_type = classification["type"]
+    if classification_type == "EHR_STATUS":
+        return openehr_api.get_version_ids_of_ehr_status(classification["ehr_id"])
+    elif classification_type == "COMPOSITION":
+        return openehr_api.get_version_ids_of_composition(classification["ehr_id"], classification["composition_id"])
+    elif classification_type == "patient":
+        return demographic_api.get_version_ids_of_patient(classification["patient_id"])
+    raise ValueError(f"The URL class '{ classification_type }' is not supported!")
+
+def create_prov_document(entity_type : str, version_ids : list, version_tuples) -> ProvDocument:
+    """
+    Creates the PROV document of a versioned object from the tuples of its versions.
 
     Parameters:
-        ehr_id - the ID of the EHR.
-        composition_id - the ID of the COMPOSITION.
+        entity_type - the PROV type of the versions (e.g. `openehr:EHR_STATUS`).
+        version_ids - the IDs of the versions, from the oldest to the newest.
+        version_tuples - the tuples of the versions, in the same order (see `extract_version_tuple`).
 
     Returns:
         The provenance document.
@@ -65,18 +137,11 @@ def create_prov_document_of_composition(ehr_id, composition_id):
 
     # PROV uses namespaces like XML.
     # All used namespaces must be declared explicitly, except the standard ones.
-    doc.add_namespace("openehr", "http://schemas.openehr.org/v2")
+    doc.add_namespace("openehr", OPENEHR_NAMESPACE)
 
     agents = set()
-    version_ids = openehr_api.get_version_ids_of_composition(ehr_id, composition_id)
-    for i in range(0, len(version_ids)):
-        version_id = version_ids[i]
-
-        version = openehr_api.get_versioned_composition_version_by_id(ehr_id, composition_id, version_id)
-        contribution_id = rm_utils.extract_contribution_id_from_version(version)
-        committer_name_or_id = rm_utils.extract_committer_name_or_id_from_version(version)
-
-        doc.entity(f"openehr:{version_id}", other_attributes = {"prov:type": "openehr:COMPOSITION"})
+    for i, (version_id, contribution_id, committer_name_or_id) in enumerate(version_tuples):
+        doc.entity(f"openehr:{version_id}", other_attributes = {"prov:type": entity_type})
         doc.activity(f"openehr:{contribution_id}", other_attributes = {"prov:type": "openehr:CONTRIBUTION"})
         doc.wasGeneratedBy(entity = f"openehr:{version_id}", activity = f"openehr:{contribution_id}")
 
@@ -95,48 +160,78 @@ def create_prov_document_of_composition(ehr_id, composition_id):
 
     return doc
 
-def create_prov_document_of_patient(patient_id):
+@timed.measure(CREATE_PROV_DOCUMENT_OF_EHR_STATUS_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def create_prov_document_of_ehr_status(ehr_id, version_ids = None):
     """
-    Creates the PROV document of the given patient.
+    Creates the PROV document of the EHR Status of a given EHR.
 
     Parameters:
-        patient_id - the ID of the patient.
+        ehr_id - the ID of the EHR.
+        version_ids - the IDs of the versions of the EHR_STATUS, if already fetched.
 
     Returns:
         The provenance document.
     """
 
-    # creates the provenance document
-    doc = ProvDocument()
+    if version_ids is None:
+        version_ids = openehr_api.get_version_ids_of_ehr_status(ehr_id)
+    request_timed.set_version_count(len(version_ids))
+    version_tuples = extract_version_tuples(version_ids, lambda version_id: openehr_api.get_versioned_ehr_status_version_by_id(ehr_id, version_id))
+    return create_prov_document(ENTITY_TYPES["EHR_STATUS"], version_ids, version_tuples)
 
-    # PROV uses namespaces like XML.
-    # All used namespaces must be declared explicitly, except the standard ones.
-    doc.add_namespace("openehr", "http://schemas.openehr.org/v2")
+@timed.measure(CREATE_PROV_DOCUMENT_OF_COMPOSITION_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def create_prov_document_of_composition(ehr_id, composition_id, version_ids = None):
+    """
+    Creates the PROV document of a COMPOSITION of a given EHR.
 
-    agents = set()
-    version_ids = demographic_api.get_version_ids_of_patient(patient_id)
-    for i in range(0, len(version_ids)):
-        version_id = version_ids[i]
+    Parameters:
+        ehr_id - the ID of the EHR.
+        composition_id - the ID of the COMPOSITION.
+        version_ids - the IDs of the versions of the COMPOSITION, if already fetched.
 
-        version = demographic_api.get_versioned_patient_version_by_id(patient_id, version_id)
-        contribution_id = rm_utils.extract_contribution_id_from_version(version)
-        committer_name_or_id = rm_utils.extract_committer_name_or_id_from_version(version)
+    Returns:
+        The provenance document.
+    """
 
-        doc.entity(f"openehr:{version_id}", other_attributes = {"prov:type": "openehr:PERSON"})
-        doc.activity(f"openehr:{contribution_id}", other_attributes = {"prov:type": "openehr:CONTRIBUTION"})
-        doc.wasGeneratedBy(entity = f"openehr:{version_id}", activity = f"openehr:{contribution_id}")
+    if version_ids is None:
+        version_ids = openehr_api.get_version_ids_of_composition(ehr_id, composition_id)
+    request_timed.set_version_count(len(version_ids))
+    version_tuples = extract_version_tuples(version_ids, lambda version_id: openehr_api.get_versioned_composition_version_by_id(ehr_id, composition_id, version_id))
+    return create_prov_document(ENTITY_TYPES["COMPOSITION"], version_ids, version_tuples)
 
-        if committer_name_or_id is not None:
-            if committer_name_or_id not in agents:
-                agents.add(committer_name_or_id)
-                doc.agent(f"openehr:committer_{committer_name_or_id}", other_attributes = {"prov:type": "openehr:PARTY_IDENTIFIED"})
+@timed.measure(CREATE_PROV_DOCUMENT_OF_PATIENT_MEASUREMENT)
+@request_timed.measure(BUILD_STAGE)
+def create_prov_document_of_patient(patient_id, version_ids = None):
+    """
+    Creates the PROV document of the given patient.
 
-            doc.wasAttributedTo(entity = f"openehr:{version_id}", agent = f"openehr:committer_{committer_name_or_id}")
-            doc.wasAssociatedWith(activity = f"openehr:{contribution_id}", agent = f"openehr:committer_{committer_name_or_id}")
+    Parameters:
+        patient_id - the ID of the patient.
+        version_ids - the IDs of the versions of the patient, if already fetched.
 
-        if i > 0:
-            previous_version_id = version_ids[i - 1]
-            doc.wasDerivedFrom(f"openehr:{version_id}", f"openehr:{previous_version_id}")
-            doc.used(f"openehr:{contribution_id}", f"openehr:{previous_version_id}")
+    Returns:
+        The provenance document.
+    """
 
-    return doc
+    if version_ids is None:
+        version_ids = demographic_api.get_version_ids_of_patient(patient_id)
+    request_timed.set_version_count(len(version_ids))
+    version_tuples = extract_version_tuples(version_ids, lambda version_id: demographic_api.get_versioned_patient_version_by_id(patient_id, version_id))
+    return create_prov_document(ENTITY_TYPES["patient"], version_ids, version_tuples)
+
+@timed.measure(SERIALIZE_PROV_DOCUMENT_MEASUREMENT)
+@request_timed.measure(SERIALIZE_STAGE)
+def serialize_prov_document(doc):
+    """
+    Serializes a PROV document to PROV-XML.
+
+    Parameters:
+        doc - the provenance document.
+
+    Returns:
+        A string with the PROV-XML representation of the document.
+    """
+
+    return doc.serialize(format="xml")
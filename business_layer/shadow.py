@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import threading
+import time
+import tracemalloc
+
+from prov.model import ProvDocument
+
+from app_settings import SHADOW_ENGINE, SHADOW_SAMPLE_RATE, SHADOW_MAX_PENDING
+from data_layer.recording import unrecorded
+from business_layer import prov_engines, prov_generation
+from business_layer.metrics import SHADOW_RUNS, SHADOW_DROPPED, SHADOW_LATENCY_RATIO, SHADOW_MEMORY_RATIO
+
+logger = logging.getLogger(__name__)
+
+# outcomes of the shadow runs.
+MATCH_OUTCOME = "match"
+MISMATCH_OUTCOME = "mismatch"
+ERROR_OUTCOME = "error"
+
+def run_measured(engine, classification : dict, version_ids : list) -> tuple:
+    """
+    Runs an engine, measuring its CPU time in the current thread and, unless memory is already being traced by someone
+    else, its peak memory.
+
+    The versions of the target must have been fetched already (see `prov_generation.using_fetched_versions`), so that
+    only building and serializing the provenance is measured, and memory is traced only while no upstream call is made.
+
+    Returns:
+        A tuple with the output of the engine, its CPU time (in seconds) and its peak memory (in bytes, or `None`).
+    """
+
+    tracing = not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        start_time = time.thread_time()
+        output = engine(classification, version_ids)
+        duration = time.thread_time() - start_time
+        peak_memory = tracemalloc.get_traced_memory()[1] if tracing else None
+    finally:
+        if tracing:
+            tracemalloc.stop()
+    return output, duration, peak_memory
+
+def is_same_provenance(xml_a : str, xml_b : str) -> bool:
+    """
+    Checks whether two PROV-XML documents have the same namespaces and records, regardless of their order and formatting.
+    """
+
+    return ProvDocument.deserialize(content = xml_a, format = "xml") == ProvDocument.deserialize(content = xml_b, format = "xml")
+
+class ShadowExecutor:
+    """
+    Runs a candidate engine alongside the current engine on a sampled fraction of the provenance requests.
+
+    The shadow runs happen in a background thread, one at a time, after the current engine has rendered the PROV-XML
+    served to the client: the versions of the target are fetched once, both engines are run on them in turn (in a random
+    order, so neither always runs first), the output of the candidate engine is compared semantically with the served
+    one, and the CPU time and peak memory of the candidate relative to the current engine are recorded in the metrics.
+    The responses are always served by the current engine, and the shadow runs are kept out of the usage statistics and
+    of the other metrics.
+    """
+
+    def __init__(self, current_engine_name : str, candidate_engine_name : str, sample_rate : float, max_pending : int):
+        """
+        Parameters:
+            current_engine_name - the name of the engine which serves the responses (see `prov_engines.ENGINES`).
+            candidate_engine_name - the name of the candidate engine.
+            sample_rate - the fraction of the requests which are shadowed.
+            max_pending - the maximum number of shadow runs waiting to be executed; sampled requests beyond it are dropped.
+        """
+
+        if candidate_engine_name not in prov_engines.ENGINES:
+            raise ValueError(f"Unknown shadow engine: {candidate_engine_name}. The engines are: {', '.join(prov_engines.ENGINES.keys())}.")
+
+        self.current_engine_name = current_engine_name
+        self.current_engine = prov_engines.ENGINES[current_engine_name]
+        self.candidate_engine_name = candidate_engine_name
+        self.candidate_engine = prov_engines.ENGINES[candidate_engine_name]
+        self.sample_rate = sample_rate
+
+        self._random = random.Random()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "shadow")
+
+    def submit(self, classification : dict, version_ids : list, served_output : str):
+        """
+        Shadows the PROV-XML rendered by the current engine for a classified target, if the request is sampled.
+
+        Parameters:
+            classification - the classification of the target URI (see `classifier.classify_uri`).
+            version_ids - the IDs of the versions of the target.
+            served_output - the PROV-XML rendered by the current engine.
+        """
+
+        if self._random.random() >= self.sample_rate:
+            return
+
+        if not self._pending.acquire(blocking = False):
+            SHADOW_DROPPED.labels(self.candidate_engine_name).inc()
+            return
+
+        self._executor.submit(self._run, dict(classification), list(version_ids), served_output)
+
+    def _run(self, classification : dict, version_ids : list, served_output : str):
+        try:
+            outcome = self.compare(classification, version_ids, served_output)
+            SHADOW_RUNS.labels(self.candidate_engine_name, outcome).inc()
+        except Exception:
+            logger.exception(f"Shadow run of {self.candidate_engine_name} failed for {classification}.")
+        finally:
+            self._pending.release()
+
+    def compare(self, classification : dict, version_ids : list, served_output : str) -> str:
+        """
+        Runs both engines on a classified target and compares the output of the candidate engine with the served one.
+
+        The engines are run without recording their upstream calls and measurements (see `recording.unrecorded`); only
+        the outcome of the comparison and the relative CPU time and peak memory are recorded.
+
+        Returns:
+            The outcome of the comparison.
+        """
+
+        engines = [self.current_engine, self.candidate_engine]
+        candidate_index = 1
+        if self._random.random() < 0.5:
+            engines.reverse()
+            candidate_index = 0
+
+        try:
+            with unrecorded():
+                get_version = prov_generation.make_version_getter(classification)
+                versions = {version_id: version for version_id, version in prov_generation.fetch_versions(version_ids, get_version)}
+                with prov_generation.using_fetched_versions(versions):
+                    measurements = [run_measured(engine, classification, version_ids) for engine in engines]
+        except Exception:
+            logger.exception(f"The shadow run of {self.candidate_engine_name} failed for {classification}.")
+            return ERROR_OUTCOME
+
+        candidate_output, candidate_duration, candidate_memory = measurements[candidate_index]
+        _, current_duration, current_memory = measurements[1 - candidate_index]
+
+        if current_duration > 0:
+            SHADOW_LATENCY_RATIO.labels(self.candidate_engine_name).observe(candidate_duration / current_duration)
+        if current_memory and candidate_memory is not None:
+            SHADOW_MEMORY_RATIO.labels(self.candidate_engine_name).observe(candidate_memory / current_memory)
+
+        if is_same_provenance(served_output, candidate_output):
+            return MATCH_OUTCOME
+
+        logger.warning(f"The output of the shadow engine {self.candidate_engine_name} differs from the current engine ({self.current_engine_name}) for {classification}.")
+        return MISMATCH_OUTCOME
+
+class NotShadowExecutor:
+    """
+    A class which provided the same API as the ShadowExecutor class, but does not shadow any request.
+    """
+
+    def submit(self, classification : dict, version_ids : list, served_output : str):
+        pass
+
+if SHADOW_ENGINE:
+    shadow_executor = ShadowExecutor(prov_engines.CURRENT_ENGINE, SHADOW_ENGINE, SHADOW_SAMPLE_RATE, SHADOW_MAX_PENDING)
+else:
+    shadow_executor = NotShadowExecutor()
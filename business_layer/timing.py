@@ -1,11 +1,82 @@
-from data_layer.time_measurement import Timed, NotTimed
-from app_settings import USAGE_STATISTICS_MAX_SAMPLES, INCLUDE_USAGE_STATISTICS
+from data_layer.timing import CLASSIFY_URI_MEASUREMENT, OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT, OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT, OPENEHR_GET_EHR_METADATA_MEASUREMENT, OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT, OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT, OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT, OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT, OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT, DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT, DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT, DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT, DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT, DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT, DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT
 
+# whole request
 GET_PROVENANCE_MEASUREMENT = "get_provenance"
 
-ALL_MEASUREMENTS = [GET_PROVENANCE_MEASUREMENT]
+# PROV document building
+CREATE_PROV_DOCUMENT_OF_EHR_STATUS_MEASUREMENT = "prov_generation.create_prov_document_of_ehr_status"
+CREATE_PROV_DOCUMENT_OF_COMPOSITION_MEASUREMENT = "prov_generation.create_prov_document_of_composition"
+CREATE_PROV_DOCUMENT_OF_PATIENT_MEASUREMENT = "prov_generation.create_prov_document_of_patient"
 
-if INCLUDE_USAGE_STATISTICS:
-    timed = Timed(USAGE_STATISTICS_MAX_SAMPLES)
-else:
-    timed = NotTimed()
+# PROV document serialization
+SERIALIZE_PROV_DOCUMENT_MEASUREMENT = "prov_generation.serialize_prov_document"
+
+# PROV-XML assembly from fragments
+ASSEMBLE_PROV_XML_MEASUREMENT = "prov_fragments.build_prov_xml"
+
+# other representations
+WRITE_PROV_JSON_MEASUREMENT = "prov_formats.write_prov_json"
+WRITE_MSGPACK_MEASUREMENT = "prov_formats.write_msgpack"
+WRITE_TURTLE_MEASUREMENT = "prov_formats.write_turtle"
+WRITE_N_TRIPLES_MEASUREMENT = "prov_formats.write_n_triples"
+
+ALL_MEASUREMENTS = [
+    GET_PROVENANCE_MEASUREMENT,
+    CLASSIFY_URI_MEASUREMENT,
+    OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT,
+    OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT,
+    OPENEHR_GET_EHR_METADATA_MEASUREMENT,
+    OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT,
+    OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT,
+    OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT,
+    OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT,
+    OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT,
+    DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT,
+    DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT,
+    DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT,
+    DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT,
+    DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT,
+    DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT,
+    DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT,
+    DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT,
+    DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT,
+    DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT,
+    CREATE_PROV_DOCUMENT_OF_EHR_STATUS_MEASUREMENT,
+    CREATE_PROV_DOCUMENT_OF_COMPOSITION_MEASUREMENT,
+    CREATE_PROV_DOCUMENT_OF_PATIENT_MEASUREMENT,
+    SERIALIZE_PROV_DOCUMENT_MEASUREMENT,
+    ASSEMBLE_PROV_XML_MEASUREMENT,
+    WRITE_PROV_JSON_MEASUREMENT,
+    WRITE_MSGPACK_MEASUREMENT,
+    WRITE_TURTLE_MEASUREMENT,
+    WRITE_N_TRIPLES_MEASUREMENT
+]
+
+# stages reported in the Server-Timing header, besides the classification (see `data_layer.timing`)
+BUILD_STAGE = "build"
+SERIALIZE_STAGE = "serialize"
+
+# labels of the samples of the GET_PROVENANCE_MEASUREMENT measurement
+TARGET_TYPE_LABEL = "target_type"
+STATUS_LABEL = "status"
+VERSIONS_LABEL = "versions"
+UPSTREAM_CALLS_LABEL = "upstream_calls"
+
+ALL_LABELS = [TARGET_TYPE_LABEL, STATUS_LABEL, VERSIONS_LABEL, UPSTREAM_CALLS_LABEL]
+
+# the measurements whose samples carry labels.
+LABELED_MEASUREMENTS = [GET_PROVENANCE_MEASUREMENT]
+
+def to_count_range(count : int) -> str:
+    """
+    Converts a count to a power-of-two range (e.g. 5 -> "4-7"), so that labels such as the number of versions
+    have a bounded number of distinct values.
+    """
+
+    if count is None:
+        return None
+    if count < 2:
+        return str(count)
+
+    lower_bound = 1 << (count.bit_length() - 1)
+    return f"{lower_bound}-{2 * lower_bound - 1}"
@@ -1,20 +1,56 @@
-from data_layer.time_measurement import TimedGroup
-from business_layer.timing import timed, ALL_MEASUREMENTS
+from data_layer.time_measurement import TimedSnapshot
+from data_layer.timing import timed
+from business_layer.timing import ALL_MEASUREMENTS, ALL_LABELS, LABELED_MEASUREMENTS
+
+# time windows (in seconds) of the usage statistics.
+STATISTICS_WINDOWS = {
+    "last_1_minute": 60,
+    "last_5_minutes": 5 * 60,
+    "last_15_minutes": 15 * 60
+}
+
+def get_usage_statistics(group_by : str = None):
+    """
+    Gets the usage statistics of all measurements.
+
+    Parameters:
+        group_by - if provided, the name of a label (e.g. `versions`) by which the statistics of each window of the
+            measurements with labels are also aggregated.
+    """
+
+    if group_by is not None and group_by not in ALL_LABELS:
+        raise ValueError(f"Unknown label: {group_by}.")
 
-def get_usage_statistics():
     usage_statistics = {}
 
     for measurement_name in ALL_MEASUREMENTS:
-        group = timed.get_group(measurement_name)
+        # the samples of each measurement are read once for all of its statistics.
+        snapshot = timed.get_group(measurement_name).take_snapshot()
 
-        usage_statistics[measurement_name] = extract_statistics(group)
+        if measurement_name in LABELED_MEASUREMENTS:
+            usage_statistics[measurement_name] = extract_statistics(snapshot, group_by)
+        else:
+            usage_statistics[measurement_name] = extract_statistics(snapshot)
 
     return usage_statistics
 
 def clear_usage_statistics():
     timed.clear_all()
 
-def extract_statistics(group : TimedGroup) -> dict:
-    return {
-        "samples": group.get_samples()
+def extract_statistics(snapshot : TimedSnapshot, group_by : str = None) -> dict:
+    windows = {}
+    for window_name, window in STATISTICS_WINDOWS.items():
+        windows[window_name] = snapshot.get_window_statistics(window)
+
+    statistics = {
+        "samples": snapshot.get_samples(),
+        "windows": windows
     }
+
+    if group_by is not None:
+        grouped_windows = {}
+        for window_name, window in STATISTICS_WINDOWS.items():
+            grouped_windows[window_name] = snapshot.get_window_statistics(window, lambda labels: str(labels.get(group_by)))
+        statistics[f"windows_by_{group_by}"] = grouped_windows
+
+    return statistics
@@ -12,3 +12,9 @@ class BadRequestException(Exception):
 
 class RequestTimeoutException(Exception):
     pass
+
+class DeadlineExceededException(Exception):
+    pass
+
+class RequestCancelledException(Exception):
+    pass
@@ -3,6 +3,7 @@ from pathlib import PurePosixPath
 
 from app_settings import PUBLIC_OPENEHR_API_BASE_URI, PUBLIC_DEMOGRAPHIC_API_BASE_URI
 from data_layer import ids
+from data_layer.timing import timed, request_timed, CLASSIFY_URI_MEASUREMENT, CLASSIFY_STAGE
 
 openehr_api_base_uri = PUBLIC_OPENEHR_API_BASE_URI
 if openehr_api_base_uri[-1] != "/":
@@ -14,6 +15,8 @@ if demographic_api_base_uri[-1] != "/":
     demographic_api_base_uri += "/"
 parsed_demographic_api_base_uri = urlparse(demographic_api_base_uri)
 
+@timed.measure(CLASSIFY_URI_MEASUREMENT)
+@request_timed.measure(CLASSIFY_STAGE)
 def classify_uri(uri : str) -> dict:
     """
     Classifies a given URI in:
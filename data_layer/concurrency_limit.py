@@ -0,0 +1,147 @@
+import threading
+import time
+
+from data_layer.metrics import UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_CONCURRENCY_LIMIT_CHANGES, UPSTREAM_CALLS_IN_FLIGHT, UPSTREAM_CONCURRENCY_WAIT
+
+# a window whose average latency exceeds the no-load latency by this factor is considered congested.
+LATENCY_TOLERANCE = 2.0
+# the factor applied to the limit when a window is congested or has errors.
+BACKOFF_RATIO = 0.9
+# the number of windows after which the no-load latency is measured again, so that it follows lasting changes of the upstream.
+NO_LOAD_LATENCY_WINDOWS = 100
+
+# directions of the limit changes.
+INCREASE_DIRECTION = "increase"
+DECREASE_DIRECTION = "decrease"
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of calls sent to an upstream API at the same time, by all the requests being processed, with a
+    limit which adapts to the latency of the upstream API (additive increase, multiplicative decrease).
+
+    The calls are grouped into windows of as many calls as the limit. At the end of each window, its average latency is
+    compared with the no-load latency (the lowest latency of the recent windows):
+    - if the window has errors, or its latency exceeds the no-load latency by more than `LATENCY_TOLERANCE`, the upstream
+      API is queueing the calls, so the limit is multiplied by `BACKOFF_RATIO`;
+    - otherwise, if the limit was reached during the window, the limit is increased by one.
+    """
+
+    def __init__(self, name : str, initial_limit : int, min_limit : int, max_limit : int):
+        """
+        Parameters:
+            name - the name of the upstream API, used in the metrics.
+            initial_limit - the limit before any call has been measured.
+            min_limit - the lowest limit.
+            max_limit - the highest limit.
+        """
+
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+
+        self._window_calls = 0
+        self._window_latency = 0.0
+        self._window_errors = 0
+        self._window_saturated = False
+        self._windows = 0
+        self._no_load_latency = None
+        self._next_no_load_latency = None
+
+        UPSTREAM_CONCURRENCY_LIMIT.labels(self.name).set(int(self.limit))
+
+    def acquire(self, timeout : float = None) -> bool:
+        """
+        Waits until a call can be sent to the upstream API.
+
+        Parameters:
+            timeout - the maximum time to wait (in seconds), or `None` to wait indefinitely.
+
+        Returns:
+            Whether the call can be sent; if it can, `release` must be called once it has completed.
+        """
+
+        start_time = time.perf_counter()
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self._in_flight < int(self.limit), timeout = timeout)
+            if not acquired:
+                return False
+
+            self._in_flight += 1
+            if self._in_flight >= int(self.limit):
+                self._window_saturated = True
+            UPSTREAM_CALLS_IN_FLIGHT.labels(self.name).set(self._in_flight)
+
+        UPSTREAM_CONCURRENCY_WAIT.labels(self.name).observe(time.perf_counter() - start_time)
+        return True
+
+    def release(self, latency : float, failed : bool):
+        """
+        Records a completed call and adapts the limit at the end of each window.
+
+        Parameters:
+            latency - the duration of the call (in seconds), or `None` if the call was abandoned (e.g. when the deadline of
+                its request passed), in which case it tells nothing about the upstream API and is not recorded.
+            failed - whether the call failed because of the upstream API (e.g. a timeout or a 5xx response).
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+            UPSTREAM_CALLS_IN_FLIGHT.labels(self.name).set(self._in_flight)
+
+            if latency is None:
+                self._condition.notify_all()
+                return
+
+            self._window_calls += 1
+            self._window_latency += latency
+            if failed:
+                self._window_errors += 1
+
+            if self._window_calls >= int(self.limit):
+                self._end_window()
+
+            self._condition.notify_all()
+
+    def _end_window(self):
+        average_latency = self._window_latency / self._window_calls
+
+        # the no-load latency is the lowest window latency, measured again every `NO_LOAD_LATENCY_WINDOWS` windows.
+        self._windows += 1
+        if self._next_no_load_latency is None or average_latency < self._next_no_load_latency:
+            self._next_no_load_latency = average_latency
+        if self._no_load_latency is None or average_latency < self._no_load_latency:
+            self._no_load_latency = average_latency
+        if self._windows % NO_LOAD_LATENCY_WINDOWS == 0:
+            self._no_load_latency = self._next_no_load_latency
+            self._next_no_load_latency = None
+
+        previous_limit = int(self.limit)
+        if self._window_errors > 0 or average_latency > self._no_load_latency * LATENCY_TOLERANCE:
+            self.limit = max(float(self.min_limit), self.limit * BACKOFF_RATIO)
+        elif self._window_saturated:
+            self.limit = min(float(self.max_limit), self.limit + 1.0)
+
+        if int(self.limit) != previous_limit:
+            direction = INCREASE_DIRECTION if int(self.limit) > previous_limit else DECREASE_DIRECTION
+            UPSTREAM_CONCURRENCY_LIMIT_CHANGES.labels(self.name, direction).inc()
+            UPSTREAM_CONCURRENCY_LIMIT.labels(self.name).set(int(self.limit))
+
+        self._window_calls = 0
+        self._window_latency = 0.0
+        self._window_errors = 0
+        self._window_saturated = self._in_flight >= int(self.limit)
+
+class NotConcurrencyLimiter:
+    """
+    A class which provided the same API as the AdaptiveConcurrencyLimiter class, but does not limit any call.
+    """
+
+    def acquire(self, timeout : float = None) -> bool:
+        return True
+
+    def release(self, latency : float, failed : bool):
+        pass
@@ -0,0 +1,186 @@
+import logging
+import queue
+import socket
+import threading
+from urllib.parse import urlparse
+
+from requests import Request
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import TimeoutError as Urllib3TimeoutError
+
+from data_layer.metrics import UPSTREAM_KEEPALIVE_PINGS
+
+logger = logging.getLogger(__name__)
+
+# outcomes of the keep-alive pings.
+ALIVE_OUTCOME = "alive"
+RECONNECTED_OUTCOME = "reconnected"
+FAILED_OUTCOME = "failed"
+
+# the exceptions raised when a ping times out.
+PING_TIMEOUT_EXCEPTIONS = (socket.timeout, Urllib3TimeoutError)
+
+class ConnectionWarmer:
+    """
+    Keeps warm connections to the replicas of an upstream API in the connection pools of its session: it establishes
+    some connections (including their TLS handshakes) at startup, and then periodically pings the idle connections, so
+    that they are not closed by the upstream API for being idle, and re-establishes those which have been closed.
+
+    The connections are handled through the `urllib3` connection pools of the `requests` transport adapters.
+    """
+
+    def __init__(self, name : str, session, base_uris : list, verify, connections : int, keepalive_interval : float, timeout : float):
+        """
+        Parameters:
+            name - the name of the upstream API, used in the metrics and in the logs.
+            session - the `requests` session of the upstream client.
+            base_uris - the base URIs of the replicas of the upstream API.
+            verify - the `verify` parameter of the requests sent by the upstream client.
+            connections - the number of connections established to each replica at startup.
+            keepalive_interval - the interval (in seconds) between the pings of the idle connections, or `0` for no pings.
+            timeout - the maximum time (in seconds) to establish a connection and to wait for the response to a ping.
+        """
+
+        self.name = name
+        self.session = session
+        self.base_uris = base_uris
+        self.verify = verify
+        self.connections = connections
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _get_pool(self, base_uri : str):
+        """
+        Gets the connection pool used by the requests to a replica, or `None` if its transport adapter has no pools.
+        """
+
+        adapter = self.session.get_adapter(base_uri)
+        if not isinstance(adapter, HTTPAdapter):
+            return None
+
+        if hasattr(adapter, "build_connection_pool_key_attributes"):
+            # since requests 2.32, the pools are keyed by their TLS settings.
+            request = self.session.prepare_request(Request("GET", base_uri))
+            host_params, pool_kwargs = adapter.build_connection_pool_key_attributes(request, self.verify, None)
+            return adapter.poolmanager.connection_from_host(**host_params, pool_kwargs = pool_kwargs)
+
+        # before, the TLS settings were set on the pool of the host for each request.
+        pool = adapter.get_connection(base_uri)
+        adapter.cert_verify(pool, base_uri, self.verify, None)
+        return pool
+
+    def warm_up(self):
+        """
+        Establishes the connections to each replica and starts the keep-alive pings, if enabled.
+        """
+
+        for base_uri in self.base_uris:
+            pool = self._get_pool(base_uri)
+            if pool is None:
+                continue
+
+            # each connection is pinged once established: with TLS 1.3, this receives the session tickets, which are then
+            # resumed by the next connections and which would otherwise make the idle connection look closed to `urllib3`.
+            path = urlparse(base_uri).path or "/"
+            connections = []
+            try:
+                for _ in range(self.connections):
+                    connection = pool._get_conn()
+                    connections.append(connection)
+                    if self._ping_connection(connection, path) == FAILED_OUTCOME:
+                        logger.warning(f"Could not establish a connection to {base_uri}.")
+                        break
+            finally:
+                for connection in connections:
+                    pool._put_conn(connection)
+
+        if self.keepalive_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target = self._run_pings, name = f"{self.name}-keepalive", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run_pings(self):
+        while not self._stopped.wait(self.keepalive_interval):
+            for base_uri in self.base_uris:
+                try:
+                    self.ping(base_uri)
+                except Exception:
+                    logger.exception(f"Could not ping the connections to {base_uri}.")
+
+    def ping(self, base_uri : str):
+        """
+        Pings the idle connections to a replica with a `HEAD` request on its base URI, re-establishing those which have
+        been closed.
+        """
+
+        pool = self._get_pool(base_uri)
+        if pool is None:
+            return
+
+        # the idle connections are taken out of the pool while they are pinged; the requests sent meanwhile open new ones.
+        connections = []
+        while True:
+            try:
+                connections.append(pool.pool.get(block = False))
+            except queue.Empty:
+                break
+
+        path = urlparse(base_uri).path or "/"
+        try:
+            for connection in connections:
+                if connection is None or connection.sock is None:
+                    continue
+                UPSTREAM_KEEPALIVE_PINGS.labels(self.name, self._ping_connection(connection, path)).inc()
+        finally:
+            for connection in connections:
+                try:
+                    pool.pool.put(connection, block = False)
+                except queue.Full:
+                    if connection is not None:
+                        connection.close()
+
+    def _ping_connection(self, connection, path : str) -> str:
+        """
+        Pings a connection (establishing it if needed), and establishes it again if it has been closed. A ping which
+        times out fails, since the replica is not answering.
+        """
+
+        try:
+            self._send_ping(connection, path)
+            return ALIVE_OUTCOME
+        except PING_TIMEOUT_EXCEPTIONS:
+            connection.close()
+            return FAILED_OUTCOME
+        except Exception:
+            connection.close()
+
+        try:
+            self._send_ping(connection, path)
+            return RECONNECTED_OUTCOME
+        except Exception:
+            connection.close()
+            return FAILED_OUTCOME
+
+    def _send_ping(self, connection, path : str):
+        # the connections taken from the pools have no timeout, which `urllib3` only sets when it sends a request.
+        connection.timeout = self.timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(self.timeout)
+        connection.request("HEAD", path)
+        connection.getresponse().read()
+
+class NotConnectionWarmer:
+    """
+    A class which provided the same API as the ConnectionWarmer class, but does not establish any connection.
+    """
+
+    def warm_up(self):
+        pass
+
+    def stop(self):
+        pass
@@ -0,0 +1,117 @@
+from contextvars import ContextVar
+import time
+
+from data_layer import api_exceptions
+
+class RequestDeadline:
+    """
+    A class which holds the deadline of one request.
+    """
+
+    def __init__(self, timeout : float, allow_partial : bool, is_cancelled = None):
+        """
+        Parameters:
+            timeout - the time budget of the request (in seconds), from now.
+            allow_partial - whether the request accepts a partial response once its deadline has passed.
+            is_cancelled - a function without parameters which tells whether the request has been cancelled (e.g. because
+                the client has disconnected), if any.
+        """
+
+        self.deadline = time.monotonic() + timeout
+        self.allow_partial = allow_partial
+        self.is_cancelled = is_cancelled
+        self.truncated = False
+
+    def get_remaining_time(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def check(self) -> float:
+        """
+        Checks that the request can go on.
+
+        Returns:
+            The remaining time (in seconds).
+
+        Raises:
+            api_exceptions.RequestCancelledException - if the request has been cancelled.
+            api_exceptions.DeadlineExceededException - if the deadline has passed.
+        """
+
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise api_exceptions.RequestCancelledException("The request has been cancelled.")
+
+        remaining_time = self.get_remaining_time()
+        if remaining_time <= 0:
+            raise api_exceptions.DeadlineExceededException("The deadline of the request has passed.")
+        return remaining_time
+
+class RequestDeadlines:
+    """
+    A class which holds the deadline of the request being processed in the current context (thread).
+
+    Requests processed outside of a deadline (e.g. the shadow runs) have no time budget.
+    """
+
+    def __init__(self):
+        self._current = ContextVar("request_deadline", default=None)
+
+    def start(self, timeout : float, allow_partial : bool = False, is_cancelled = None):
+        """
+        Starts the deadline of a new request in the current context.
+
+        Returns:
+            A token which must be passed to `stop`.
+        """
+
+        return self._current.set(RequestDeadline(timeout, allow_partial, is_cancelled))
+
+    def stop(self, token):
+        """
+        Stops the deadline of the request started with `token`.
+        """
+
+        self._current.reset(token)
+
+    def get_current(self) -> RequestDeadline:
+        """
+        Gets the deadline of the current request, or `None` if the current request has no deadline.
+        """
+
+        return self._current.get()
+
+    def get_timeout(self) -> float:
+        """
+        Gets the timeout of the next upstream call of the current request, i.e. its remaining time.
+
+        Returns:
+            The remaining time (in seconds), or `None` if the current request has no deadline.
+
+        Raises:
+            api_exceptions.RequestCancelledException - if the request has been cancelled.
+            api_exceptions.DeadlineExceededException - if the deadline has passed.
+        """
+
+        request_deadline = self._current.get()
+        if request_deadline is None:
+            return None
+        return request_deadline.check()
+
+    def truncate(self) -> bool:
+        """
+        Marks the current request as truncated, if it accepts a partial response.
+
+        Returns:
+            Whether the request has been truncated; otherwise, the caller must give up.
+        """
+
+        request_deadline = self._current.get()
+        if request_deadline is None or not request_deadline.allow_partial:
+            return False
+        request_deadline.truncated = True
+        return True
+
+    def is_truncated(self) -> bool:
+        request_deadline = self._current.get()
+        return request_deadline is not None and request_deadline.truncated
+
+deadlines = RequestDeadlines()
@@ -1,27 +1,22 @@
-from requests import Session
-from requests.auth import HTTPBasicAuth
-
-from app_settings import PRIVATE_DEMOGRAPHIC_API_BASE_URI, DEMOGRAPHIC_API_AUTH_USERNAME, DEMOGRAPHIC_API_AUTH_PASSWORD, VALIDATE_DEMOGRAPHIC_API_CERTIFICATE, USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE
-from data_layer import path_utils, api_exceptions
-from data_layer.ssl_extension import HostNameIgnoringAdapter
-
-base_uri = PRIVATE_DEMOGRAPHIC_API_BASE_URI
-validate_certificate = VALIDATE_DEMOGRAPHIC_API_CERTIFICATE
-use_custom_certificate = USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE
-api_auth = HTTPBasicAuth(username=DEMOGRAPHIC_API_AUTH_USERNAME, password=DEMOGRAPHIC_API_AUTH_PASSWORD)
-
-session = Session()
-
-extra_params = {}
-if base_uri.startswith("https"):
-    if validate_certificate:
-        if use_custom_certificate:
-            session.mount("https://", HostNameIgnoringAdapter())
-            certificate_path = path_utils.relative_path("other_certificates", "demographic_api_ca_certificate.pem")
-            extra_params["verify"] = certificate_path
-    else:
-        extra_params["verify"] = False
-
+from app_settings import PRIVATE_DEMOGRAPHIC_API_BASE_URIS, DEMOGRAPHIC_API_AUTH_USERNAME, DEMOGRAPHIC_API_AUTH_PASSWORD, VALIDATE_DEMOGRAPHIC_API_CERTIFICATE, USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE
+from data_layer import api_exceptions, rm_utils
+from data_layer.upstream_client import UpstreamClient
+from data_layer.revision_history_cache import revision_histories
+from data_layer.metrics import measure_upstream_call
+from data_layer.timing import timed, DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT, DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT, DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT, DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT, DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT, DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT, DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT
+
+client = UpstreamClient(
+    name = "demographic",
+    base_uris = PRIVATE_DEMOGRAPHIC_API_BASE_URIS,
+    username = DEMOGRAPHIC_API_AUTH_USERNAME,
+    password = DEMOGRAPHIC_API_AUTH_PASSWORD,
+    validate_certificate = VALIDATE_DEMOGRAPHIC_API_CERTIFICATE,
+    use_custom_certificate = USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE,
+    certificate_file_name = "demographic_api_ca_certificate.pem"
+)
+
+@timed.measure(DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT)
 def get_patient_by_version_id(version_id):
     """
     Retrieves particular version of the patient identified by `version_id`
@@ -31,13 +26,8 @@ def get_patient_by_version_id(version_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/patient/{version_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/patient/{version_id}"
         )
     except ConnectionError as e:
         raise e
@@ -52,6 +42,8 @@ def get_patient_by_version_id(version_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT)
 def get_patient_at_time(patient_id, version_at_time):
     """
     Retrieves a version of the patient identified by `patient_id`. If `version_at_time` is supplied,
@@ -62,16 +54,12 @@ def get_patient_at_time(patient_id, version_at_time):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/patient/{patient_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
+        response = client.get(
+            path = f"/v1/patient/{patient_id}",
             params = {
                 "version_at_time": version_at_time
             },
-            **extra_params
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -86,6 +74,8 @@ def get_patient_at_time(patient_id, version_at_time):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT)
 def get_versioned_patient(patient_id):
     """
     Retrieves a `VERSIONED_PARTY` identified by `patient_id`
@@ -95,13 +85,9 @@ def get_versioned_patient(patient_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}",
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -114,6 +100,8 @@ def get_versioned_patient(patient_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT)
 def get_versioned_patient_revision_history(patient_id):
     """
     Retrieves the revision history of the `VERSIONED_PARTY` identified by `patient_id`.
@@ -123,13 +111,9 @@ def get_versioned_patient_revision_history(patient_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}/revision_history",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}/revision_history",
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -147,6 +131,8 @@ def get_versioned_patient_revision_history(patient_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT)
 def get_versioned_patient_version_by_id(patient_id, version_id):
     """
     Retrieves a `VERSION` identified by `version_id` of a `VERSIONED_PARTY` identified by `patient_id`.
@@ -156,13 +142,9 @@ def get_versioned_patient_version_by_id(patient_id, version_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}/version/{version_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}/version/{version_id}",
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -175,6 +157,8 @@ def get_versioned_patient_version_by_id(patient_id, version_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT)
 def get_versioned_patient_version_at_time(patient_id, version_at_time):
     """
     Retrieves a `VERSION` from the `VERSIONED_PARTY` identified by `patient_id`.
@@ -186,16 +170,12 @@ def get_versioned_patient_version_at_time(patient_id, version_at_time):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}/version",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}/version",
             params = {
                 "version_at_time": version_at_time
             },
-            **extra_params
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -208,6 +188,8 @@ def get_versioned_patient_version_at_time(patient_id, version_at_time):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT)
 def list_patients():
     """
     Lists the IDs of all the patients in the system.
@@ -217,13 +199,8 @@ def list_patients():
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/patient",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = "/v1/patient"
         )
     except ConnectionError as e:
         raise e
@@ -234,6 +211,8 @@ def list_patients():
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT)
 def get_ehr_id_from_patient(patient_id):
     """
     Retrieves the EHR identifier associated with a given patient.
@@ -243,13 +222,9 @@ def get_ehr_id_from_patient(patient_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}/ehr",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}/ehr",
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -267,6 +242,8 @@ def get_ehr_id_from_patient(patient_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT)
 def get_contribution(patient_id, contribution_id):
     """
     Retrieves a contribution of a given patient
@@ -276,13 +253,9 @@ def get_contribution(patient_id, contribution_id):
     """
     # Sends the request to the openEHR server
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/versioned_patient/{patient_id}/contribution/{contribution_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/versioned_patient/{patient_id}/contribution/{contribution_id}",
+            affinity_key = patient_id
         )
     except ConnectionError as e:
         raise e
@@ -295,10 +268,15 @@ def get_contribution(patient_id, contribution_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT)
+@measure_upstream_call(DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT)
 def get_version_ids_of_patient(patient_id):
     """
     Lists the version IDS of a given patient.
 
+    The revision history is only downloaded and parsed again if it has changed (see `RevisionHistoryCache`), so the
+    returned array is shared and must not be modified.
+
     Parameters:
         patient_id - the ID of the patient.
 
@@ -306,42 +284,19 @@ def get_version_ids_of_patient(patient_id):
         An array where each element is a version ID.
     """
 
-    revision_history = get_versioned_patient_revision_history(patient_id)
-    # the response is a REVISION_HISTORY and has the following format:
-    # {
-    #     "items": [
-    #     {
-    #       "version_id": {
-    #         "value": <ID of version #1>
-    #       },
-    #       ...
-    #     },
-    #     {
-    #       "version_id": {
-    #         "value": <ID of version #2>
-    #       },
-    #       ...
-    #     },
-    #     {
-    #       "version_id": {
-    #         "value": <ID of version #3>
-    #       },
-    #       ...
-    #     },
-    #     ...
-    #   ]
-    # }
-    # documentation: https://specifications.openehr.org/releases/RM/latest/common.html#_revision_history_class
-
-    # the next code converts it to the following format:
-    # [
-    #   <ID of version #1>,
-    #   <ID of version #2>,
-    #   <ID of version #3>,
-    #   ...
-    # ]
-    patient_versions = []
-    for revision_history_item in revision_history["items"]:
-        patient_versions.append(revision_history_item["version_id"]["value"])
-
-    return patient_versions
+    try:
+        status_code, patient_versions = revision_histories.fetch(
+            client = client,
+            path = f"/v1/versioned_patient/{patient_id}/revision_history",
+            parse = rm_utils.extract_version_ids_from_revision_history,
+            affinity_key = patient_id
+        )
+    except ConnectionError as e:
+        raise e
+
+    if status_code == 200:
+        return patient_versions
+    elif status_code == 404:
+        raise api_exceptions.NotFoundException(f"A patient with {patient_id} does not exist.")
+    else:
+        raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {status_code}")
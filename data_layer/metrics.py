@@ -0,0 +1,40 @@
+from data_layer.metrics_collection import MetricsRegistry, NotMetricsRegistry
+from app_settings import INCLUDE_METRICS
+
+# the registry of all the metrics: those of the data layer, and those added by the business layer (see
+# `business_layer.metrics`).
+if INCLUDE_METRICS:
+    registry = MetricsRegistry()
+else:
+    registry = NotMetricsRegistry()
+
+# upstream API calls
+UPSTREAM_RESPONSES = registry.counter("upstream_responses", "HTTP responses received from the upstream APIs by API and status.", ["api", "status"])
+UPSTREAM_CALL_DURATION = registry.histogram("upstream_call_duration_seconds", "Duration of openehr_api and demographic_api functions.", ["function"])
+UPSTREAM_CALL_ERRORS = registry.counter("upstream_call_errors", "Exceptions raised by openehr_api and demographic_api functions.", ["function", "error"])
+
+# adaptive concurrency limits of the upstream APIs
+UPSTREAM_CONCURRENCY_LIMIT = registry.gauge("upstream_concurrency_limit", "Current concurrency limit of each upstream API.", ["api"])
+UPSTREAM_CONCURRENCY_LIMIT_CHANGES = registry.counter("upstream_concurrency_limit_changes", "Changes of the concurrency limit of each upstream API by direction (increase or decrease).", ["api", "direction"])
+UPSTREAM_CALLS_IN_FLIGHT = registry.gauge("upstream_calls_in_flight", "Calls currently sent to each upstream API.", ["api"])
+UPSTREAM_CONCURRENCY_WAIT = registry.histogram("upstream_concurrency_wait_seconds", "Time waited by the calls to each upstream API before being sent.", ["api"])
+
+# replicas of the upstream APIs
+UPSTREAM_REPLICA_OUTSTANDING = registry.gauge("upstream_replica_outstanding_calls", "Calls currently sent to each replica of the upstream APIs.", ["api", "replica"])
+UPSTREAM_REPLICA_EJECTIONS = registry.counter("upstream_replica_ejections", "Ejections of replicas of the upstream APIs after consecutive failures.", ["api", "replica"])
+
+# connections to the upstream APIs
+UPSTREAM_TLS_HANDSHAKES = registry.counter("upstream_tls_handshakes", "TLS handshakes with the upstream APIs by API and whether the TLS session was resumed.", ["api", "resumed"])
+UPSTREAM_TLS_HANDSHAKE_DURATION = registry.histogram("upstream_tls_handshake_duration_seconds", "Duration of the TLS handshakes with the upstream APIs.", ["api"])
+UPSTREAM_KEEPALIVE_PINGS = registry.counter("upstream_keepalive_pings", "Keep-alive pings of idle connections to the upstream APIs by outcome (alive, reconnected or failed).", ["api", "outcome"])
+UPSTREAM_HTTP_VERSIONS = registry.counter("upstream_http_versions", "Responses of the upstream APIs by HTTP version.", ["api", "version"])
+
+# revision history cache
+REVISION_HISTORY_FETCHES = registry.counter("revision_history_fetches", "Revision history fetches by API and outcome (not_modified, unchanged, changed or miss).", ["api", "outcome"])
+
+def measure_upstream_call(function_name : str):
+    """
+    Creates a decorator that measures the duration and the errors of an upstream API function.
+    """
+
+    return registry.measure_call(UPSTREAM_CALL_DURATION, UPSTREAM_CALL_ERRORS, function_name)
@@ -0,0 +1,299 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+import threading
+import time
+
+from data_layer.recording import is_recording
+
+# default histogram buckets (in seconds), from 1ms to 30s.
+DEFAULT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+def format_labels(label_names : list, label_values : tuple, extra : str = None) -> str:
+    """
+    Formats a set of labels in the OpenMetrics text format, e.g. `{api="openehr",status="200"}`.
+    """
+
+    parts = []
+    for name, value in zip(label_names, label_values):
+        escaped_value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped_value}"')
+    if extra is not None:
+        parts.append(extra)
+
+    if len(parts) == 0:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+def format_value(value : float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricFamily(ABC):
+    """
+    A named metric with a fixed set of label names, which holds one child per combination of label values.
+
+    The family lock is only taken when a new combination of label values is seen; each child has its own lock.
+    """
+
+    metric_type = None
+
+    def __init__(self, name : str, description : str, label_names : list):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *label_values):
+        """
+        Gets the child of this metric with the given label values (in the same order as the label names).
+        """
+
+        child = self._children.get(label_values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(label_values)
+                if child is None:
+                    child = self._create_child()
+                    self._children[label_values] = child
+        return child
+
+    @abstractmethod
+    def _create_child(self):
+        pass
+
+    def render(self) -> list:
+        """
+        Renders the metric in the OpenMetrics text format.
+
+        Returns:
+            A list of lines.
+        """
+
+        lines = [
+            f"# TYPE {self.name} {self.metric_type}",
+            f"# HELP {self.name} {self.description}"
+        ]
+        for label_values, child in list(self._children.items()):
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+    @abstractmethod
+    def _render_child(self, label_values : tuple, child) -> list:
+        pass
+
+class CounterChild:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        if not is_recording():
+            return
+
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+class Counter(MetricFamily):
+    """
+    A monotonically increasing counter.
+    """
+
+    metric_type = "counter"
+
+    def _create_child(self):
+        return CounterChild()
+
+    def _render_child(self, label_values : tuple, child : CounterChild) -> list:
+        return [f"{self.name}_total{format_labels(self.label_names, label_values)} {format_value(child.get())}"]
+
+class GaugeChild:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount = 1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def get(self):
+        return self._value
+
+class Gauge(MetricFamily):
+    """
+    A value which may go up and down.
+    """
+
+    metric_type = "gauge"
+
+    def _create_child(self):
+        return GaugeChild()
+
+    def _render_child(self, label_values : tuple, child : GaugeChild) -> list:
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(child.get())}"]
+
+class HistogramChild:
+    def __init__(self, buckets : list):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value : float):
+        if not is_recording():
+            return
+
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def get(self):
+        """
+        Gets the cumulative bucket counts and the sum of the observed values.
+        """
+
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+
+        cumulative_counts = []
+        cumulative_count = 0
+        for count in counts:
+            cumulative_count += count
+            cumulative_counts.append(cumulative_count)
+        return cumulative_counts, total_sum
+
+class Histogram(MetricFamily):
+    """
+    A distribution of observed values (e.g. durations) in fixed buckets.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name : str, description : str, label_names : list, buckets : list = None):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets if buckets is not None else DEFAULT_BUCKETS
+
+    def _create_child(self):
+        return HistogramChild(self.buckets)
+
+    def _render_child(self, label_values : tuple, child : HistogramChild) -> list:
+        cumulative_counts, total_sum = child.get()
+
+        lines = []
+        for upper_bound, cumulative_count in zip(self.buckets + [float("inf")], cumulative_counts):
+            labels = format_labels(self.label_names, label_values, f'le="{format_value(float(upper_bound))}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+        lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {cumulative_counts[-1]}")
+        lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {format_value(total_sum)}")
+        return lines
+
+class MetricsRegistry:
+    """
+    A class which holds metrics and renders them in the OpenMetrics text format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name : str, description : str, label_names : list = []) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name : str, description : str, label_names : list = []) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(self, name : str, description : str, label_names : list = [], buckets : list = None) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def _register(self, metric : MetricFamily) -> MetricFamily:
+        self._metrics.append(metric)
+        return metric
+
+    def measure_call(self, duration_histogram : Histogram, error_counter : Counter, function_name : str):
+        """
+        Creates a decorator that observes the execution time of a function in `duration_histogram`
+        and counts the exceptions it raises in `error_counter`, both labeled with `function_name`.
+        """
+
+        duration = duration_histogram.labels(function_name)
+
+        def wrapper(fn):
+            @wraps(fn)
+            def wrapped_function(*args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    error_counter.labels(function_name, type(e).__name__).inc()
+                    raise
+                finally:
+                    duration.observe(time.perf_counter() - start_time)
+            return wrapped_function
+        return wrapper
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the OpenMetrics text format.
+        """
+
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+class NotMetric:
+    """
+    A metric (or metric child) which ignores every update.
+    """
+
+    def labels(self, *label_values):
+        return self
+
+    def inc(self, amount = 1):
+        pass
+
+    def dec(self, amount = 1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value : float):
+        pass
+
+class NotMetricsRegistry:
+    """
+    A class which provided the same API as the MetricsRegistry class, but does not collect any metrics.
+    """
+
+    def counter(self, name : str, description : str, label_names : list = []) -> NotMetric:
+        return NotMetric()
+
+    def gauge(self, name : str, description : str, label_names : list = []) -> NotMetric:
+        return NotMetric()
+
+    def histogram(self, name : str, description : str, label_names : list = [], buckets : list = None) -> NotMetric:
+        return NotMetric()
+
+    def measure_call(self, duration_histogram, error_counter, function_name : str):
+        def wrapper(fn):
+            return fn
+        return wrapper
+
+    def render(self) -> str:
+        return "# EOF\n"
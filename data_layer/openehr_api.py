@@ -1,27 +1,22 @@
-from requests import Session
-from requests.auth import HTTPBasicAuth
-
-from app_settings import PRIVATE_OPENEHR_API_BASE_URI, OPENEHR_API_AUTH_USERNAME, OPENEHR_API_AUTH_PASSWORD, VALIDATE_OPENEHR_API_CERTIFICATE, USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE
-from data_layer import path_utils, api_exceptions
-from data_layer.ssl_extension import HostNameIgnoringAdapter
-
-base_uri = PRIVATE_OPENEHR_API_BASE_URI
-validate_certificate = VALIDATE_OPENEHR_API_CERTIFICATE
-use_custom_certificate = USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE
-api_auth = HTTPBasicAuth(username=OPENEHR_API_AUTH_USERNAME, password=OPENEHR_API_AUTH_PASSWORD)
-
-session = Session()
-
-extra_params = {}
-if base_uri.startswith("https"):
-    if validate_certificate:
-        if use_custom_certificate:
-            session.mount("https://", HostNameIgnoringAdapter())
-            certificate_path = path_utils.relative_path("other_certificates", "openehr_api_ca_certificate.pem")
-            extra_params["verify"] = certificate_path
-    else:
-        extra_params["verify"] = False
-
+from app_settings import PRIVATE_OPENEHR_API_BASE_URIS, OPENEHR_API_AUTH_USERNAME, OPENEHR_API_AUTH_PASSWORD, VALIDATE_OPENEHR_API_CERTIFICATE, USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE
+from data_layer import api_exceptions, rm_utils
+from data_layer.upstream_client import UpstreamClient
+from data_layer.revision_history_cache import revision_histories
+from data_layer.metrics import measure_upstream_call
+from data_layer.timing import timed, OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT, OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT, OPENEHR_GET_EHR_METADATA_MEASUREMENT, OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT, OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT, OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT, OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT, OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT
+
+client = UpstreamClient(
+    name = "openehr",
+    base_uris = PRIVATE_OPENEHR_API_BASE_URIS,
+    username = OPENEHR_API_AUTH_USERNAME,
+    password = OPENEHR_API_AUTH_PASSWORD,
+    validate_certificate = VALIDATE_OPENEHR_API_CERTIFICATE,
+    use_custom_certificate = USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE,
+    certificate_file_name = "openehr_api_ca_certificate.pem"
+)
+
+@timed.measure(OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT)
 def get_all_ehr_ids():
     """
     Get the IDs of all EHRs.
@@ -39,16 +34,11 @@ def get_all_ehr_ids():
     # operation name: "Execute ad-hoc (non-stored) AQL query".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/query.html#query-execute-query-get
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/query/aql",
-            auth = api_auth,
+        response = client.get(
+            path = "/v1/query/aql",
             params = {
                 "q": aql_query
-            },
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+            }
         )
     except ConnectionError as e:
         raise e
@@ -88,6 +78,8 @@ def get_all_ehr_ids():
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT)
 def get_all_composition_ids_and_names_of_ehr(ehr_id):
     """
     Gets IDs and names of all COMPOSITIONs of a given EHR.
@@ -108,16 +100,12 @@ def get_all_composition_ids_and_names_of_ehr(ehr_id):
     # operation name: "Execute ad-hoc (non-stored) AQL query".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/query.html#query-execute-query-get
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/query/aql",
-            auth = api_auth,
+        response = client.get(
+            path = "/v1/query/aql",
             params = {
                 "q": aql_query
             },
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
@@ -157,6 +145,8 @@ def get_all_composition_ids_and_names_of_ehr(ehr_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(OPENEHR_GET_EHR_METADATA_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_EHR_METADATA_MEASUREMENT)
 def get_ehr_metadata(ehr_id):
     """
     Gets the creation date and time of an EHR, the ID of its most recent version and the parameters "is queryable", "is modifiable" and "archetype_node_id".
@@ -177,13 +167,9 @@ def get_ehr_metadata(ehr_id):
     # operation name: "Get EHR summary by id".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/ehr.html#ehr-ehr-get
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/ehr/{ehr_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/ehr/{ehr_id}",
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
@@ -235,10 +221,15 @@ def get_ehr_metadata(ehr_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT)
 def get_version_ids_of_ehr_status(ehr_id):
     """
     Lists the version IDS of the EHR_STATUS of a given EHR.
 
+    The revision history is only downloaded and parsed again if it has changed (see `RevisionHistoryCache`), so the
+    returned array is shared and must not be modified.
+
     Parameters:
         ehr_id - the ID of the EHR.
 
@@ -250,68 +241,31 @@ def get_version_ids_of_ehr_status(ehr_id):
     # operation name: "Get versioned EHR_STATUS revision history".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/ehr.html#ehr_status-versioned_ehr_status-get-1
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/ehr/{ehr_id}/versioned_ehr_status/revision_history",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        status_code, ehr_status_versions = revision_histories.fetch(
+            client = client,
+            path = f"/v1/ehr/{ehr_id}/versioned_ehr_status/revision_history",
+            parse = rm_utils.extract_version_ids_from_revision_history,
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
 
-    if response.status_code == 200:
-        revision_history = response.json()
-        # the response is a REVISION_HISTORY and has the following format:
-        # [
-        #   {
-        #     "version_id": {
-        #       "value": <ID of version #1>
-        #     },
-        #     ...
-        #   },
-        #   {
-        #     "version_id": {
-        #       "value": <ID of version #2>
-        #     },
-        #     ...
-        #   },
-        #   {
-        #     "version_id": {
-        #       "value": <ID of version #3>
-        #     },
-        #     ...
-        #   },
-        #   ...
-        # ]
-        # documentation: https://specifications.openehr.org/releases/RM/latest/common.html#_revision_history_class
-
-        # fallback for REVISION_HISTORY which is a plain list.
-        if isinstance(revision_history, list):
-            revision_history = { "items": revision_history }
-
-        # the next code converts it to the following format:
-        # [
-        #   <ID of version #1>,
-        #   <ID of version #2>,
-        #   <ID of version #3>,
-        #   ...
-        # ]
-        ehr_status_versions = []
-        for revision_history_item in revision_history["items"]:
-            ehr_status_versions.append(revision_history_item["version_id"]["value"])
-
+    if status_code == 200:
         return ehr_status_versions
-    elif response.status_code == 404:
+    elif status_code == 404:
         raise api_exceptions.NotFoundException(f"An EHR with {ehr_id} does not exist.")
     else:
-        raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
+        raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {status_code}")
 
+@timed.measure(OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT)
 def get_version_ids_of_composition(ehr_id, composition_id):
     """
     Lists the version IDS of a given COMPOSITION of a given EHR.
 
+    The revision history is only downloaded and parsed again if it has changed (see `RevisionHistoryCache`), so the
+    returned array is shared and must not be modified.
+
     Parameters:
         ehr_id - the ID of the EHR which owns the COMPOSITION.
         composition_id - the ID of the composition.
@@ -324,66 +278,24 @@ def get_version_ids_of_composition(ehr_id, composition_id):
     # operation name: "Get versioned composition revision history".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/ehr.html#composition-versioned_composition-get-1
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/ehr/{ehr_id}/versioned_composition/{composition_id}/revision_history",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        status_code, composition_versions = revision_histories.fetch(
+            client = client,
+            path = f"/v1/ehr/{ehr_id}/versioned_composition/{composition_id}/revision_history",
+            parse = rm_utils.extract_version_ids_from_revision_history,
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
 
-    if response.status_code == 200:
-        revision_history = response.json()
-        # the response is a REVISION_HISTORY and has the following format:
-        # {
-        #     "items": [
-        #     {
-        #       "version_id": {
-        #         "value": <ID of version #1>
-        #       },
-        #       ...
-        #     },
-        #     {
-        #       "version_id": {
-        #         "value": <ID of version #2>
-        #       },
-        #       ...
-        #     },
-        #     {
-        #       "version_id": {
-        #         "value": <ID of version #3>
-        #       },
-        #       ...
-        #     },
-        #     ...
-        #   ]
-        # }
-        # documentation: https://specifications.openehr.org/releases/RM/latest/common.html#_revision_history_class
-
-        # fallback for REVISION_HISTORY which is a plain list.
-        if isinstance(revision_history, list):
-            revision_history = { "items": revision_history }
-
-        # the next code converts it to the following format:
-        # [
-        #   <ID of version #1>,
-        #   <ID of version #2>,
-        #   <ID of version #3>,
-        #   ...
-        # ]
-        composition_versions = []
-        for revision_history_item in revision_history["items"]:
-            composition_versions.append(revision_history_item["version_id"]["value"])
-
+    if status_code == 200:
         return composition_versions
-    elif response.status_code == 404:
+    elif status_code == 404:
         raise api_exceptions.NotFoundException(f"An EHR with {ehr_id} does not exist or a VERSIONED_COMPOSITION with {composition_id} does not exist.")
     else:
-        raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
+        raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {status_code}")
 
+@timed.measure(OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT)
 def get_versioned_ehr_status_version_by_id(ehr_id, version_id):
     """
     Retrieves a `VERSION` identified by `version_id` of a `VERSIONED_EHR_STATUS` of the `EHR` identified by `ehr_id`.
@@ -400,13 +312,9 @@ def get_versioned_ehr_status_version_by_id(ehr_id, version_id):
     # operation name: "Get versioned EHR_STATUS version by id".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/ehr.html#ehr_status-versioned_ehr_status-get-3
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/ehr/{ehr_id}/versioned_ehr_status/version/{version_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/ehr/{ehr_id}/versioned_ehr_status/version/{version_id}",
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
@@ -419,6 +327,8 @@ def get_versioned_ehr_status_version_by_id(ehr_id, version_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT)
 def get_versioned_composition_version_by_id(ehr_id, composition_id, version_id):
     """
     Retrieves a `VERSION` identified by `version_id` of a `VERSIONED_COMPOSITION` identifier by `composition_id` or the `EHR` identified by `ehr_id`.
@@ -436,13 +346,9 @@ def get_versioned_composition_version_by_id(ehr_id, composition_id, version_id):
     # operation name: "Get versioned composition version by id".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/ehr.html#composition-versioned_composition-get-2
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/ehr/{ehr_id}/versioned_composition/{composition_id}/version/{version_id}",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = f"/v1/ehr/{ehr_id}/versioned_composition/{composition_id}/version/{version_id}",
+            affinity_key = ehr_id
         )
     except ConnectionError as e:
         raise e
@@ -455,6 +361,8 @@ def get_versioned_composition_version_by_id(ehr_id, composition_id, version_id):
     else:
         raise api_exceptions.UnknownException(f"An unknown error has occured. The status code is {response.status_code}")
 
+@timed.measure(OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT)
+@measure_upstream_call(OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT)
 def get_templates_ids_and_names():
     """
     Lists the IDs and names of all available templates.
@@ -467,13 +375,8 @@ def get_templates_ids_and_names():
     # operation name: "List ADL 1.4 templates".
     # documentation: https://specifications.openehr.org/releases/ITS-REST/latest/definitions.html#definitions-adl-1.4-template-get
     try:
-        response = session.get(
-            url = f"{base_uri}/v1/definition/template/adl1.4",
-            auth = api_auth,
-            headers = {
-                "Accept": "application/json"
-            },
-            **extra_params
+        response = client.get(
+            path = "/v1/definition/template/adl1.4"
         )
     except ConnectionError as e:
         raise e
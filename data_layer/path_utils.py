@@ -2,7 +2,12 @@
 # Based on <https://stackoverflow.com/a/1676860> and <https://stackoverflow.com/a/248862>
 import sys, os
 main_module = sys.modules["__main__"]
-base_path = os.path.dirname(os.path.abspath(main_module.__file__))
+if hasattr(main_module, "__file__"):
+    base_path = os.path.dirname(os.path.abspath(main_module.__file__))
+else:
+    # the main module has no file in the processes spawned by `multiprocessing` (e.g. by `export.py`) while they import
+    # it, and in interactive sessions: the entry points are in the root folder of the repository.
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 def relative_path(*args):
     return os.path.join(base_path, *args)
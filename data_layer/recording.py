@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# whether the measurements taken in the current context (thread) are recorded.
+_recording = ContextVar("recording", default=True)
+
+def is_recording() -> bool:
+    return _recording.get()
+
+@contextmanager
+def unrecorded():
+    """
+    Runs a block of code without recording its samples in the usage statistics nor its events (counters and histograms)
+    in the metrics, e.g. the shadow runs, which are not part of the served traffic.
+
+    The gauges still change, since they describe the current state of the process (e.g. the calls in flight).
+    """
+
+    token = _recording.set(False)
+    try:
+        yield
+    finally:
+        _recording.reset(token)
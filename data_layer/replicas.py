@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+
+from data_layer.metrics import UPSTREAM_REPLICA_OUTSTANDING, UPSTREAM_REPLICA_EJECTIONS
+
+# the balancing strategies.
+LEAST_OUTSTANDING_BALANCING = "least_outstanding"
+LATENCY_WEIGHTED_BALANCING = "latency_weighted"
+BALANCING_STRATEGIES = [LEAST_OUTSTANDING_BALANCING, LATENCY_WEIGHTED_BALANCING]
+
+# the weight of the latest call in the moving average of the latency of a replica.
+LATENCY_SMOOTHING = 0.1
+# the factor applied to the average latency of a replica when one of its calls fails.
+FAILURE_LATENCY_PENALTY = 2.0
+
+class Replica:
+    """
+    A replica of an upstream API, with the state used to balance the calls.
+    """
+
+    def __init__(self, base_uri : str):
+        self.base_uri = base_uri
+        self.outstanding = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now : float) -> bool:
+        return now < self.ejected_until
+
+    def get_affinity_weight(self, affinity_key : str) -> int:
+        """
+        Gets the weight of the replica for a key (rendezvous hashing): the replica with the highest weight is chosen.
+        """
+
+        digest = hashlib.blake2b(f"{affinity_key}|{self.base_uri}".encode("utf-8"), digest_size = 8).digest()
+        return int.from_bytes(digest, "big")
+
+class ReplicaSet:
+    """
+    Balances the calls to an upstream API across its replicas.
+
+    Each call goes to the healthy replica with the fewest outstanding calls (or, with latency-weighted balancing, with the
+    lowest expected latency, i.e. its average latency times its outstanding calls plus one), the ties being broken in
+    turn. If an affinity key is given (e.g. the ID of the EHR) and hashing is enabled, the calls with the same key go to
+    the same healthy replica instead, so that the caches of the replicas stay warm.
+
+    A replica whose calls fail several times in a row is ejected for some time (passive health checking). If every
+    replica is ejected, the calls are balanced across all of them.
+    """
+
+    def __init__(self, name : str, base_uris : list, balancing : str, use_affinity : bool, ejection_failures : int, ejection_duration : float):
+        """
+        Parameters:
+            name - the name of the upstream API, used in the metrics.
+            base_uris - the base URIs of the replicas.
+            balancing - the balancing strategy (see `BALANCING_STRATEGIES`).
+            use_affinity - whether the calls with an affinity key are sent to the replica chosen by hashing the key.
+            ejection_failures - the number of consecutive failures after which a replica is ejected.
+            ejection_duration - the duration (in seconds) of the ejections.
+        """
+
+        if len(base_uris) == 0:
+            raise ValueError(f"No base URI for the {name} API.")
+        if balancing not in BALANCING_STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy: {balancing}. The strategies are: {', '.join(BALANCING_STRATEGIES)}.")
+
+        self.name = name
+        self.replicas = [Replica(base_uri) for base_uri in base_uris]
+        self.balancing = balancing
+        self.use_affinity = use_affinity
+        self.ejection_failures = ejection_failures
+        self.ejection_duration = ejection_duration
+
+        self._lock = threading.Lock()
+        self._rotation = 0
+
+    def acquire(self, affinity_key : str = None) -> Replica:
+        """
+        Chooses the replica of a call.
+
+        Parameters:
+            affinity_key - the key which identifies the data of the call (e.g. the ID of the EHR), if any.
+
+        Returns:
+            The replica, which must be passed to `release` once the call has completed.
+        """
+
+        with self._lock:
+            if len(self.replicas) == 1:
+                replica = self.replicas[0]
+            else:
+                now = time.monotonic()
+                candidates = [replica for replica in self.replicas if not replica.is_ejected(now)] or self.replicas
+                # the candidates are rotated, so that the ties are broken in turn.
+                self._rotation = (self._rotation + 1) % len(candidates)
+                candidates = candidates[self._rotation:] + candidates[:self._rotation]
+                if affinity_key is not None and self.use_affinity:
+                    replica = max(candidates, key = lambda replica: replica.get_affinity_weight(affinity_key))
+                elif self.balancing == LATENCY_WEIGHTED_BALANCING:
+                    # the replicas without measured latency are tried first.
+                    replica = min(candidates, key = lambda replica: (replica.outstanding + 1) * replica.latency if replica.latency is not None else -1.0)
+                else:
+                    replica = min(candidates, key = lambda replica: replica.outstanding)
+
+            replica.outstanding += 1
+            UPSTREAM_REPLICA_OUTSTANDING.labels(self.name, replica.base_uri).set(replica.outstanding)
+        return replica
+
+    def release(self, replica : Replica, latency : float, failed : bool):
+        """
+        Records a completed call to a replica, ejecting the replica after too many consecutive failures.
+
+        Parameters:
+            replica - the replica returned by `acquire`.
+            latency - the duration of the call (in seconds), or `None` if the call was abandoned (e.g. when the deadline of
+                its request passed), in which case it tells nothing about the replica and is not recorded.
+            failed - whether the call failed because of the replica (e.g. a connection error or a 5xx response).
+        """
+
+        with self._lock:
+            replica.outstanding -= 1
+            UPSTREAM_REPLICA_OUTSTANDING.labels(self.name, replica.base_uri).set(replica.outstanding)
+
+            if latency is None:
+                return
+
+            if replica.latency is None:
+                replica.latency = latency
+            elif failed:
+                # failures are often fast, so they must not make the replica look faster.
+                replica.latency = FAILURE_LATENCY_PENALTY * max(latency, replica.latency)
+            else:
+                replica.latency += LATENCY_SMOOTHING * (latency - replica.latency)
+
+            if not failed:
+                replica.consecutive_failures = 0
+                return
+
+            replica.consecutive_failures += 1
+            if replica.consecutive_failures >= self.ejection_failures and len(self.replicas) > 1:
+                replica.consecutive_failures = 0
+                replica.ejected_until = time.monotonic() + self.ejection_duration
+                UPSTREAM_REPLICA_EJECTIONS.labels(self.name, replica.base_uri).inc()
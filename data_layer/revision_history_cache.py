@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+from data_layer.metrics import REVISION_HISTORY_FETCHES
+from app_settings import REVISION_HISTORY_CACHE_SIZE
+
+# outcomes of the revision history fetches.
+NOT_MODIFIED_OUTCOME = "not_modified"
+UNCHANGED_OUTCOME = "unchanged"
+CHANGED_OUTCOME = "changed"
+MISS_OUTCOME = "miss"
+
+class CachedRevisionHistory:
+    """
+    A revision history parsed from a response of an upstream API, with the validators of the response.
+    """
+
+    def __init__(self, etag : str, last_modified : str, content_hash : bytes, value):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.value = value
+
+def hash_content(content : bytes) -> bytes:
+    return hashlib.blake2b(content, digest_size = 16).digest()
+
+class RevisionHistoryCache:
+    """
+    Caches the parsed revision histories of the versioned objects (least recently used first out), so that they are only
+    downloaded and parsed again when they have changed.
+
+    The revision histories are fetched again on every request, but conditionally: if the upstream API sent an `ETag` (or
+    a `Last-Modified`) header with the cached revision history, the request has an `If-None-Match` (or an
+    `If-Modified-Since`) header, and the cached revision history is reused when the upstream API answers with a 304 (Not
+    Modified) response. Otherwise, the cached revision history is reused when the content of the new response has the same
+    hash, which saves parsing it.
+    """
+
+    def __init__(self, max_entries : int):
+        """
+        Parameters:
+            max_entries - the maximum number of cached revision histories.
+        """
+
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fetch(self, client, path : str, parse, affinity_key : str = None) -> tuple:
+        """
+        Fetches a revision history from an upstream API, reusing the cached one if it has not changed.
+
+        The parsed revision histories are shared by every request, so they must not be modified.
+
+        Parameters:
+            client - the `UpstreamClient` of the upstream API.
+            path - the path of the revision history, relative to the base URI.
+            parse - a function which parses the revision history from the JSON content of the response.
+            affinity_key - the ID of the EHR or patient of the revision history (see `UpstreamClient.get`).
+
+        Returns:
+            A tuple with the status of the response (200 if the cached revision history is reused) and the parsed revision
+            history (`None` if the status is not 200).
+        """
+
+        key = (client.name, path)
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            elif entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = client.get(path = path, headers = headers, affinity_key = affinity_key)
+
+        if response.status_code == 304 and entry is not None:
+            self._put(key, entry)
+            REVISION_HISTORY_FETCHES.labels(client.name, NOT_MODIFIED_OUTCOME).inc()
+            return 200, entry.value
+        elif response.status_code != 200:
+            if response.status_code == 404:
+                self._remove(key)
+            return response.status_code, None
+
+        content_hash = hash_content(response.content)
+        if entry is not None and entry.content_hash == content_hash:
+            value = entry.value
+            REVISION_HISTORY_FETCHES.labels(client.name, UNCHANGED_OUTCOME).inc()
+        else:
+            value = parse(response.json())
+            REVISION_HISTORY_FETCHES.labels(client.name, MISS_OUTCOME if entry is None else CHANGED_OUTCOME).inc()
+
+        self._put(key, CachedRevisionHistory(response.headers.get("ETag", None), response.headers.get("Last-Modified", None), content_hash, value))
+        return 200, value
+
+    def _put(self, key : tuple, entry : CachedRevisionHistory):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def _remove(self, key : tuple):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class NotRevisionHistoryCache:
+    """
+    A class which provided the same API as the RevisionHistoryCache class, but does not cache any revision history.
+    """
+
+    def fetch(self, client, path : str, parse, affinity_key : str = None) -> tuple:
+        response = client.get(path = path, affinity_key = affinity_key)
+        if response.status_code != 200:
+            return response.status_code, None
+        return 200, parse(response.json())
+
+if REVISION_HISTORY_CACHE_SIZE > 0:
+    revision_histories = RevisionHistoryCache(REVISION_HISTORY_CACHE_SIZE)
+else:
+    revision_histories = NotRevisionHistoryCache()
@@ -55,3 +55,47 @@ def extract_committer_name_or_id_from_version(version : dict) -> dict:
             committer_name_or_id = committer["identifiers"][0]["id"]
 
     return committer_name_or_id
+
+def extract_version_ids_from_revision_history(revision_history) -> list:
+    # the REVISION_HISTORY has the following format:
+    # {
+    #     "items": [
+    #     {
+    #       "version_id": {
+    #         "value": <ID of version #1>
+    #       },
+    #       ...
+    #     },
+    #     {
+    #       "version_id": {
+    #         "value": <ID of version #2>
+    #       },
+    #       ...
+    #     },
+    #     {
+    #       "version_id": {
+    #         "value": <ID of version #3>
+    #       },
+    #       ...
+    #     },
+    #     ...
+    #   ]
+    # }
+    # documentation: https://specifications.openehr.org/releases/RM/latest/common.html#_revision_history_class
+
+    # fallback for REVISION_HISTORY which is a plain list.
+    if isinstance(revision_history, list):
+        revision_history = { "items": revision_history }
+
+    # the next code converts it to the following format:
+    # [
+    #   <ID of version #1>,
+    #   <ID of version #2>,
+    #   <ID of version #3>,
+    #   ...
+    # ]
+    version_ids = []
+    for revision_history_item in revision_history["items"]:
+        version_ids.append(revision_history_item["version_id"]["value"])
+
+    return version_ids
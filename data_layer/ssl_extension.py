@@ -1,14 +1,150 @@
+import ssl
+import threading
+import time
+import weakref
+
+import certifi
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.poolmanager import PoolManager
+
+from data_layer.metrics import UPSTREAM_TLS_HANDSHAKES, UPSTREAM_TLS_HANDSHAKE_DURATION
+
+class MeasuredSSLObject(ssl.SSLObject):
+    """
+    A TLS connection over memory buffers (used by asynchronous clients), whose handshake is measured once completed.
+    """
+
+    def do_handshake(self):
+        if getattr(self, "_handshake_start_time", None) is None:
+            self._handshake_start_time = time.perf_counter()
+        # raises `ssl.SSLWantReadError` until the handshake has completed.
+        super().do_handshake()
+        self.context.record_handshake(self, time.perf_counter() - self._handshake_start_time)
+
+class SessionReusingSSLContext(ssl.SSLContext):
+    """
+    An SSL context which resumes the last TLS session (or session ticket) of each server on its new connections, so that
+    only the first connection to a server does a full handshake, and which measures the handshakes.
+
+    The context trusts no certificate authority until some are loaded (see `make_ssl_context`), and does not check the
+    hostnames unless `check_hostname` is set: `urllib3` checks them itself.
+    """
+
+    sslobject_class = MeasuredSSLObject
+
+    def __new__(cls, api_name : str):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, api_name : str):
+        """
+        Parameters:
+            api_name - the name of the upstream API, used in the metrics.
+        """
+
+        super().__init__()
+        self.api_name = api_name
+        self.check_hostname = False
+        self.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.options |= ssl.OP_NO_COMPRESSION
+
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_sockets = {}
+
+    def _get_session(self, server_hostname : str):
+        with self._lock:
+            # with TLS 1.3, the session tickets are received after the handshake, so the session of the last connection is
+            # read as late as possible.
+            last_socket = self._last_sockets.get(server_hostname, lambda: None)()
+            if last_socket is not None:
+                try:
+                    session = last_socket.session
+                except (OSError, ValueError):
+                    session = None
+                if session is not None:
+                    self._sessions[server_hostname] = session
+            return self._sessions.get(server_hostname, None)
+
+    def wrap_socket(self, sock, server_side = False, do_handshake_on_connect = True, suppress_ragged_eofs = True, server_hostname = None, session = None):
+        if session is None and not server_side:
+            session = self._get_session(server_hostname)
+
+        start_time = time.perf_counter()
+        try:
+            ssl_socket = super().wrap_socket(sock, server_side = server_side, do_handshake_on_connect = do_handshake_on_connect,
+                suppress_ragged_eofs = suppress_ragged_eofs, server_hostname = server_hostname, session = session)
+        except ssl.SSLError:
+            # the session may have been rejected (e.g. expired), so the next connection does a full handshake.
+            with self._lock:
+                self._sessions.pop(server_hostname, None)
+                self._last_sockets.pop(server_hostname, None)
+            raise
+
+        if do_handshake_on_connect:
+            self.record_handshake(ssl_socket, time.perf_counter() - start_time)
+
+        with self._lock:
+            self._last_sockets[server_hostname] = weakref.ref(ssl_socket)
+        return ssl_socket
+
+    def wrap_bio(self, incoming, outgoing, server_side = False, server_hostname = None, session = None):
+        if session is None and not server_side:
+            session = self._get_session(server_hostname)
+
+        ssl_object = super().wrap_bio(incoming, outgoing, server_side = server_side, server_hostname = server_hostname, session = session)
+        with self._lock:
+            self._last_sockets[server_hostname] = weakref.ref(ssl_object)
+        return ssl_object
+
+    def record_handshake(self, ssl_connection, duration : float):
+        UPSTREAM_TLS_HANDSHAKE_DURATION.labels(self.api_name).observe(duration)
+        UPSTREAM_TLS_HANDSHAKES.labels(self.api_name, "yes" if ssl_connection.session_reused else "no").inc()
+
+def make_ssl_context(api_name : str, validate_certificate : bool, custom_certificate_path : str = None, check_hostname : bool = False) -> SessionReusingSSLContext:
+    """
+    Makes the SSL context of the connections to an upstream API in one verification mode. Each mode has its own context,
+    since `urllib3` changes the verification of the contexts that it uses.
+
+    Parameters:
+        api_name - the name of the upstream API, used in the metrics.
+        validate_certificate - whether the certificates of the upstream API are verified.
+        custom_certificate_path - the path of the root CA certificate which is trusted instead of the public certificate
+            authorities (`certifi`), if any.
+        check_hostname - whether the context checks the hostnames against the certificates of the public certificate
+            authorities, when the client does not check them itself.
+
+    Returns:
+        The SSL context.
+    """
+
+    ssl_context = SessionReusingSSLContext(api_name)
+    if not validate_certificate:
+        ssl_context.verify_mode = ssl.CERT_NONE
+    elif custom_certificate_path is not None:
+        # only the custom root CA is trusted; as before, the hostnames are not checked against its certificates.
+        ssl_context.load_verify_locations(custom_certificate_path)
+    else:
+        ssl_context.load_verify_locations(certifi.where())
+        ssl_context.check_hostname = check_hostname
+    return ssl_context
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+    A `requests` transport adapter whose HTTPS connections use a given SSL context.
+    """
+
+    def __init__(self, ssl_context : ssl.SSLContext = None, **kwargs):
+        # the pool manager is initialized by the constructor of HTTPAdapter, so the context must be set before.
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block = False, **pool_kwargs):
+        if self.ssl_context is not None:
+            pool_kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
 
 # source: <https://stackoverflow.com/a/22794281/6242158>
 
 # Never check any hostnames
-class HostNameIgnoringAdapter(HTTPAdapter):
-    def init_poolmanager(self, connections, maxsize, block=False):
-        self.poolmanager = PoolManager(
-            num_pools = connections,
-            maxsize = maxsize,
-            block = block,
-            assert_hostname = False
-        )
+class HostNameIgnoringAdapter(SSLContextAdapter):
+    def init_poolmanager(self, connections, maxsize, block = False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, assert_hostname = False, **pool_kwargs)
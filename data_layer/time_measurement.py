@@ -1,70 +1,309 @@
+from array import array
+from bisect import bisect_left
+from contextvars import ContextVar
 from functools import wraps
+import heapq
+from itertools import count
+import threading
 import time
 
+from data_layer.recording import is_recording
+
+# label set identifier of the samples without labels.
+NO_LABEL_SET_ID = -1
+
 class CircularBuffer:
     """
-    A very, very simple circular buffer.
+    A circular buffer of timestamped samples.
+
+    The timestamps and the values are stored in compact arrays of doubles, along with an array of label set
+    identifiers, and every operation is protected by a lock.
     """
 
     def __init__(self, amount : int):
+        self._lock = threading.Lock()
         self._initial_index = 0
         self._amount = 0
-        self._buffer = [0.0] * amount
+        self._newest_dropped_timestamp = None
+        self._timestamps = array("d", bytes(8 * amount))
+        self._values = array("d", bytes(8 * amount))
+        self._label_set_ids = array("l", [NO_LABEL_SET_ID]) * amount
 
-    def add(self, value : float):
+    def add(self, value : float, timestamp : float = None, label_set_id : int = NO_LABEL_SET_ID):
         """
-        Adds a value to the circular buffer.
+        Adds a value, measured at a given timestamp and identified by a label set, to the circular buffer.
+
+        If no timestamp is given, it is taken while the lock is held, so the samples remain sorted by timestamp.
         """
 
-        final_index = (self._initial_index + self._amount) % len(self._buffer)
-        self._buffer[final_index] = value
-        if self._amount < len(self._buffer):
-            self._amount += 1
-        else:
-            self._initial_index = (self._initial_index + 1) % len(self._buffer)
+        with self._lock:
+            if timestamp is None:
+                timestamp = time.monotonic()
+            final_index = (self._initial_index + self._amount) % len(self._values)
+            if self._amount == len(self._values):
+                self._newest_dropped_timestamp = self._timestamps[final_index]
+            self._timestamps[final_index] = timestamp
+            self._values[final_index] = value
+            self._label_set_ids[final_index] = label_set_id
+            if self._amount < len(self._values):
+                self._amount += 1
+            else:
+                self._initial_index = (self._initial_index + 1) % len(self._values)
 
     def clear(self):
         """
         Clears the circular buffer.
         """
 
-        self._initial_index = 0
-        self._amount = 0
+        with self._lock:
+            self._initial_index = 0
+            self._amount = 0
+            self._newest_dropped_timestamp = None
 
-    def to_list(self) -> list:
+    def get_newest_dropped_timestamp(self) -> float:
         """
-        Converts the contents of the buffer to a list.
+        Gets the timestamp of the newest sample overwritten so far, or `None` if no sample was overwritten.
         """
 
-        if self._amount == 0:
-            return []
+        with self._lock:
+            return self._newest_dropped_timestamp
 
-        final_index = (self._initial_index + self._amount) % len(self._buffer)
-        if final_index > self._initial_index:
-            return self._buffer[self._initial_index:final_index]
-        else:
-            return self._buffer[self._initial_index:]+self._buffer[:final_index]
+    def to_lists(self) -> tuple:
+        """
+        Converts the contents of the buffer to a list of timestamps, a list of values and a list of label set identifiers,
+        from the oldest to the newest sample.
+        """
+
+        with self._lock:
+            if self._amount == 0:
+                return [], [], []
+
+            final_index = (self._initial_index + self._amount) % len(self._values)
+            if final_index > self._initial_index:
+                timestamps = self._timestamps[self._initial_index:final_index]
+                values = self._values[self._initial_index:final_index]
+                label_set_ids = self._label_set_ids[self._initial_index:final_index]
+            else:
+                timestamps = self._timestamps[self._initial_index:] + self._timestamps[:final_index]
+                values = self._values[self._initial_index:] + self._values[:final_index]
+                label_set_ids = self._label_set_ids[self._initial_index:] + self._label_set_ids[:final_index]
+
+        return timestamps.tolist(), values.tolist(), label_set_ids.tolist()
+
+class StripedCircularBuffer:
+    """
+    A set of circular buffers ("stripes") which may be written concurrently by several threads.
+
+    Each thread is assigned a stripe in round-robin order the first time it writes, so concurrent writers seldom
+    wait for the same lock.
+    On read, the stripes are merged by timestamp and the newest `amount` samples are kept, so the buffer holds the
+    newest `amount` samples however they are spread over the threads.
+    """
+
+    def __init__(self, amount : int, stripes : int = 4):
+        self._amount = amount
+        self._stripes = [CircularBuffer(amount) for _ in range(stripes)]
+        self._next_stripe_indices = count()
+        self._thread_state = threading.local()
+
+    def add(self, value : float, label_set_id : int = NO_LABEL_SET_ID):
+        """
+        Adds a value, identified by a label set, to the stripe of the current thread.
+
+        The timestamp is taken while the stripe is locked, so that every stripe remains sorted by timestamp.
+        """
+
+        stripe_index = getattr(self._thread_state, "stripe_index", None)
+        if stripe_index is None:
+            # itertools.count is atomic under the GIL.
+            stripe_index = next(self._next_stripe_indices) % len(self._stripes)
+            self._thread_state.stripe_index = stripe_index
+        self._stripes[stripe_index].add(value, label_set_id = label_set_id)
+
+    def clear(self):
+        for stripe in self._stripes:
+            stripe.clear()
+
+    def to_lists(self) -> tuple:
+        """
+        Converts the contents of the buffer to a list of timestamps, a list of values and a list of label set identifiers,
+        from the oldest to the newest sample.
+
+        Returns:
+            The three lists, and the timestamp of the newest sample dropped so far (`None` if no sample was dropped),
+            either by a stripe or by keeping the newest `amount` samples.
+        """
+
+        stripe_lists = [stripe.to_lists() for stripe in self._stripes]
+        # read after the samples, so that a sample dropped in the meantime is reported rather than missed.
+        dropped_timestamps = [stripe.get_newest_dropped_timestamp() for stripe in self._stripes]
+
+        samples = list(heapq.merge(*[zip(*lists) for lists in stripe_lists]))
+        if len(samples) > self._amount:
+            dropped_timestamps.append(samples[-self._amount - 1][0])
+            samples = samples[-self._amount:]
+
+        dropped_timestamps = [timestamp for timestamp in dropped_timestamps if timestamp is not None]
+        newest_dropped_timestamp = max(dropped_timestamps) if len(dropped_timestamps) > 0 else None
+
+        if len(samples) == 0:
+            return [], [], [], newest_dropped_timestamp
+
+        timestamps, values, label_set_ids = zip(*samples)
+        return list(timestamps), list(values), list(label_set_ids), newest_dropped_timestamp
+
+def compute_statistics(values : list, window : float) -> dict:
+    """
+    Computes the rate (samples per second) and the latency statistics of the samples taken in a time window.
+
+    Parameters:
+        values - the samples, in seconds.
+        window - the length of the time window, in seconds.
+
+    Returns:
+        A dictionary with the count, rate, mean, percentiles and maximum of the samples.
+    """
+
+    if len(values) == 0:
+        return {
+            "count": 0,
+            "rate": 0.0
+        }
+
+    sorted_values = sorted(values)
+
+    def percentile(p):
+        return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+    return {
+        "count": len(sorted_values),
+        "rate": len(sorted_values) / window,
+        "mean": sum(sorted_values) / len(sorted_values),
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "p99": percentile(0.99),
+        "max": sorted_values[-1]
+    }
+
+class TimedSnapshot:
+    """
+    The samples of a timed group at a given time, from which several statistics can be computed while the buffer
+    is read (and its stripes merged) only once.
+    """
+
+    def __init__(self, timestamp : float, timestamps : list, values : list, label_set_ids : list, newest_dropped_timestamp : float, get_label_set):
+        self._timestamp = timestamp
+        self._timestamps = timestamps
+        self._values = values
+        self._label_set_ids = label_set_ids
+        self._newest_dropped_timestamp = newest_dropped_timestamp
+        self._get_label_set = get_label_set
+
+    def get_samples(self) -> list:
+        return self._values
+
+    def get_window_statistics(self, window : float, get_group_key = None) -> dict:
+        """
+        Computes the statistics of the samples taken in the last `window` seconds.
+
+        If `get_group_key` is provided, the samples are grouped by the value it returns for the labels of each
+        sample (a dictionary, empty if the sample has no labels), and this method returns one set of statistics per group.
+
+        If the buffer has already dropped samples taken in this window, the statistics are computed
+        over the retained samples only and are marked as `truncated`.
+        """
+
+        window_start = self._timestamp - window
+        truncated = self._newest_dropped_timestamp is not None and self._newest_dropped_timestamp >= window_start
+
+        first_index = bisect_left(self._timestamps, window_start)
+
+        if get_group_key is None:
+            statistics = compute_statistics(self._values[first_index:], window)
+            statistics["truncated"] = truncated
+            return statistics
+
+        grouped_values = {}
+        for value, label_set_id in zip(self._values[first_index:], self._label_set_ids[first_index:]):
+            group_key = get_group_key(self._get_label_set(label_set_id))
+            grouped_values.setdefault(group_key, []).append(value)
+
+        grouped_statistics = {}
+        for group_key, group_values in grouped_values.items():
+            statistics = compute_statistics(group_values, window)
+            statistics["truncated"] = truncated
+            grouped_statistics[group_key] = statistics
+        return grouped_statistics
 
 class TimedGroup:
     """
     A group of functions timed as a group.
+
+    Each sample may carry labels (e.g. `{"status": 200}`), which allow the samples to be aggregated by dimension.
     """
 
     def __init__(self, max_samples : int):
-        self._samples = CircularBuffer(max_samples)
+        self._samples = StripedCircularBuffer(max_samples)
+        self._label_sets = []
+        self._label_set_ids = {}
+        self._label_sets_lock = threading.Lock()
+
+    def take_snapshot(self) -> TimedSnapshot:
+        """
+        Takes a snapshot of the samples, to compute several statistics from the same samples.
+        """
+
+        timestamps, values, label_set_ids, newest_dropped_timestamp = self._samples.to_lists()
+        return TimedSnapshot(time.monotonic(), timestamps, values, label_set_ids, newest_dropped_timestamp, self._get_label_set)
 
     def get_samples(self) -> list:
-        return self._samples.to_list()
+        return self.take_snapshot().get_samples()
+
+    def get_window_statistics(self, window : float, get_group_key = None) -> dict:
+        """
+        Computes the statistics of the samples taken in the last `window` seconds (see `TimedSnapshot.get_window_statistics`).
+        """
 
-    def add_sample(self, value : float):
-        self._samples.add(value)
+        return self.take_snapshot().get_window_statistics(window, get_group_key)
+
+    def add_sample(self, value : float, labels : dict = None):
+        if not is_recording():
+            return
+
+        if labels is None:
+            self._samples.add(value)
+        else:
+            self._samples.add(value, self._get_label_set_id(labels))
+
+    def _get_label_set_id(self, labels : dict) -> int:
+        """
+        Gets the identifier of a set of labels, so that samples store a single integer instead of a dictionary.
+        """
+
+        label_set = tuple(sorted(labels.items()))
+        label_set_id = self._label_set_ids.get(label_set)
+        if label_set_id is None:
+            with self._label_sets_lock:
+                label_set_id = self._label_set_ids.get(label_set)
+                if label_set_id is None:
+                    label_set_id = len(self._label_sets)
+                    self._label_sets.append(dict(label_set))
+                    self._label_set_ids[label_set] = label_set_id
+        return label_set_id
+
+    def _get_label_set(self, label_set_id : int) -> dict:
+        if label_set_id == NO_LABEL_SET_ID:
+            return {}
+        return self._label_sets[label_set_id]
 
     def clear(self):
         self._samples.clear()
 
-    def wrap(self, fn):
+    def wrap(self, fn, get_labels = None):
         """
         Wraps a function to be measured.
+
+        If `get_labels` is provided, it is called with the result of the function and must return the labels of the sample.
         """
 
         # inspired by <https://dev.to/kcdchennai/python-decorator-to-measure-execution-time-54hk>
@@ -75,7 +314,10 @@ class TimedGroup:
             end_time = time.perf_counter()
             total_time = end_time - start_time
 
-            self.add_sample(total_time)
+            if get_labels is None:
+                self.add_sample(total_time)
+            else:
+                self.add_sample(total_time, get_labels(result))
 
             return result
         return wrapped_function
@@ -87,15 +329,18 @@ class Timed:
 
     def __init__(self, max_samples : int):
         self._groups = {}
+        self._groups_lock = threading.Lock()
         self._max_samples = max_samples
 
-    def measure(self, name : str):
+    def measure(self, name : str, get_labels = None):
         """
         Creates a decorator that wraps a function to be measured with a given name.
+
+        If `get_labels` is provided, it is called with the result of the function and must return the labels of the sample.
         """
 
         def wrapper(fn):
-            return self.get_group(name).wrap(fn)
+            return self.get_group(name).wrap(fn, get_labels)
         return wrapper
 
     def clear_all(self):
@@ -103,8 +348,11 @@ class Timed:
         Clears all measurements so far.
         """
 
-        for name in self._groups:
-            self._groups[name].clear()
+        with self._groups_lock:
+            groups = list(self._groups.values())
+
+        for group in groups:
+            group.clear()
 
     def get_group(self, name : str) -> TimedGroup:
         """
@@ -112,7 +360,9 @@ class Timed:
         """
 
         if name not in self._groups:
-            self._groups[name] = TimedGroup(self._max_samples)
+            with self._groups_lock:
+                if name not in self._groups:
+                    self._groups[name] = TimedGroup(self._max_samples)
         return self._groups[name]
 
 class NotTimed:
@@ -120,7 +370,7 @@ class NotTimed:
     A class which provided the same API as the Timed class, but does not collect any timing data.
     """
 
-    def measure(self, name : str):
+    def measure(self, name : str, get_labels = None):
         def wrapper(fn):
             return fn
         return wrapper
@@ -130,3 +380,157 @@ class NotTimed:
 
     def get_group(self, name : str) -> TimedGroup:
         return None
+
+class RequestTiming:
+    """
+    The timing data gathered while a single request is processed.
+    """
+
+    def __init__(self):
+        self.target_type = None
+        self.version_count = None
+        self.upstream_calls = {}
+        self.upstream_times = {}
+        self.stage_times = {}
+
+    def add_upstream_call(self, api_name : str, duration : float):
+        """
+        Adds a call to an upstream API which took `duration` seconds.
+        """
+
+        self.upstream_calls[api_name] = self.upstream_calls.get(api_name, 0) + 1
+        self.upstream_times[api_name] = self.upstream_times.get(api_name, 0.0) + duration
+
+    def add_stage_time(self, stage_name : str, duration : float):
+        """
+        Adds `duration` seconds to the time spent on a processing stage.
+        """
+
+        self.stage_times[stage_name] = self.stage_times.get(stage_name, 0.0) + duration
+
+    def get_upstream_call_count(self) -> int:
+        return sum(self.upstream_calls.values())
+
+    def to_server_timing_header(self) -> str:
+        """
+        Converts the timing data to the value of a `Server-Timing` HTTP header.
+
+        The header has the following entries:
+        - `upstream`: the number of upstream calls and the total time waiting for them;
+        - one entry per upstream API (e.g. `openehr`, `demographic`) with its calls and waiting time;
+        - one entry per processing stage (e.g. `classify`, `build`, `serialize`) with its duration.
+        """
+
+        entries = []
+
+        total_upstream_time = sum(self.upstream_times.values())
+        entries.append(f'upstream;desc="{self.get_upstream_call_count()} calls";dur={total_upstream_time * 1000:.3f}')
+
+        for api_name in self.upstream_calls:
+            entries.append(f'{api_name};desc="{self.upstream_calls[api_name]} calls";dur={self.upstream_times[api_name] * 1000:.3f}')
+
+        for stage_name in self.stage_times:
+            entries.append(f'{stage_name};dur={self.stage_times[stage_name] * 1000:.3f}')
+
+        return ", ".join(entries)
+
+class RequestTimed:
+    """
+    A class which holds the timing data of the request being processed in the current context (thread).
+    """
+
+    def __init__(self):
+        self._current = ContextVar("request_timing", default=None)
+
+    def start(self):
+        """
+        Starts gathering timing data for a new request in the current context.
+
+        Returns:
+            A token which must be passed to `stop`.
+        """
+
+        return self._current.set(RequestTiming())
+
+    def stop(self, token):
+        """
+        Stops gathering timing data for the request started with `token`.
+        """
+
+        self._current.reset(token)
+
+    def get_current(self) -> RequestTiming:
+        """
+        Gets the timing data of the current request, or `None` if no request is being timed.
+        """
+
+        return self._current.get()
+
+    def set_target_type(self, target_type : str):
+        """
+        Sets the type of the target of the current request (e.g. `EHR_STATUS`, `COMPOSITION` or `patient`).
+        """
+
+        request_timing = self._current.get()
+        if request_timing is not None:
+            request_timing.target_type = target_type
+
+    def set_version_count(self, version_count : int):
+        """
+        Sets the number of versions of the target of the current request.
+        """
+
+        request_timing = self._current.get()
+        if request_timing is not None:
+            request_timing.version_count = version_count
+
+    def add_upstream_call(self, api_name : str, duration : float):
+        request_timing = self._current.get()
+        if request_timing is not None:
+            request_timing.add_upstream_call(api_name, duration)
+
+    def measure(self, stage_name : str):
+        """
+        Creates a decorator that adds the execution time of a function to a given stage of the current request.
+        """
+
+        def wrapper(fn):
+            @wraps(fn)
+            def wrapped_function(*args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    request_timing = self._current.get()
+                    if request_timing is not None:
+                        request_timing.add_stage_time(stage_name, time.perf_counter() - start_time)
+            return wrapped_function
+        return wrapper
+
+class NotRequestTimed:
+    """
+    A class which provided the same API as the RequestTimed class, but does not collect any timing data.
+    """
+
+    def start(self):
+        return None
+
+    def stop(self, token):
+        pass
+
+    def get_current(self) -> RequestTiming:
+        return None
+
+    def set_target_type(self, target_type : str):
+        pass
+
+    def set_version_count(self, version_count : int):
+        pass
+
+    def add_upstream_call(self, api_name : str, duration : float):
+        pass
+
+    def measure(self, stage_name : str):
+        def wrapper(fn):
+            return fn
+        return wrapper
@@ -0,0 +1,43 @@
+from data_layer.time_measurement import Timed, NotTimed, RequestTimed, NotRequestTimed
+from app_settings import USAGE_STATISTICS_MAX_SAMPLES, INCLUDE_USAGE_STATISTICS, INCLUDE_SERVER_TIMING, INCLUDE_METRICS
+
+# the measurements of the data layer. The business layer adds its own (see `business_layer.timing`).
+
+# URI classification
+CLASSIFY_URI_MEASUREMENT = "classify_uri"
+
+# openEHR API calls
+OPENEHR_GET_ALL_EHR_IDS_MEASUREMENT = "openehr_api.get_all_ehr_ids"
+OPENEHR_GET_ALL_COMPOSITION_IDS_AND_NAMES_OF_EHR_MEASUREMENT = "openehr_api.get_all_composition_ids_and_names_of_ehr"
+OPENEHR_GET_EHR_METADATA_MEASUREMENT = "openehr_api.get_ehr_metadata"
+OPENEHR_GET_VERSION_IDS_OF_EHR_STATUS_MEASUREMENT = "openehr_api.get_version_ids_of_ehr_status"
+OPENEHR_GET_VERSION_IDS_OF_COMPOSITION_MEASUREMENT = "openehr_api.get_version_ids_of_composition"
+OPENEHR_GET_VERSIONED_EHR_STATUS_VERSION_BY_ID_MEASUREMENT = "openehr_api.get_versioned_ehr_status_version_by_id"
+OPENEHR_GET_VERSIONED_COMPOSITION_VERSION_BY_ID_MEASUREMENT = "openehr_api.get_versioned_composition_version_by_id"
+OPENEHR_GET_TEMPLATES_IDS_AND_NAMES_MEASUREMENT = "openehr_api.get_templates_ids_and_names"
+
+# demographic API calls
+DEMOGRAPHIC_GET_PATIENT_BY_VERSION_ID_MEASUREMENT = "demographic_api.get_patient_by_version_id"
+DEMOGRAPHIC_GET_PATIENT_AT_TIME_MEASUREMENT = "demographic_api.get_patient_at_time"
+DEMOGRAPHIC_GET_VERSIONED_PATIENT_MEASUREMENT = "demographic_api.get_versioned_patient"
+DEMOGRAPHIC_GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT = "demographic_api.get_versioned_patient_revision_history"
+DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_BY_ID_MEASUREMENT = "demographic_api.get_versioned_patient_version_by_id"
+DEMOGRAPHIC_GET_VERSIONED_PATIENT_VERSION_AT_TIME_MEASUREMENT = "demographic_api.get_versioned_patient_version_at_time"
+DEMOGRAPHIC_LIST_PATIENTS_MEASUREMENT = "demographic_api.list_patients"
+DEMOGRAPHIC_GET_EHR_ID_FROM_PATIENT_MEASUREMENT = "demographic_api.get_ehr_id_from_patient"
+DEMOGRAPHIC_GET_CONTRIBUTION_MEASUREMENT = "demographic_api.get_contribution"
+DEMOGRAPHIC_GET_VERSION_IDS_OF_PATIENT_MEASUREMENT = "demographic_api.get_version_ids_of_patient"
+
+if INCLUDE_USAGE_STATISTICS:
+    timed = Timed(USAGE_STATISTICS_MAX_SAMPLES)
+else:
+    timed = NotTimed()
+
+# stages reported in the Server-Timing header
+CLASSIFY_STAGE = "classify"
+
+# the request-scoped data is used by the Server-Timing header, by the metrics and by the labels of the usage statistics.
+if INCLUDE_SERVER_TIMING or INCLUDE_METRICS or INCLUDE_USAGE_STATISTICS:
+    request_timed = RequestTimed()
+else:
+    request_timed = NotRequestTimed()
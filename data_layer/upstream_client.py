@@ -0,0 +1,181 @@
+import logging
+import time
+
+from requests import Session
+from requests.adapters import DEFAULT_POOLSIZE
+from requests.auth import HTTPBasicAuth
+
+from data_layer import api_exceptions, path_utils
+from data_layer.deadlines import deadlines
+from data_layer.concurrency_limit import AdaptiveConcurrencyLimiter, NotConcurrencyLimiter
+from data_layer.replicas import ReplicaSet
+from data_layer.ssl_extension import make_ssl_context, SSLContextAdapter, HostNameIgnoringAdapter
+from data_layer.connection_warming import ConnectionWarmer, NotConnectionWarmer
+from data_layer.upstream_transports import RequestsTransport, Http2Transport, is_http2_available
+from data_layer.timing import request_timed
+from data_layer.metrics import UPSTREAM_RESPONSES, UPSTREAM_HTTP_VERSIONS
+from app_settings import ADAPTIVE_UPSTREAM_CONCURRENCY, UPSTREAM_INITIAL_CONCURRENCY, UPSTREAM_MIN_CONCURRENCY, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_BALANCING, UPSTREAM_HASH_AFFINITY, UPSTREAM_EJECTION_FAILURES, UPSTREAM_EJECTION_SECONDS, UPSTREAM_WARM_CONNECTIONS, UPSTREAM_KEEPALIVE_SECONDS, UPSTREAM_WARMUP_TIMEOUT_SECONDS, UPSTREAM_CALL_TIMEOUT_SECONDS, UPSTREAM_HTTP2, UPSTREAM_HTTP2_MAX_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+class UpstreamClient:
+    """
+    An HTTP client which sends requests to an upstream API (the openEHR API or the demographic API).
+
+    The requests are sent over HTTP/1.1 with `requests`, or, if HTTP/2 is enabled and `httpx[http2]` is installed, with
+    `httpx`, which multiplexes the concurrent requests over a few HTTP/2 connections to each replica (and falls back to
+    HTTP/1.1 if a replica does not negotiate HTTP/2).
+    """
+
+    def __init__(self, name : str, base_uris : list, username : str, password : str, validate_certificate : bool, use_custom_certificate : bool, certificate_file_name : str, use_http2 : bool = UPSTREAM_HTTP2):
+        """
+        Parameters:
+            name - a short name of the upstream API, used in measurements.
+            base_uris - the base URIs of the replicas of the upstream API.
+            username - the username used for HTTP basic authentication.
+            password - the password used for HTTP basic authentication.
+            validate_certificate - whether the SSL certificate of the upstream API must be validated.
+            use_custom_certificate - whether the root CA certificate is validated against a custom file.
+            certificate_file_name - the name of the custom root CA certificate file in the `other_certificates` folder.
+            use_http2 - whether the requests are sent with `httpx` over HTTP/2 (`UPSTREAM_HTTP2` by default).
+        """
+
+        self.name = name
+        self.base_uris = base_uris
+        self.call_timeout = UPSTREAM_CALL_TIMEOUT_SECONDS if UPSTREAM_CALL_TIMEOUT_SECONDS > 0 else None
+        self.replicas = ReplicaSet(name, base_uris, UPSTREAM_BALANCING, UPSTREAM_HASH_AFFINITY, UPSTREAM_EJECTION_FAILURES, UPSTREAM_EJECTION_SECONDS)
+        self.auth = HTTPBasicAuth(username=username, password=password)
+        self.session = Session()
+
+        # the calls are limited by all the requests being processed, so the limiter is shared by all of them.
+        if ADAPTIVE_UPSTREAM_CONCURRENCY:
+            self.limiter = AdaptiveConcurrencyLimiter(name, UPSTREAM_INITIAL_CONCURRENCY, UPSTREAM_MIN_CONCURRENCY, UPSTREAM_MAX_CONCURRENCY)
+        else:
+            self.limiter = NotConcurrencyLimiter()
+
+        # the pools keep at least the connections established at startup.
+        pool_size = max(DEFAULT_POOLSIZE, UPSTREAM_WARM_CONNECTIONS)
+        self.session.mount("http://", SSLContextAdapter(pool_maxsize = pool_size))
+
+        # the TLS sessions are resumed by the new connections, so that they do not need a full handshake.
+        custom_certificate_path = path_utils.relative_path("other_certificates", certificate_file_name) if use_custom_certificate else None
+        ssl_context = make_ssl_context(name, validate_certificate, custom_certificate_path)
+
+        if validate_certificate and use_custom_certificate:
+            self.session.mount("https://", HostNameIgnoringAdapter(ssl_context = ssl_context, pool_maxsize = pool_size))
+        else:
+            self.session.mount("https://", SSLContextAdapter(ssl_context = ssl_context, pool_maxsize = pool_size))
+
+        self.extra_params = {}
+        if any(base_uri.startswith("https") for base_uri in base_uris):
+            if validate_certificate:
+                if use_custom_certificate:
+                    self.extra_params["verify"] = custom_certificate_path
+            else:
+                self.extra_params["verify"] = False
+
+        if use_http2 and not is_http2_available():
+            logger.warning(f"HTTP/2 is enabled, but `httpx[http2]` is not installed: the {name} API is called over HTTP/1.1.")
+            use_http2 = False
+
+        if use_http2:
+            # `httpx` does not check the hostnames itself, so the context of the HTTP/2 connections checks them.
+            verify = make_ssl_context(name, validate_certificate, custom_certificate_path, check_hostname = True)
+            self.transport = Http2Transport(name, username, password, verify, UPSTREAM_HTTP2_MAX_CONNECTIONS * len(base_uris))
+            # the connections of `httpx` are not pooled by the session, so they are not kept warm by the warmer.
+            self.connection_warmer = NotConnectionWarmer()
+        else:
+            self.transport = RequestsTransport(self.session, self.auth, self.extra_params)
+            if UPSTREAM_WARM_CONNECTIONS > 0 or UPSTREAM_KEEPALIVE_SECONDS > 0:
+                self.connection_warmer = ConnectionWarmer(name, self.session, base_uris, self.extra_params.get("verify", True), UPSTREAM_WARM_CONNECTIONS, UPSTREAM_KEEPALIVE_SECONDS, UPSTREAM_WARMUP_TIMEOUT_SECONDS)
+            else:
+                self.connection_warmer = NotConnectionWarmer()
+
+    def warm_up(self):
+        """
+        Establishes the connections to the upstream API which are kept warm, if enabled (see `ConnectionWarmer`). Over
+        HTTP/2, one connection is established to each replica.
+        """
+
+        if UPSTREAM_WARM_CONNECTIONS > 0:
+            self.transport.warm_up(self.base_uris, UPSTREAM_WARMUP_TIMEOUT_SECONDS)
+        self.connection_warmer.warm_up()
+
+    def get(self, path : str, params : dict = None, headers : dict = None, affinity_key : str = None):
+        """
+        Sends a GET request to the upstream API, accepting a JSON response.
+
+        The call times out after `UPSTREAM_CALL_TIMEOUT_SECONDS`, or when the deadline of the current request passes, if
+        it has one and it passes first; the call is not sent once the deadline has passed (or the request has been
+        cancelled). The timeout applies to connecting and to each read of the response, as in `requests`. The calls which
+        time out are failures of the upstream API, except those abandoned while reading the response because of the
+        deadline, which tell nothing about the upstream API. If the adaptive concurrency limit of the upstream API is reached, the call waits for
+        a slot first. The call is sent to one of the replicas of the upstream API (see `ReplicaSet`).
+
+        Parameters:
+            path - the path of the resource, relative to the base URI.
+            params - the query parameters, if any.
+            headers - extra headers, if any (e.g. conditional request headers).
+            affinity_key - the ID of the EHR or patient whose data is requested, if any, used to choose the replica.
+
+        Returns:
+            The response (of `requests` or `httpx`, which both have `status_code` and `json`).
+
+        Raises:
+            api_exceptions.DeadlineExceededException - if the deadline of the current request has passed.
+            api_exceptions.RequestCancelledException - if the current request has been cancelled.
+        """
+
+        start_time = time.perf_counter()
+        if not self.limiter.acquire(deadlines.get_timeout()):
+            raise api_exceptions.DeadlineExceededException(f"No call to the {self.name} API could be sent before the deadline of the request.")
+
+        # the time waited for the limiter is part of the time budget.
+        try:
+            remaining_time = deadlines.get_timeout()
+        except (api_exceptions.DeadlineExceededException, api_exceptions.RequestCancelledException):
+            # the call is not sent, so it is not recorded.
+            self.limiter.release(None, False)
+            raise
+        deadline_bound = remaining_time is not None and (self.call_timeout is None or remaining_time < self.call_timeout)
+        timeout = remaining_time if deadline_bound else self.call_timeout
+
+        replica = self.replicas.acquire(affinity_key)
+
+        failed = False
+        abandoned = False
+        call_start_time = time.perf_counter()
+        try:
+            response = self.transport.get(
+                url = f"{replica.base_uri}{path}",
+                params = params,
+                headers = {
+                    "Accept": "application/json",
+                    **(headers or {})
+                },
+                timeout = timeout
+            )
+            failed = response.status_code == 429 or response.status_code >= 500
+        except self.transport.timeout_exceptions as e:
+            # a replica which cannot even be connected to in time is down or unreachable.
+            if isinstance(e, self.transport.connect_timeout_exceptions) or not deadline_bound:
+                failed = True
+            else:
+                # the response was cut short by the deadline of the request, before the timeout of the upstream API.
+                abandoned = True
+            if deadline_bound:
+                raise api_exceptions.DeadlineExceededException(f"The call to {replica.base_uri}{path} did not complete before the deadline of the request.") from e
+            raise e
+        except self.transport.error_exceptions as e:
+            failed = True
+            raise e
+        finally:
+            end_time = time.perf_counter()
+            latency = None if abandoned else end_time - call_start_time
+            self.limiter.release(latency, failed)
+            self.replicas.release(replica, latency, failed)
+            request_timed.add_upstream_call(self.name, end_time - start_time)
+
+        UPSTREAM_RESPONSES.labels(self.name, response.status_code).inc()
+        UPSTREAM_HTTP_VERSIONS.labels(self.name, self.transport.get_http_version(response)).inc()
+        return response
@@ -0,0 +1,139 @@
+import asyncio
+from importlib.util import find_spec
+import logging
+import threading
+
+from requests.exceptions import RequestException, Timeout, ConnectTimeout
+
+# HTTP/2 is optional: it needs the `httpx` package with its `h2` extra (`pip install httpx[http2]`).
+try:
+    import httpx
+except ImportError:
+    httpx = None
+# without `h2`, `httpx` cannot negotiate HTTP/2.
+if find_spec("h2") is None:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# the HTTP versions of the `http.client` responses.
+HTTP_VERSIONS = {10: "HTTP/1.0", 11: "HTTP/1.1"}
+# the number of times a request is sent again when its connection is closed before the response (e.g. after a GOAWAY).
+HTTP2_RETRIES = 2
+# the maximum number of requests in progress at the same time over HTTP/2: `httpx` multiplexes them over one connection
+# as long as it is open, and 100 is the lowest limit of concurrent streams recommended by RFC 9113.
+MAX_CONCURRENT_STREAMS = 100
+
+def is_http2_available() -> bool:
+    return httpx is not None
+
+class RequestsTransport:
+    """
+    Sends the requests to an upstream API with a `requests` session, over HTTP/1.1.
+
+    Each concurrent request needs its own connection; the connections are pooled by the session.
+    """
+
+    # the exceptions raised when a request times out (while connecting, or at any time), and when it fails because of the
+    # upstream API or the network.
+    connect_timeout_exceptions = (ConnectTimeout,)
+    timeout_exceptions = (Timeout,)
+    error_exceptions = (RequestException,)
+
+    def __init__(self, session, auth, extra_params : dict):
+        """
+        Parameters:
+            session - the `requests` session.
+            auth - the `requests` authentication.
+            extra_params - extra parameters of the requests (e.g. `verify`).
+        """
+
+        self.session = session
+        self.auth = auth
+        self.extra_params = extra_params
+
+    def get(self, url : str, params : dict, headers : dict, timeout : float):
+        return self.session.get(
+            url = url,
+            auth = self.auth,
+            params = params,
+            headers = headers,
+            timeout = timeout,
+            **self.extra_params
+        )
+
+    def get_http_version(self, response) -> str:
+        # the fixture adapters of the benchmarks do not set the version.
+        return HTTP_VERSIONS.get(getattr(response.raw, "version", None), "unknown")
+
+    def warm_up(self, base_uris : list, timeout : float):
+        # the connections of the session are warmed up by `ConnectionWarmer`.
+        pass
+
+class Http2Transport:
+    """
+    Sends the requests to an upstream API with an `httpx` client, over HTTP/2 when the upstream API negotiates it (with
+    ALPN, so only over HTTPS), and over HTTP/1.1 otherwise.
+
+    Over HTTP/2, the concurrent requests are multiplexed over a few connections. The HTTP/2 connections of the
+    synchronous `httpx` client are not safe to share between threads, so the requests are sent by an asynchronous client
+    running in an event loop of its own, and the calling threads wait for their responses.
+
+    Upstream APIs close their connections after some requests (with a GOAWAY frame), which fails the requests in progress
+    on them, so these requests (which are all GETs) are sent again, up to `HTTP2_RETRIES` times.
+    """
+
+    def __init__(self, name : str, username : str, password : str, verify, max_connections : int):
+        """
+        Parameters:
+            name - the name of the upstream API, used to name the thread of the event loop.
+            username - the username used for HTTP basic authentication.
+            password - the password used for HTTP basic authentication.
+            verify - the SSL context of the connections, or `False` to skip the verification of the certificates.
+            max_connections - the maximum number of connections to all the replicas.
+        """
+
+        self.connect_timeout_exceptions = (httpx.ConnectTimeout,)
+        self.timeout_exceptions = (httpx.TimeoutException,)
+        self.error_exceptions = (httpx.TransportError,)
+        self.client = httpx.AsyncClient(
+            http2 = True,
+            auth = (username, password),
+            verify = verify,
+            limits = httpx.Limits(max_connections = max_connections, max_keepalive_connections = max_connections),
+            timeout = None
+        )
+
+        self._loop = asyncio.new_event_loop()
+        self._streams = asyncio.Semaphore(MAX_CONCURRENT_STREAMS)
+        threading.Thread(target = self._loop.run_forever, name = f"{name}-http2", daemon = True).start()
+
+    def get(self, url : str, params : dict, headers : dict, timeout : float):
+        return asyncio.run_coroutine_threadsafe(self._get(url, params, headers, timeout), self._loop).result()
+
+    async def _get(self, url : str, params : dict, headers : dict, timeout : float):
+        async with self._streams:
+            for retry in range(HTTP2_RETRIES + 1):
+                try:
+                    return await self.client.get(url, params = params, headers = headers, timeout = timeout)
+                except (httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError):
+                    if retry == HTTP2_RETRIES:
+                        raise
+
+    def get_http_version(self, response) -> str:
+        return response.http_version
+
+    def warm_up(self, base_uris : list, timeout : float):
+        """
+        Establishes a connection to each replica, which also negotiates the HTTP version.
+
+        Parameters:
+            base_uris - the base URIs of the replicas.
+            timeout - the maximum time (in seconds) to establish each connection and to get the response.
+        """
+
+        for base_uri in base_uris:
+            try:
+                asyncio.run_coroutine_threadsafe(self.client.head(base_uri, timeout = timeout), self._loop).result()
+            except httpx.HTTPError:
+                logger.exception(f"Could not establish a connection to {base_uri}.")
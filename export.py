@@ -0,0 +1,320 @@
+"""
+Exports the provenance of every EHR_STATUS, COMPOSITION and patient to sharded, compressed files, e.g. for a nightly
+archive.
+
+The targets are listed from the upstream APIs and split into batches (of EHRs, with their EHR_STATUS and COMPOSITIONs,
+and of patients), which are exported by a pool of processes. Each batch is written to its own shard, in one of the
+formats:
+- `ndjson`: one line per target, with its classification, its number of versions and its PROV-JSON (see `prov_formats`);
+- `nt`: the N-Triples of the targets, one after the other, which is itself an N-Triples document;
+- `ttl`: the Turtle of the targets, one after the other, which is itself a Turtle document.
+
+The documents are written from the versions with `prov_generation` and `prov_formats`, as by the service, without
+going through its HTTP API. Each process sends the upstream calls of its targets from a few threads, so that at most
+`--upstream-concurrency` calls are in flight at once, for the whole export.
+
+The plan of the export (its settings and batches) is written to `plan.json` in the output folder, and each completed
+batch is appended to `checkpoint.ndjson`. Running the export again with the same output folder resumes it: the
+completed batches are skipped and the others are exported again.
+
+Usage (from the root folder of the repository, with the environment variables of the service):
+```bash
+python export.py --output archive --format ndjson --compression zstd --processes 4 --upstream-concurrency 32
+```
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from data_layer import api_exceptions, ids, openehr_api, demographic_api
+from business_layer import compression, prov_formats, prov_generation
+from business_layer.document_store import make_target_key, VARIANT_EXTENSIONS
+
+PLAN_FILE_NAME = "plan.json"
+CHECKPOINT_FILE_NAME = "checkpoint.ndjson"
+
+# the kinds of tasks of the batches: an EHR (its EHR_STATUS and its COMPOSITIONs) or a patient.
+EHR_TASK = "ehr"
+PATIENT_TASK = "patient"
+
+TARGET_TYPES = ["EHR_STATUS", "COMPOSITION", "patient"]
+
+def write_ndjson_record(classification : dict, version_ids : list) -> bytes:
+    """
+    Writes the NDJSON line of a target: its key (see `document_store.make_target_key`), its classification, its number of
+    versions and its PROV-JSON.
+    """
+
+    record = {
+        "target": make_target_key(classification),
+        **classification,
+        "versions": len(version_ids),
+        "provenance": prov_formats.fetch_prov_json(classification, version_ids)
+    }
+    return (json.dumps(record, separators = (",", ":"), ensure_ascii = False) + "\n").encode("utf-8")
+
+# the export formats, with the extension of their shards and their writer, from the classification of a target and the
+# IDs of its versions to its document.
+EXPORT_FORMATS = {
+    "ndjson": (".ndjson", write_ndjson_record),
+    "nt": (".nt", prov_formats.write_n_triples),
+    "ttl": (".ttl", prov_formats.write_turtle)
+}
+
+def get_available_compressions() -> list:
+    return [compression.IDENTITY_ENCODING, *compression.get_available_encodings()]
+
+def make_shard_name(batch_index : int, export_format : str, encoding : str) -> str:
+    extension = EXPORT_FORMATS[export_format][0] + VARIANT_EXTENSIONS.get(encoding, "")
+    return f"shard-{batch_index:06d}{extension}"
+
+def list_tasks(target_types : list) -> list:
+    """
+    Lists the tasks of an export: the EHRs (if the EHR_STATUS or the COMPOSITIONs are exported) and the patients.
+
+    Returns:
+        A list of tuples with the kind of each task and the ID of its EHR or patient.
+    """
+
+    tasks = []
+    if "EHR_STATUS" in target_types or "COMPOSITION" in target_types:
+        tasks.extend((EHR_TASK, ehr_id) for ehr_id in openehr_api.get_all_ehr_ids())
+    if "patient" in target_types:
+        tasks.extend((PATIENT_TASK, patient_id) for patient_id in demographic_api.list_patients())
+    return tasks
+
+def list_targets(task : tuple, target_types : list) -> list:
+    """
+    Lists the classifications of the targets of a task (see `classifier.classify_uri`).
+    """
+
+    kind, object_id = task
+    if kind == PATIENT_TASK:
+        return [{ "type": "patient", "patient_id": object_id }]
+
+    classifications = []
+    if "EHR_STATUS" in target_types:
+        classifications.append({ "type": "EHR_STATUS", "ehr_id": object_id })
+    if "COMPOSITION" in target_types:
+        # the query returns the ID of the latest version of each COMPOSITION.
+        composition_ids = dict.fromkeys(
+            ids.extract_versioned_object_id_from_version_id(version_id)
+            for version_id, _ in openehr_api.get_all_composition_ids_and_names_of_ehr(object_id)
+        )
+        classifications.extend({ "type": "COMPOSITION", "ehr_id": object_id, "composition_id": composition_id } for composition_id in composition_ids)
+    return classifications
+
+def export_target(classification : dict, write) -> tuple:
+    """
+    Writes the document of a target.
+
+    Returns:
+        A tuple with the document and the number of versions of the target, or `None` and 0 if the target does not exist
+        anymore.
+    """
+
+    try:
+        version_ids = prov_generation.get_version_ids(classification)
+        return write(classification, version_ids), len(version_ids)
+    except api_exceptions.NotFoundException:
+        return None, 0
+
+def export_batch(output_folder : str, batch_index : int, tasks : list, settings : dict, threads : int) -> dict:
+    """
+    Exports the targets of a batch to its shard, in the processes of the pool. The documents are written in the order in
+    which they are completed, and the shard is renamed once complete, so that it is never read partially written.
+
+    Returns:
+        The statistics of the batch.
+    """
+
+    write = EXPORT_FORMATS[settings["format"]][1]
+    encoding = settings["compression"]
+    compressor = None if encoding == compression.IDENTITY_ENCODING else compression.make_compressor(encoding)
+    statistics = { "batch": batch_index, "shard": make_shard_name(batch_index, settings["format"], encoding), "targets": 0, "missing": 0, "versions": 0, "bytes": 0 }
+
+    descriptor, temporary_path = tempfile.mkstemp(dir = output_folder, suffix = ".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as shard_file, ThreadPoolExecutor(threads) as executor:
+            classifications = []
+            for task_classifications in executor.map(lambda task: list_targets(task, settings["targets"]), tasks):
+                classifications.extend(task_classifications)
+
+            futures = [executor.submit(export_target, classification, write) for classification in classifications]
+            for future in as_completed(futures):
+                content, version_count = future.result()
+                if content is None:
+                    statistics["missing"] += 1
+                    continue
+                statistics["targets"] += 1
+                statistics["versions"] += version_count
+                statistics["bytes"] += len(content)
+                shard_file.write(content if compressor is None else compressor.compress(content))
+
+            if compressor is not None:
+                shard_file.write(compressor.flush())
+        os.replace(temporary_path, os.path.join(output_folder, statistics["shard"]))
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return statistics
+
+def load_plan(output_folder : str, settings : dict) -> list:
+    """
+    Loads the batches of an export which is resumed, or plans a new export.
+
+    Returns:
+        The list of the batches, each one a list of tasks.
+    """
+
+    plan_path = os.path.join(output_folder, PLAN_FILE_NAME)
+    if os.path.exists(plan_path):
+        with open(plan_path) as plan_file:
+            plan = json.load(plan_file)
+        if plan["settings"] != settings:
+            raise ValueError(f"The export in {output_folder} has other settings ({plan['settings']}); resume it with the same settings or export to another folder.")
+        return [[tuple(task) for task in batch] for batch in plan["batches"]]
+
+    tasks = list_tasks(settings["targets"])
+    batch_size = settings["batch_size"]
+    batches = [tasks[start:start + batch_size] for start in range(0, len(tasks), batch_size)]
+
+    # the plan is renamed once written, so that an interrupted export is planned again.
+    descriptor, temporary_path = tempfile.mkstemp(dir = output_folder, suffix = ".tmp")
+    with os.fdopen(descriptor, "w") as plan_file:
+        json.dump({ "settings": settings, "batches": batches }, plan_file)
+    os.replace(temporary_path, plan_path)
+    return batches
+
+def load_checkpoint(output_folder : str) -> dict:
+    """
+    Loads the statistics of the completed batches, by batch index.
+
+    A last line which was partially written (by an interrupted export) is removed from the file, so that the next lines
+    are not appended to it.
+    """
+
+    completed = {}
+    checkpoint_path = os.path.join(output_folder, CHECKPOINT_FILE_NAME)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r+b") as checkpoint_file:
+            complete_size = 0
+            for line in checkpoint_file:
+                if not line.endswith(b"\n"):
+                    break
+                complete_size += len(line)
+                try:
+                    statistics = json.loads(line)
+                except ValueError:
+                    continue
+                if os.path.exists(os.path.join(output_folder, statistics["shard"])):
+                    completed[statistics["batch"]] = statistics
+            checkpoint_file.truncate(complete_size)
+    return completed
+
+def remove_temporary_files(output_folder : str):
+    """
+    Removes the temporary files of the shards left by an interrupted export.
+    """
+
+    for entry in os.scandir(output_folder):
+        if entry.is_file() and entry.name.endswith(".tmp"):
+            os.unlink(entry.path)
+
+def format_throughput(totals : dict, elapsed_time : float) -> str:
+    return (f"targets={totals['targets']} ({totals['targets'] / elapsed_time:.1f}/s) "
+            f"versions={totals['versions']} ({totals['versions'] / elapsed_time:.1f}/s) "
+            f"written={totals['bytes'] / 2**20:.1f}MiB ({totals['bytes'] / 2**20 / elapsed_time:.2f}MiB/s)")
+
+def run_export(args) -> dict:
+    settings = {
+        "format": args.format,
+        "compression": args.compression,
+        "targets": [target_type for target_type in TARGET_TYPES if target_type in args.targets.split(",")],
+        "batch_size": args.batch_size
+    }
+    os.makedirs(args.output, exist_ok = True)
+    remove_temporary_files(args.output)
+
+    start_time = time.perf_counter()
+    batches = load_plan(args.output, settings)
+    completed = load_checkpoint(args.output)
+    pending = [batch_index for batch_index in range(len(batches)) if batch_index not in completed]
+    print(f"{len(batches)} batches, {len(completed)} already completed, planned in {time.perf_counter() - start_time:.1f}s")
+
+    # each process sends the upstream calls of its targets from as many threads as its share of the concurrency.
+    processes = max(1, min(args.processes, args.upstream_concurrency, len(pending)))
+    threads = max(1, args.upstream_concurrency // processes)
+
+    totals = { "targets": 0, "missing": 0, "versions": 0, "bytes": 0 }
+    failed_batches = []
+    exported_batches = 0
+    start_time = time.perf_counter()
+    # the processes are spawned rather than forked, so that they do not share the upstream connections of this process.
+    with ProcessPoolExecutor(processes, mp_context = multiprocessing.get_context("spawn")) as executor, \
+         open(os.path.join(args.output, CHECKPOINT_FILE_NAME), "a") as checkpoint_file:
+        futures = {executor.submit(export_batch, args.output, batch_index, batches[batch_index], settings, threads): batch_index for batch_index in pending}
+        for future in as_completed(futures):
+            batch_index = futures[future]
+            try:
+                statistics = future.result()
+            except Exception as e:
+                failed_batches.append(batch_index)
+                print(f"batch {batch_index} failed: {e!r}")
+                continue
+
+            checkpoint_file.write(json.dumps(statistics) + "\n")
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+            exported_batches += 1
+            for name in totals:
+                totals[name] += statistics[name]
+            elapsed_time = time.perf_counter() - start_time
+            print(f"batch {batch_index} done ({len(completed) + exported_batches}/{len(batches)}) {format_throughput(totals, elapsed_time)}")
+
+    elapsed_time = time.perf_counter() - start_time
+    print(f"exported in {elapsed_time:.1f}s: {format_throughput(totals, max(elapsed_time, 1e-9))} missing={totals['missing']} failed_batches={len(failed_batches)}")
+
+    return {
+        "export": "provenance",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": { **settings, "processes": processes, "threads_per_process": threads },
+        "batches": len(batches),
+        "resumed_batches": len(completed),
+        "exported_batches": exported_batches,
+        "failed_batches": failed_batches,
+        "elapsed_time": elapsed_time,
+        "totals": totals
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Exports the provenance of every EHR_STATUS, COMPOSITION and patient.")
+    parser.add_argument("--output", required = True, help = "folder of the shards, the plan and the checkpoint")
+    parser.add_argument("--format", choices = EXPORT_FORMATS.keys(), default = "ndjson", help = "format of the shards")
+    parser.add_argument("--compression", choices = get_available_compressions(), default = compression.GZIP_ENCODING, help = "compression of the shards")
+    parser.add_argument("--targets", default = ",".join(TARGET_TYPES), help = "comma-separated target types")
+    parser.add_argument("--batch-size", type = int, default = 100, help = "number of EHRs or patients of each batch (and shard)")
+    parser.add_argument("--processes", type = int, default = os.cpu_count(), help = "number of processes")
+    parser.add_argument("--upstream-concurrency", type = int, default = 16, help = "maximum number of upstream calls in flight")
+    parser.add_argument("--report", default = None, help = "path of the JSON report")
+    args = parser.parse_args()
+
+    report = run_export(args)
+
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent = 2)
+
+    if len(report["failed_batches"]) > 0:
+        print("Some batches failed; run the export again with the same output folder to resume it.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
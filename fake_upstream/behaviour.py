@@ -0,0 +1,112 @@
+import random
+import threading
+
+class EndpointBehaviour:
+    """
+    The simulated behaviour of an endpoint: its latency distribution, its error rate and the size of the padding of its payloads.
+
+    The configuration has the following format (every key is optional):
+    ```json
+    {
+        "latency": {
+            "distribution": "constant" | "uniform" | "normal" | "lognormal" | "exponential",
+            ...parameters of the distribution, in milliseconds...
+        },
+        "error_rate": <probability of answering with an error>,
+        "error_status": <HTTP status of the errors, 500 by default>,
+        "payload_bytes": <size of the padding added to each VERSION>,
+        "etag": <whether the revision histories have an `ETag` header and the conditional requests are answered with 304>
+    }
+    ```
+
+    The parameters of the distributions are:
+    - constant: `value_ms`;
+    - uniform: `min_ms` and `max_ms`;
+    - normal: `mean_ms` and `stddev_ms` (negative values are clipped to zero);
+    - lognormal: `median_ms` and `sigma`;
+    - exponential: `mean_ms`.
+    """
+
+    def __init__(self, config : dict, seed : int = None):
+        latency = config.get("latency", {})
+        self.distribution = latency.get("distribution", "constant")
+        self.latency = latency
+        self.error_rate = config.get("error_rate", 0.0)
+        self.error_status = config.get("error_status", 500)
+        self.payload_bytes = config.get("payload_bytes", None)
+        self.etag = config.get("etag", False)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """
+        Samples the latency of a request, in seconds.
+        """
+
+        with self._lock:
+            if self.distribution == "constant":
+                latency_ms = self.latency.get("value_ms", 0.0)
+            elif self.distribution == "uniform":
+                latency_ms = self._random.uniform(self.latency["min_ms"], self.latency["max_ms"])
+            elif self.distribution == "normal":
+                latency_ms = max(0.0, self._random.gauss(self.latency["mean_ms"], self.latency["stddev_ms"]))
+            elif self.distribution == "lognormal":
+                latency_ms = self.latency["median_ms"] * self._random.lognormvariate(0.0, self.latency["sigma"])
+            elif self.distribution == "exponential":
+                latency_ms = self._random.expovariate(1.0 / self.latency["mean_ms"])
+            else:
+                raise ValueError(f"Unknown latency distribution: {self.distribution}.")
+
+        return latency_ms / 1000.0
+
+    def should_fail(self) -> bool:
+        """
+        Decides whether a request must be answered with an error.
+        """
+
+        if self.error_rate <= 0.0:
+            return False
+
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+def load_behaviours(config : dict, seed : int = None) -> dict:
+    """
+    Loads the behaviour of each endpoint class from the `endpoints` section of the configuration.
+
+    The settings of the `default` entry are used for the endpoint classes which are not configured.
+
+    Returns:
+        A dictionary from endpoint class to `EndpointBehaviour`.
+    """
+
+    default_config = config.get("default", {})
+
+    behaviours = {}
+    for index, endpoint_class in enumerate(ENDPOINT_CLASSES):
+        endpoint_config = dict(default_config)
+        endpoint_config.update(config.get(endpoint_class, {}))
+        behaviours[endpoint_class] = EndpointBehaviour(endpoint_config, None if seed is None else seed + index)
+    return behaviours
+
+# classes of endpoints which may have different behaviours.
+AQL_ENDPOINT = "aql"
+EHR_ENDPOINT = "ehr"
+REVISION_HISTORY_ENDPOINT = "revision_history"
+VERSION_ENDPOINT = "version"
+TEMPLATES_ENDPOINT = "templates"
+PATIENT_ENDPOINT = "patient"
+EHR_OF_PATIENT_ENDPOINT = "ehr_of_patient"
+CONTRIBUTION_ENDPOINT = "contribution"
+
+ENDPOINT_CLASSES = [
+    AQL_ENDPOINT,
+    EHR_ENDPOINT,
+    REVISION_HISTORY_ENDPOINT,
+    VERSION_ENDPOINT,
+    TEMPLATES_ENDPOINT,
+    PATIENT_ENDPOINT,
+    EHR_OF_PATIENT_ENDPOINT,
+    CONTRIBUTION_ENDPOINT
+]
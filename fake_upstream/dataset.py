@@ -0,0 +1,455 @@
+"""
+Generator and reader of large synthetic datasets for the stand-in upstream.
+
+A dataset is a compact binary file which describes EHRs with many COMPOSITIONs, long revision histories, several
+committers per object (identified by `name` or by `identifiers[0].id`), contributions referred to with the fallback
+`id` form of `OBJECT_REF`, and patients with demographic versions. The VERSIONs themselves are not stored: each version
+is an 8-byte record (committer, flags and time of the commit) from which it is rebuilt on demand, and the file is
+memory-mapped, so datasets with millions of versions are served without being loaded into memory.
+
+Usage (from the root folder of the repository):
+```bash
+python -m fake_upstream.dataset --config fake_upstream/dataset_config.json --output dataset.bin
+python -m fake_upstream.server --config fake_upstream/config.json --dataset dataset.bin
+```
+
+The file has the following sections (little-endian):
+- the header (`HEADER`), with the counts and the offsets of the other sections;
+- the versions (`VERSION_RECORD`), grouped by versioned object in version order;
+- the objects (`OBJECT_RECORD`): the EHRs and the versioned objects, sorted by ID so that they are found by binary search;
+- the EHRs (`EHR_RECORD`), in generation order, with their EHR_STATUS and the range of their COMPOSITIONs;
+- the COMPOSITIONs of the EHRs (indexes of object records), contiguous per EHR;
+- the patients (indexes of object records), in generation order.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import random
+import struct
+import uuid
+
+from fake_upstream.synthetic_data import make_id, make_version_id, build_version, build_revision_history, BASE_TIME, SYSTEM_ID, EHR_STATUS_TYPE, COMPOSITION_TYPE, PERSON_TYPE
+
+MAGIC = b"PROVDS\x00\x01"
+
+# magic, padding bytes, version count, object count, EHR count, composition link count, patient count,
+# and the offsets of the versions, objects, EHRs, composition links and patients.
+HEADER = struct.Struct("<8sIQIIIIQQQQQ")
+
+# committer index, flags and time of the commit (in minutes after `BASE_TIME`).
+VERSION_RECORD = struct.Struct("<HBxI")
+
+# object ID (UUID bytes), kind, EHR index (or `NO_INDEX`), index of the first version, number of versions.
+OBJECT_RECORD = struct.Struct("<16sB3xIQI")
+
+# EHR ID (UUID bytes), object index of its EHR_STATUS, index of its first composition link, number of COMPOSITIONs.
+EHR_RECORD = struct.Struct("<16sIII")
+
+INDEX = struct.Struct("<I")
+
+NO_INDEX = 0xFFFFFFFF
+
+# flags of the versions.
+ID_FALLBACK_FLAG = 1
+
+# kinds of the object records.
+EHR_KIND = 0
+EHR_STATUS_KIND = 1
+COMPOSITION_KIND = 2
+PERSON_KIND = 3
+
+KIND_TYPES = {
+    EHR_STATUS_KIND: EHR_STATUS_TYPE,
+    COMPOSITION_KIND: COMPOSITION_TYPE,
+    PERSON_KIND: PERSON_TYPE
+}
+
+TYPE_KINDS = {object_type: kind for kind, object_type in KIND_TYPES.items()}
+
+DEFAULT_CONFIG = {
+    "seed": 1,
+    "ehrs": 1000,
+    "compositions_per_ehr_mean": 20,
+    "patients": 1000,
+    "history_length_median": 3,
+    "history_length_sigma": 1.5,
+    "max_history_length": 50000,
+    "long_history_fraction": 0.001,
+    "long_history_length": 20000,
+    "committers": 200,
+    "committers_per_object": 4,
+    "id_fallback_rate": 0.05,
+    "commit_interval_minutes_mean": 1440,
+    "version_padding_bytes": 256
+}
+
+class DatasetWriter:
+    """
+    Generates a dataset file. The versions are written as they are generated, and only the (small) object records are
+    kept in memory until the end.
+    """
+
+    def __init__(self, output_file, config : dict):
+        self.output_file = output_file
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config)
+
+        self.random = random.Random(self.config["seed"])
+        self.version_count = 0
+        self.objects = []
+        self.ehrs = []
+        self.patients = []
+
+        # the committers are chosen with Zipf-like weights, so that some of them commit much more than others.
+        committer_count = max(self.config["committers"], 1)
+        self.committer_weights = []
+        total = 0.0
+        for committer_index in range(committer_count):
+            total += 1.0 / (committer_index + 1)
+            self.committer_weights.append(total)
+
+    def sample_history_length(self) -> int:
+        if self.random.random() < self.config["long_history_fraction"]:
+            return self.config["long_history_length"]
+        length = int(round(self.config["history_length_median"] * self.random.lognormvariate(0.0, self.config["history_length_sigma"])))
+        return min(max(length, 1), self.config["max_history_length"])
+
+    def sample_composition_count(self) -> int:
+        mean = self.config["compositions_per_ehr_mean"]
+        if mean <= 0:
+            return 0
+        return int(self.random.expovariate(1.0 / mean))
+
+    def write_versions(self, length : int) -> int:
+        """
+        Generates and writes the versions of a versioned object.
+
+        Returns:
+            The index of its first version.
+        """
+
+        first_version = self.version_count
+        committers = self.random.choices(range(len(self.committer_weights)), cum_weights = self.committer_weights, k = self.random.randint(1, max(self.config["committers_per_object"], 1)))
+        interval_mean = self.config["commit_interval_minutes_mean"]
+
+        minutes = self.random.randrange(0, 60 * 24 * 365)
+        chunk = bytearray(VERSION_RECORD.size * length)
+        for version_index in range(length):
+            flags = ID_FALLBACK_FLAG if self.random.random() < self.config["id_fallback_rate"] else 0
+            VERSION_RECORD.pack_into(chunk, version_index * VERSION_RECORD.size, self.random.choice(committers), flags, minutes)
+            minutes += 1 + int(self.random.expovariate(1.0 / interval_mean))
+        self.output_file.write(chunk)
+
+        self.version_count += length
+        return first_version
+
+    def add_object(self, object_id : str, kind : int, ehr_index : int, length : int = 0) -> int:
+        first_version = self.write_versions(length) if length > 0 else 0
+        self.objects.append((uuid.UUID(object_id).bytes, kind, ehr_index, first_version, length))
+        return len(self.objects) - 1
+
+    def generate(self):
+        self.output_file.write(bytes(HEADER.size))
+        versions_offset = HEADER.size
+
+        for ehr_index in range(self.config["ehrs"]):
+            ehr_id = make_id("ehr", ehr_index)
+            self.add_object(ehr_id, EHR_KIND, ehr_index)
+            ehr_status = self.add_object(make_id("ehr_status", ehr_index), EHR_STATUS_KIND, ehr_index, self.sample_history_length())
+            compositions = [
+                self.add_object(make_id("composition", ehr_index, composition_index), COMPOSITION_KIND, ehr_index, self.sample_history_length())
+                for composition_index in range(self.sample_composition_count())
+            ]
+            self.ehrs.append((ehr_id, ehr_status, compositions))
+
+        for patient_index in range(self.config["patients"]):
+            ehr_index = patient_index if patient_index < self.config["ehrs"] else NO_INDEX
+            self.patients.append(self.add_object(make_id("patient", patient_index), PERSON_KIND, ehr_index, self.sample_history_length()))
+
+        # the object records are sorted by ID, and the other sections refer to them by their sorted position.
+        order = sorted(range(len(self.objects)), key = lambda object_index: self.objects[object_index][0])
+        positions = [0] * len(order)
+        for position, object_index in enumerate(order):
+            positions[object_index] = position
+
+        objects_offset = self.output_file.tell()
+        for object_index in order:
+            self.output_file.write(OBJECT_RECORD.pack(*self.objects[object_index]))
+
+        ehrs_offset = self.output_file.tell()
+        link_count = 0
+        for ehr_id, ehr_status, compositions in self.ehrs:
+            self.output_file.write(EHR_RECORD.pack(uuid.UUID(ehr_id).bytes, positions[ehr_status], link_count, len(compositions)))
+            link_count += len(compositions)
+
+        links_offset = self.output_file.tell()
+        for _, _, compositions in self.ehrs:
+            for composition in compositions:
+                self.output_file.write(INDEX.pack(positions[composition]))
+
+        patients_offset = self.output_file.tell()
+        for patient in self.patients:
+            self.output_file.write(INDEX.pack(positions[patient]))
+
+        self.output_file.seek(0)
+        self.output_file.write(HEADER.pack(
+            MAGIC, self.config["version_padding_bytes"], self.version_count, len(self.objects), len(self.ehrs), link_count, len(self.patients),
+            versions_offset, objects_offset, ehrs_offset, links_offset, patients_offset
+        ))
+
+def generate_dataset(path : str, config : dict) -> dict:
+    """
+    Generates a dataset file.
+
+    Parameters:
+        path - the path of the file.
+        config - the shape of the data (see `DEFAULT_CONFIG` and `fake_upstream/README.md`).
+
+    Returns:
+        A dictionary with the number of EHRs, COMPOSITIONs, patients and versions.
+    """
+
+    with open(path, "wb") as output_file:
+        writer = DatasetWriter(output_file, config)
+        writer.generate()
+
+    return {
+        "ehrs": len(writer.ehrs),
+        "compositions": sum(len(compositions) for _, _, compositions in writer.ehrs),
+        "patients": len(writer.patients),
+        "versions": writer.version_count
+    }
+
+class ObjectIds:
+    """
+    A read-only sequence of the IDs of the object records, which `bisect` can search without loading them.
+    """
+
+    def __init__(self, buffer, offset : int, count : int):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index : int) -> bytes:
+        start = self.offset + index * OBJECT_RECORD.size
+        return self.buffer[start:start + 16]
+
+class DatasetData:
+    """
+    Serves a memory-mapped dataset file with the same interface as `SyntheticData`.
+    """
+
+    def __init__(self, path : str):
+        with open(path, "rb") as dataset_file:
+            self.buffer = mmap.mmap(dataset_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        (magic, self.padding_bytes, self.version_count, self.object_count, self.ehr_count, self.link_count, self.patient_count,
+            self.versions_offset, self.objects_offset, self.ehrs_offset, self.links_offset, self.patients_offset) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dataset file.")
+
+        self.object_ids = ObjectIds(self.buffer, self.objects_offset, self.object_count)
+
+    def _get_object(self, position : int) -> tuple:
+        return OBJECT_RECORD.unpack_from(self.buffer, self.objects_offset + position * OBJECT_RECORD.size)
+
+    def _find_object(self, object_id : str, kind : int) -> tuple:
+        """
+        Finds the record of an object by its ID and kind.
+
+        Returns:
+            The record, or `None` if there is no such object.
+        """
+
+        try:
+            key = uuid.UUID(object_id).bytes
+        except (ValueError, TypeError):
+            return None
+
+        position = bisect.bisect_left(self.object_ids, key)
+        if position == self.object_count:
+            return None
+        record = self._get_object(position)
+        if record[0] != key or record[1] != kind:
+            return None
+        return record
+
+    def _get_ehr(self, ehr_index : int) -> tuple:
+        return EHR_RECORD.unpack_from(self.buffer, self.ehrs_offset + ehr_index * EHR_RECORD.size)
+
+    def _get_versioned_object(self, object_type : str, object_id : str, ehr_id : str = None) -> tuple:
+        """
+        Gets the record of a versioned object, or `None` if it does not exist (or does not belong to the EHR).
+        """
+
+        if object_type == EHR_STATUS_TYPE:
+            ehr_record = self._find_object(ehr_id, EHR_KIND)
+            if ehr_record is None:
+                return None
+            return self._get_object(self._get_ehr(ehr_record[2])[1])
+
+        record = self._find_object(object_id, TYPE_KINDS[object_type])
+        if record is None:
+            return None
+        if object_type == COMPOSITION_TYPE:
+            ehr_record = self._find_object(ehr_id, EHR_KIND)
+            if ehr_record is None or ehr_record[2] != record[2]:
+                return None
+        return record
+
+    def _get_version_record(self, record : tuple, version_number : int) -> tuple:
+        return VERSION_RECORD.unpack_from(self.buffer, self.versions_offset + (record[3] + version_number - 1) * VERSION_RECORD.size)
+
+    def _build_version(self, record : tuple, version_number : int) -> dict:
+        committer_index, flags, minutes = self._get_version_record(record, version_number)
+        return build_version(KIND_TYPES[record[1]], str(uuid.UUID(bytes = record[0])), version_number, committer_index, bool(flags & ID_FALLBACK_FLAG), minutes, self.padding_bytes)
+
+    def get_ehr_status_id(self, ehr_id : str) -> str:
+        record = self._get_versioned_object(EHR_STATUS_TYPE, None, ehr_id)
+        if record is None:
+            return None
+        return str(uuid.UUID(bytes = record[0]))
+
+    def get_all_ehr_ids(self) -> list:
+        return [str(uuid.UUID(bytes = self._get_ehr(ehr_index)[0])) for ehr_index in range(self.ehr_count)]
+
+    def _get_compositions_of_ehr(self, ehr_index : int) -> list:
+        _, _, first_link, composition_count = self._get_ehr(ehr_index)
+        return [self._get_object(INDEX.unpack_from(self.buffer, self.links_offset + link * INDEX.size)[0]) for link in range(first_link, first_link + composition_count)]
+
+    def get_composition_ids_and_names(self, ehr_id : str) -> list:
+        """
+        Gets the latest version ID and the name of each COMPOSITION of an EHR.
+        """
+
+        ehr_record = self._find_object(ehr_id, EHR_KIND)
+        if ehr_record is None:
+            return []
+
+        return [
+            [make_version_id(str(uuid.UUID(bytes = record[0])), record[4]), f"Composition {composition_index}"]
+            for composition_index, record in enumerate(self._get_compositions_of_ehr(ehr_record[2]))
+        ]
+
+    def get_ehr_summary(self, ehr_id : str) -> dict:
+        record = self._get_versioned_object(EHR_STATUS_TYPE, None, ehr_id)
+        if record is None:
+            return None
+
+        return {
+            "ehr_id": {
+                "value": ehr_id
+            },
+            "system_id": {
+                "value": SYSTEM_ID
+            },
+            "time_created": {
+                "value": BASE_TIME.isoformat()
+            },
+            "ehr_status": {
+                "uid": {
+                    "value": make_version_id(str(uuid.UUID(bytes = record[0])), record[4])
+                },
+                "archetype_node_id": "openEHR-EHR-EHR_STATUS.generic.v1",
+                "is_modifiable": True,
+                "is_queryable": True
+            }
+        }
+
+    def get_revision_history(self, object_type : str, object_id : str, ehr_id : str = None) -> list:
+        """
+        Gets the revision history of a versioned object, or `None` if it does not exist.
+
+        For EHR_STATUS objects, `object_id` is ignored and the EHR_STATUS of `ehr_id` is used.
+        """
+
+        record = self._get_versioned_object(object_type, object_id, ehr_id)
+        if record is None:
+            return None
+        commit_minutes = (self._get_version_record(record, version_number)[2] for version_number in range(1, record[4] + 1))
+        return build_revision_history(str(uuid.UUID(bytes = record[0])), commit_minutes)
+
+    def get_version(self, object_type : str, version_id : str, ehr_id : str = None) -> dict:
+        """
+        Gets a version of a versioned object, or `None` if it does not exist.
+        """
+
+        parts = version_id.split("::")
+        if len(parts) != 3 or parts[1] != SYSTEM_ID or not parts[2].isdecimal():
+            return None
+        version_number = int(parts[2])
+
+        record = self._get_versioned_object(object_type, parts[0], ehr_id)
+        if record is None or str(uuid.UUID(bytes = record[0])) != parts[0] or version_number < 1 or version_number > record[4]:
+            return None
+        return self._build_version(record, version_number)
+
+    def get_latest_version(self, object_type : str, object_id : str, ehr_id : str = None) -> dict:
+        record = self._get_versioned_object(object_type, object_id, ehr_id)
+        if record is None:
+            return None
+        return self._build_version(record, record[4])
+
+    def _get_patient(self, patient_index : int) -> tuple:
+        return self._get_object(INDEX.unpack_from(self.buffer, self.patients_offset + patient_index * INDEX.size)[0])
+
+    def list_patients(self) -> list:
+        return [str(uuid.UUID(bytes = self._get_patient(patient_index)[0])) for patient_index in range(self.patient_count)]
+
+    def get_ehr_id_of_patient(self, patient_id : str) -> str:
+        record = self._find_object(patient_id, PERSON_KIND)
+        if record is None or record[2] == NO_INDEX:
+            return None
+        return str(uuid.UUID(bytes = self._get_ehr(record[2])[0]))
+
+    def get_catalog(self) -> list:
+        """
+        Lists every versioned object with its type, its IDs and its number of versions.
+        """
+
+        catalog = []
+        for ehr_index in range(self.ehr_count):
+            ehr_id_bytes, ehr_status_position, _, _ = self._get_ehr(ehr_index)
+            ehr_id = str(uuid.UUID(bytes = ehr_id_bytes))
+            catalog.append({
+                "type": EHR_STATUS_TYPE,
+                "ehr_id": ehr_id,
+                "versions": self._get_object(ehr_status_position)[4]
+            })
+            for record in self._get_compositions_of_ehr(ehr_index):
+                catalog.append({
+                    "type": COMPOSITION_TYPE,
+                    "ehr_id": ehr_id,
+                    "composition_id": str(uuid.UUID(bytes = record[0])),
+                    "versions": record[4]
+                })
+        for patient_index in range(self.patient_count):
+            record = self._get_patient(patient_index)
+            catalog.append({
+                "type": PERSON_TYPE,
+                "patient_id": str(uuid.UUID(bytes = record[0])),
+                "versions": record[4]
+            })
+        return catalog
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generates a synthetic dataset file for the stand-in upstream.")
+    parser.add_argument("--config", default = None, help = "path to the JSON file with the shape of the data")
+    parser.add_argument("--output", required = True, help = "path of the dataset file")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+
+    counts = generate_dataset(args.output, config)
+    print(f"Generated {counts['ehrs']} EHRs, {counts['compositions']} COMPOSITIONs, {counts['patients']} patients and {counts['versions']} versions.")
+
+if __name__ == "__main__":
+    main()
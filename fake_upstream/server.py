@@ -0,0 +1,289 @@
+"""
+A local stand-in for the openEHR API and the demographic API, which serves synthetic data with configurable
+latencies, error rates and payload sizes.
+
+Usage (from the root folder of the repository):
+```bash
+python -m fake_upstream.server --config fake_upstream/config.json --port 12010
+```
+
+The openEHR API is served under `/openehr` and the demographic API under `/demographic`. With `--http2`, they are
+served over HTTPS with `hypercorn`, which negotiates HTTP/2 or HTTP/1.1 with each client.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, request
+
+from fake_upstream.synthetic_data import SyntheticData, EHR_STATUS_TYPE, COMPOSITION_TYPE, PERSON_TYPE
+from fake_upstream.dataset import DatasetData
+from fake_upstream import behaviour
+
+# folder of the self-signed certificate served with `--http2`.
+CERTIFICATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "certificate")
+# number of threads which handle the requests served with `--http2`, so that slow endpoints do not queue each other.
+HTTP2_WORKER_THREADS = 256
+
+# regular expression which extracts the EHR ID from the AQL query of `openehr_api.get_all_composition_ids_and_names_of_ehr`.
+COMPOSITIONS_OF_EHR_QUERY_PATTERN = re.compile(r"e/ehr_id/value\s*=\s*'([^']*)'")
+
+def json_response(content, status : int = 200) -> Response:
+    return Response(status = status, response = json.dumps(content), mimetype = "application/json")
+
+def create_app(data, behaviours : dict) -> Flask:
+    """
+    Creates the Flask application of the stand-in upstream.
+
+    Parameters:
+        data - the data source (`SyntheticData` or `DatasetData`).
+        behaviours - a dictionary from endpoint class to `EndpointBehaviour`.
+    """
+
+    app = Flask(__name__)
+
+    def simulate(endpoint_class : str, handler):
+        """
+        Simulates the latency and the errors of an endpoint class, then calls the handler.
+        """
+
+        endpoint_behaviour = behaviours[endpoint_class]
+        latency = endpoint_behaviour.sample_latency()
+        if latency > 0.0:
+            time.sleep(latency)
+        if endpoint_behaviour.should_fail():
+            return Response(status = endpoint_behaviour.error_status)
+        return handler(endpoint_behaviour)
+
+    def version_response(version : dict, endpoint_behaviour) -> Response:
+        if version is None:
+            return Response(status = 404)
+        if endpoint_behaviour.payload_bytes is not None:
+            version["data"]["padding"] = "x" * endpoint_behaviour.payload_bytes
+        return json_response(version)
+
+    def optional_response(content) -> Response:
+        if content is None:
+            return Response(status = 404)
+        return json_response(content)
+
+    def revision_history_response(revision_history, endpoint_behaviour) -> Response:
+        response = optional_response(revision_history)
+        if revision_history is None or not endpoint_behaviour.etag:
+            return response
+        response.add_etag()
+        return response.make_conditional(request)
+
+    # openEHR API
+
+    @app.route("/openehr/v1/query/aql", methods=["GET"])
+    def execute_aql():
+        def handler(endpoint_behaviour):
+            query = request.args.get("q", "")
+            match = COMPOSITIONS_OF_EHR_QUERY_PATTERN.search(query)
+            if match is not None:
+                rows = data.get_composition_ids_and_names(match.group(1))
+            elif "FROM EHR e" in query:
+                rows = [[ehr_id] for ehr_id in data.get_all_ehr_ids()]
+            else:
+                return Response(status = 400)
+
+            if len(rows) == 0:
+                return Response(status = 204)
+            return json_response({ "q": query, "rows": rows })
+        return simulate(behaviour.AQL_ENDPOINT, handler)
+
+    @app.route("/openehr/v1/ehr/<ehr_id>", methods=["GET"])
+    def get_ehr(ehr_id):
+        return simulate(behaviour.EHR_ENDPOINT, lambda _: optional_response(data.get_ehr_summary(ehr_id)))
+
+    @app.route("/openehr/v1/ehr/<ehr_id>/versioned_ehr_status/revision_history", methods=["GET"])
+    def get_ehr_status_revision_history(ehr_id):
+        return simulate(behaviour.REVISION_HISTORY_ENDPOINT, lambda endpoint_behaviour: revision_history_response(data.get_revision_history(EHR_STATUS_TYPE, None, ehr_id), endpoint_behaviour))
+
+    @app.route("/openehr/v1/ehr/<ehr_id>/versioned_ehr_status/version/<version_id>", methods=["GET"])
+    def get_ehr_status_version(ehr_id, version_id):
+        return simulate(behaviour.VERSION_ENDPOINT, lambda endpoint_behaviour: version_response(data.get_version(EHR_STATUS_TYPE, version_id, ehr_id), endpoint_behaviour))
+
+    @app.route("/openehr/v1/ehr/<ehr_id>/versioned_composition/<composition_id>/revision_history", methods=["GET"])
+    def get_composition_revision_history(ehr_id, composition_id):
+        return simulate(behaviour.REVISION_HISTORY_ENDPOINT, lambda endpoint_behaviour: revision_history_response(data.get_revision_history(COMPOSITION_TYPE, composition_id, ehr_id), endpoint_behaviour))
+
+    @app.route("/openehr/v1/ehr/<ehr_id>/versioned_composition/<composition_id>/version/<version_id>", methods=["GET"])
+    def get_composition_version(ehr_id, composition_id, version_id):
+        def handler(endpoint_behaviour):
+            if not version_id.startswith(f"{composition_id}::"):
+                return Response(status = 404)
+            return version_response(data.get_version(COMPOSITION_TYPE, version_id, ehr_id), endpoint_behaviour)
+        return simulate(behaviour.VERSION_ENDPOINT, handler)
+
+    @app.route("/openehr/v1/definition/template/adl1.4", methods=["GET"])
+    def get_templates():
+        def handler(_):
+            return json_response([
+                {
+                    "template_id": "fake.template.v1",
+                    "concept": "Fake template",
+                    "archetype_id": "openEHR-EHR-COMPOSITION.report.v1",
+                    "created_timestamp": "2022-01-01T00:00:00"
+                }
+            ])
+        return simulate(behaviour.TEMPLATES_ENDPOINT, handler)
+
+    # demographic API
+
+    @app.route("/demographic/v1/patient", methods=["GET"])
+    def list_patients():
+        return simulate(behaviour.PATIENT_ENDPOINT, lambda _: json_response(data.list_patients()))
+
+    @app.route("/demographic/v1/patient/<version_id_or_patient_id>", methods=["GET"])
+    def get_patient(version_id_or_patient_id):
+        def handler(endpoint_behaviour):
+            if "::" in version_id_or_patient_id:
+                version = data.get_version(PERSON_TYPE, version_id_or_patient_id)
+            else:
+                version = data.get_latest_version(PERSON_TYPE, version_id_or_patient_id)
+            if version is None:
+                return Response(status = 404)
+            return json_response(version["data"])
+        return simulate(behaviour.PATIENT_ENDPOINT, handler)
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>", methods=["GET"])
+    def get_versioned_patient(patient_id):
+        def handler(_):
+            if data.get_revision_history(PERSON_TYPE, patient_id) is None:
+                return Response(status = 404)
+            return json_response({
+                "uid": {
+                    "value": patient_id
+                },
+                "owner_id": {
+                    "value": patient_id
+                },
+                "time_created": {
+                    "value": "2022-01-01T00:00:00"
+                }
+            })
+        return simulate(behaviour.PATIENT_ENDPOINT, handler)
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>/revision_history", methods=["GET"])
+    def get_patient_revision_history(patient_id):
+        return simulate(behaviour.REVISION_HISTORY_ENDPOINT, lambda endpoint_behaviour: revision_history_response(data.get_revision_history(PERSON_TYPE, patient_id), endpoint_behaviour))
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>/version", methods=["GET"])
+    def get_patient_latest_version(patient_id):
+        return simulate(behaviour.VERSION_ENDPOINT, lambda endpoint_behaviour: version_response(data.get_latest_version(PERSON_TYPE, patient_id), endpoint_behaviour))
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>/version/<version_id>", methods=["GET"])
+    def get_patient_version(patient_id, version_id):
+        def handler(endpoint_behaviour):
+            if not version_id.startswith(f"{patient_id}::"):
+                return Response(status = 404)
+            return version_response(data.get_version(PERSON_TYPE, version_id), endpoint_behaviour)
+        return simulate(behaviour.VERSION_ENDPOINT, handler)
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>/ehr", methods=["GET"])
+    def get_ehr_of_patient(patient_id):
+        def handler(_):
+            ehr_id = data.get_ehr_id_of_patient(patient_id)
+            if ehr_id is None:
+                return Response(status = 404)
+            return json_response({ "ehr_id": ehr_id })
+        return simulate(behaviour.EHR_OF_PATIENT_ENDPOINT, handler)
+
+    @app.route("/demographic/v1/versioned_patient/<patient_id>/contribution/<contribution_id>", methods=["GET"])
+    def get_contribution(patient_id, contribution_id):
+        def handler(_):
+            if data.get_revision_history(PERSON_TYPE, patient_id) is None:
+                return Response(status = 404)
+            return json_response({
+                "uid": {
+                    "value": contribution_id
+                },
+                "versions": []
+            })
+        return simulate(behaviour.CONTRIBUTION_ENDPOINT, handler)
+
+    # benchmark support
+
+    @app.route("/catalog", methods=["GET"])
+    def get_catalog():
+        """
+        Lists every versioned object with its number of versions, so that benchmarks can choose their targets.
+        """
+
+        return json_response(data.get_catalog())
+
+    return app
+
+def load_data(config : dict, dataset_path : str = None):
+    """
+    Loads the data source: the dataset file given on the command line or in the `dataset` entry of the `data` section,
+    or else synthetic data generated on the fly.
+    """
+
+    data_config = config.get("data", {})
+    dataset_path = dataset_path or data_config.get("dataset", None)
+    if dataset_path is not None:
+        return DatasetData(dataset_path)
+    return SyntheticData(data_config)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Local stand-in for the openEHR and demographic APIs.")
+    parser.add_argument("--config", default = None, help = "path to the JSON configuration file")
+    parser.add_argument("--dataset", default = None, help = "path to a dataset file generated by `fake_upstream.dataset`")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 12010)
+    parser.add_argument("--verbose", action = "store_true", help = "log every request")
+    parser.add_argument("--http2", action = "store_true", help = "serve over HTTPS with HTTP/2 (requires `hypercorn`)")
+    parser.add_argument("--certfile", default = os.path.join(CERTIFICATE_FOLDER, "api-cert.pem"), help = "certificate served with `--http2`")
+    parser.add_argument("--keyfile", default = os.path.join(CERTIFICATE_FOLDER, "api-key.pem"), help = "private key of the certificate served with `--http2`")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    config = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+
+    data = load_data(config, args.dataset)
+    behaviours = behaviour.load_behaviours(config.get("endpoints", {}), config.get("seed", None))
+
+    app = create_app(data, behaviours)
+    if args.http2:
+        serve_http2(app, args.host, args.port, args.certfile, args.keyfile, args.verbose)
+    else:
+        app.run(host = args.host, port = args.port, threaded = True)
+
+def serve_http2(app, host : str, port : int, certfile : str, keyfile : str, verbose : bool):
+    """
+    Serves the stand-in upstream over HTTPS with `hypercorn`, which negotiates HTTP/2 (or HTTP/1.1) with ALPN.
+    """
+
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.certfile = certfile
+    config.keyfile = keyfile
+    if verbose:
+        config.accesslog = "-"
+
+    async def run():
+        # the WSGI application runs in the default executor of the loop.
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers = HTTP2_WORKER_THREADS))
+        await serve(app, config, mode = "wsgi")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+from datetime import datetime, timedelta
+from uuid import uuid5, UUID
+
+# namespace of the deterministic identifiers of the synthetic data.
+SYNTHETIC_NAMESPACE = UUID("6f1c7f0e-7d4b-4b8e-9c55-2f7f4f1de5a1")
+
+# system ID used in the version IDs.
+SYSTEM_ID = "fake.upstream"
+
+# date/time of the first version of every object.
+BASE_TIME = datetime(2022, 1, 1)
+
+EHR_STATUS_TYPE = "EHR_STATUS"
+COMPOSITION_TYPE = "COMPOSITION"
+PERSON_TYPE = "PERSON"
+
+def make_id(*parts) -> str:
+    """
+    Makes a deterministic UUID from the given parts.
+    """
+
+    return str(uuid5(SYNTHETIC_NAMESPACE, "/".join(str(part) for part in parts)))
+
+def make_version_id(object_id : str, version_number : int) -> str:
+    return f"{object_id}::{SYSTEM_ID}::{version_number}"
+
+def make_committer(committer_index : int) -> dict:
+    """
+    Makes a `PARTY_IDENTIFIED` committer.
+
+    Even committers are identified by name and odd committers by their first identifier,
+    which are the two forms handled by `rm_utils.extract_committer_name_or_id_from_version`.
+    """
+
+    committer = {
+        "_type": "PARTY_IDENTIFIED"
+    }
+    if committer_index % 2 == 0:
+        committer["name"] = f"Committer {committer_index}"
+    else:
+        committer["identifiers"] = [
+            {
+                "_type": "DV_IDENTIFIER",
+                "id": f"committer-{committer_index}",
+                "issuer": "fake.upstream",
+                "assigner": "fake.upstream",
+                "type": "ID"
+            }
+        ]
+    return committer
+
+def make_contribution_ref(contribution_id : str, use_id_fallback : bool) -> dict:
+    """
+    Makes an `OBJECT_REF` to a contribution, either in the `uid` form or in the `id` (fallback) form.
+    """
+
+    key = "id" if use_id_fallback else "uid"
+    return {
+        key: {
+            "_type": "HIER_OBJECT_ID",
+            "value": contribution_id
+        },
+        "namespace": "local",
+        "type": "CONTRIBUTION"
+    }
+
+def make_version(object_type : str, object_id : str, version_number : int, committers : int, padding_bytes : int) -> dict:
+    """
+    Makes a `VERSION<T>` of a versioned object.
+
+    Parameters:
+        object_type - the type of the versioned object (EHR_STATUS, COMPOSITION or PERSON).
+        object_id - the ID of the versioned object.
+        version_number - the number of the version, starting at 1.
+        committers - the number of distinct committers.
+        padding_bytes - the size of the padding added to the data of the version.
+
+    Returns:
+        The version.
+    """
+
+    committer_index = (version_number - 1) % max(committers, 1)
+    return build_version(object_type, object_id, version_number, committer_index, version_number % 7 == 0, version_number, padding_bytes)
+
+def build_version(object_type : str, object_id : str, version_number : int, committer_index : int, use_id_fallback : bool, minutes : int, padding_bytes : int) -> dict:
+    """
+    Builds a `VERSION<T>` of a versioned object from its attributes.
+
+    Parameters:
+        object_type - the type of the versioned object (EHR_STATUS, COMPOSITION or PERSON).
+        object_id - the ID of the versioned object.
+        version_number - the number of the version, starting at 1.
+        committer_index - the index of the committer (see `make_committer`).
+        use_id_fallback - whether the contribution is referred to with the fallback `id` form of `OBJECT_REF`.
+        minutes - the time of the commit, in minutes after `BASE_TIME`.
+        padding_bytes - the size of the padding added to the data of the version.
+
+    Returns:
+        The version.
+    """
+
+    version_id = make_version_id(object_id, version_number)
+    contribution_id = make_id("contribution", version_id)
+
+    version = {
+        "_type": "ORIGINAL_VERSION",
+        "uid": {
+            "_type": "OBJECT_VERSION_ID",
+            "value": version_id
+        },
+        "contribution": make_contribution_ref(contribution_id, use_id_fallback = use_id_fallback),
+        "commit_audit": {
+            "_type": "AUDIT_DETAILS",
+            "system_id": SYSTEM_ID,
+            "time_committed": {
+                "value": (BASE_TIME + timedelta(minutes=minutes)).isoformat()
+            },
+            "change_type": {
+                "value": "creation" if version_number == 1 else "modification"
+            },
+            "committer": make_committer(committer_index)
+        },
+        "lifecycle_state": {
+            "value": "complete"
+        },
+        "data": {
+            "_type": object_type,
+            "name": {
+                "value": f"{object_type} {object_id}"
+            },
+            "padding": "x" * padding_bytes
+        }
+    }
+    if version_number > 1:
+        version["preceding_version_uid"] = {
+            "_type": "OBJECT_VERSION_ID",
+            "value": make_version_id(object_id, version_number - 1)
+        }
+    return version
+
+def make_revision_history(object_id : str, version_count : int) -> list:
+    """
+    Makes the `REVISION_HISTORY` of a versioned object, in the plain list form.
+    """
+
+    return build_revision_history(object_id, range(1, version_count + 1))
+
+def build_revision_history(object_id : str, commit_minutes) -> list:
+    """
+    Builds the `REVISION_HISTORY` of a versioned object, in the plain list form, from the time of the commit of each of
+    its versions (in minutes after `BASE_TIME`).
+    """
+
+    revision_history = []
+    for version_number, minutes in enumerate(commit_minutes, start = 1):
+        revision_history.append({
+            "version_id": {
+                "value": make_version_id(object_id, version_number)
+            },
+            "audits": [
+                {
+                    "_type": "AUDIT_DETAILS",
+                    "system_id": SYSTEM_ID,
+                    "time_committed": {
+                        "value": (BASE_TIME + timedelta(minutes=minutes)).isoformat()
+                    }
+                }
+            ]
+        })
+    return revision_history
+
+class SyntheticData:
+    """
+    Synthetic openEHR and demographic data generated on the fly from a small configuration.
+
+    The versioned objects are numbered and the number of versions of each object is taken, in turn,
+    from the list `history_lengths`, so benchmarks know in advance how long each history is.
+    """
+
+    def __init__(self, config : dict):
+        self.ehr_count = config.get("ehrs", 10)
+        self.compositions_per_ehr = config.get("compositions_per_ehr", 3)
+        self.patient_count = config.get("patients", 10)
+        self.history_lengths = config.get("history_lengths", [1, 10, 100])
+        self.committers = config.get("committers", 5)
+        self.padding_bytes = config.get("version_padding_bytes", 0)
+
+        self._ehr_indexes = {}
+        self._ehr_status_indexes = {}
+        self._composition_indexes = {}
+        self._patient_indexes = {}
+        for ehr_index in range(self.ehr_count):
+            self._ehr_indexes[make_id("ehr", ehr_index)] = ehr_index
+            self._ehr_status_indexes[make_id("ehr_status", ehr_index)] = ehr_index
+            for composition_index in range(self.compositions_per_ehr):
+                self._composition_indexes[make_id("composition", ehr_index, composition_index)] = (ehr_index, composition_index)
+        for patient_index in range(self.patient_count):
+            self._patient_indexes[make_id("patient", patient_index)] = patient_index
+
+    def _get_history_length(self, object_index : int) -> int:
+        return self.history_lengths[object_index % len(self.history_lengths)]
+
+    def _get_versioned_object(self, object_type : str, object_id : str, ehr_id : str = None):
+        """
+        Gets the number of versions of a versioned object, or `None` if it does not exist.
+        """
+
+        if object_type == EHR_STATUS_TYPE:
+            ehr_index = self._ehr_indexes.get(ehr_id)
+            if ehr_index is None:
+                return None
+            return self._get_history_length(ehr_index)
+        elif object_type == COMPOSITION_TYPE:
+            indexes = self._composition_indexes.get(object_id)
+            if indexes is None or self._ehr_indexes.get(ehr_id) != indexes[0]:
+                return None
+            return self._get_history_length(indexes[0] * self.compositions_per_ehr + indexes[1])
+        elif object_type == PERSON_TYPE:
+            patient_index = self._patient_indexes.get(object_id)
+            if patient_index is None:
+                return None
+            return self._get_history_length(patient_index)
+        return None
+
+    def get_ehr_status_id(self, ehr_id : str) -> str:
+        ehr_index = self._ehr_indexes.get(ehr_id)
+        if ehr_index is None:
+            return None
+        return make_id("ehr_status", ehr_index)
+
+    def get_all_ehr_ids(self) -> list:
+        return list(self._ehr_indexes.keys())
+
+    def get_composition_ids_and_names(self, ehr_id : str) -> list:
+        """
+        Gets the latest version ID and the name of each COMPOSITION of an EHR.
+        """
+
+        ehr_index = self._ehr_indexes.get(ehr_id)
+        if ehr_index is None:
+            return []
+
+        compositions = []
+        for composition_index in range(self.compositions_per_ehr):
+            composition_id = make_id("composition", ehr_index, composition_index)
+            version_count = self._get_history_length(ehr_index * self.compositions_per_ehr + composition_index)
+            compositions.append([make_version_id(composition_id, version_count), f"Composition {composition_index}"])
+        return compositions
+
+    def get_ehr_summary(self, ehr_id : str) -> dict:
+        ehr_status_id = self.get_ehr_status_id(ehr_id)
+        if ehr_status_id is None:
+            return None
+
+        version_count = self._get_versioned_object(EHR_STATUS_TYPE, ehr_status_id, ehr_id)
+        return {
+            "ehr_id": {
+                "value": ehr_id
+            },
+            "system_id": {
+                "value": SYSTEM_ID
+            },
+            "time_created": {
+                "value": BASE_TIME.isoformat()
+            },
+            "ehr_status": {
+                "uid": {
+                    "value": make_version_id(ehr_status_id, version_count)
+                },
+                "archetype_node_id": "openEHR-EHR-EHR_STATUS.generic.v1",
+                "is_modifiable": True,
+                "is_queryable": True
+            }
+        }
+
+    def get_revision_history(self, object_type : str, object_id : str, ehr_id : str = None) -> list:
+        """
+        Gets the revision history of a versioned object, or `None` if it does not exist.
+
+        For EHR_STATUS objects, `object_id` is ignored and the EHR_STATUS of `ehr_id` is used.
+        """
+
+        if object_type == EHR_STATUS_TYPE:
+            object_id = self.get_ehr_status_id(ehr_id)
+
+        version_count = self._get_versioned_object(object_type, object_id, ehr_id)
+        if version_count is None:
+            return None
+        return make_revision_history(object_id, version_count)
+
+    def get_version(self, object_type : str, version_id : str, ehr_id : str = None) -> dict:
+        """
+        Gets a version of a versioned object, or `None` if it does not exist.
+        """
+
+        parts = version_id.split("::")
+        if len(parts) != 3 or parts[1] != SYSTEM_ID or not parts[2].isdecimal():
+            return None
+        object_id = parts[0]
+        version_number = int(parts[2])
+
+        if object_type == EHR_STATUS_TYPE and object_id != self.get_ehr_status_id(ehr_id):
+            return None
+
+        version_count = self._get_versioned_object(object_type, object_id, ehr_id)
+        if version_count is None or version_number < 1 or version_number > version_count:
+            return None
+        return make_version(object_type, object_id, version_number, self.committers, self.padding_bytes)
+
+    def get_latest_version(self, object_type : str, object_id : str, ehr_id : str = None) -> dict:
+        version_count = self._get_versioned_object(object_type, object_id, ehr_id)
+        if version_count is None:
+            return None
+        return make_version(object_type, object_id, version_count, self.committers, self.padding_bytes)
+
+    def list_patients(self) -> list:
+        return list(self._patient_indexes.keys())
+
+    def get_ehr_id_of_patient(self, patient_id : str) -> str:
+        patient_index = self._patient_indexes.get(patient_id)
+        if patient_index is None or patient_index >= self.ehr_count:
+            return None
+        return make_id("ehr", patient_index)
+
+    def get_catalog(self) -> list:
+        """
+        Lists every versioned object with its type, its IDs and its number of versions.
+        """
+
+        catalog = []
+        for ehr_id, ehr_index in self._ehr_indexes.items():
+            catalog.append({
+                "type": EHR_STATUS_TYPE,
+                "ehr_id": ehr_id,
+                "versions": self._get_history_length(ehr_index)
+            })
+        for composition_id, (ehr_index, composition_index) in self._composition_indexes.items():
+            catalog.append({
+                "type": COMPOSITION_TYPE,
+                "ehr_id": make_id("ehr", ehr_index),
+                "composition_id": composition_id,
+                "versions": self._get_history_length(ehr_index * self.compositions_per_ehr + composition_index)
+            })
+        for patient_id, patient_index in self._patient_indexes.items():
+            catalog.append({
+                "type": PERSON_TYPE,
+                "patient_id": patient_id,
+                "versions": self._get_history_length(patient_index)
+            })
+        return catalog
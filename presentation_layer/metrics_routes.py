@@ -0,0 +1,15 @@
+from flask import Blueprint, Response
+
+from business_layer import metrics_controller
+
+blueprint = Blueprint("metrics routes", __name__)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+@blueprint.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(
+        status = 200,
+        response = metrics_controller.get_metrics(),
+        content_type = OPENMETRICS_CONTENT_TYPE
+    )
@@ -1,14 +1,242 @@
-from flask import Blueprint, request, Response
+from functools import wraps
+import select
+import socket
+import time
 
+from flask import Blueprint, request, Response, send_file
+
+from app_settings import INCLUDE_SERVER_TIMING, INCLUDE_METRICS, INCLUDE_USAGE_STATISTICS, DEFAULT_REQUEST_DEADLINE_SECONDS, MAX_REQUEST_DEADLINE_SECONDS, SHED_RETRY_AFTER_SECONDS, RESPONSE_COMPRESSION, RESPONSE_COMPRESSION_MIN_BYTES, DOCUMENT_STORE_FOLDER, DOCUMENT_STORE_GZIP
 from authentication import auth
-from business_layer import prov_controller, controller_exceptions
-from business_layer.timing import timed, GET_PROVENANCE_MEASUREMENT
+from data_layer.deadlines import deadlines
+from business_layer import prov_controller, prov_formats, controller_exceptions, metrics, compression
+from business_layer.admission import admission_controller
+from business_layer.document_store import StoredDocument, stored_documents
+from data_layer.timing import timed, request_timed
+from business_layer.timing import to_count_range, GET_PROVENANCE_MEASUREMENT, TARGET_TYPE_LABEL, STATUS_LABEL, VERSIONS_LABEL, UPSTREAM_CALLS_LABEL
 
 blueprint = Blueprint("PROV routes", __name__)
 
+# the header with which a client can set the time budget of its request.
+TIMEOUT_HEADER = "X-Request-Timeout"
+# the header which marks a partial response.
+TRUNCATED_HEADER = "X-Provenance-Truncated"
+# the status of the requests cancelled because the client has disconnected (as in nginx, since HTTP has none).
+CLIENT_CLOSED_REQUEST_STATUS = 499
+
+def instrumented(fn):
+    """
+    Wraps a route so that the data of each request is gathered in a request-scoped context, which is then:
+    - sent in the `Server-Timing` header, if enabled;
+    - used to update the request metrics, if enabled;
+    - used to label the usage statistics samples, if enabled.
+
+    If all of them are disabled, the route is returned unchanged.
+    """
+
+    if not INCLUDE_SERVER_TIMING and not INCLUDE_METRICS and not INCLUDE_USAGE_STATISTICS:
+        return fn
+
+    @wraps(fn)
+    def wrapped_function(*args, **kwargs):
+        in_flight = metrics.PROV_REQUESTS_IN_FLIGHT.labels()
+        in_flight.inc()
+        token = request_timed.start()
+        start_time = time.perf_counter()
+        status = 500
+        try:
+            response = fn(*args, **kwargs)
+            status = response.status_code
+
+            request_timing = request_timed.get_current()
+            if INCLUDE_SERVER_TIMING:
+                response.headers["Server-Timing"] = request_timing.to_server_timing_header()
+
+            return response
+        finally:
+            target_type = request_timed.get_current().target_type or metrics.UNKNOWN_TARGET_TYPE
+            metrics.PROV_REQUEST_DURATION.labels(target_type).observe(time.perf_counter() - start_time)
+            metrics.PROV_REQUESTS.labels(target_type, status).inc()
+
+            request_timed.stop(token)
+            in_flight.dec()
+    return wrapped_function
+
+def admission_controlled(is_cheap = None):
+    """
+    Creates a decorator that processes a route only once the admission control admits the request, and otherwise returns a
+    503 (Service Unavailable) response with a `Retry-After` header.
+
+    Parameters:
+        is_cheap - a function without parameters which tells whether the current request is cheap enough (e.g. served
+            from a cache) to bypass the admission control, if any.
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        def wrapped_function(*args, **kwargs):
+            if is_cheap is not None and is_cheap():
+                return fn(*args, **kwargs)
+
+            if not admission_controller.try_acquire():
+                return Response(status = 503, headers = { "Retry-After": str(SHED_RETRY_AFTER_SECONDS) })
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                admission_controller.release()
+        return wrapped_function
+    return wrapper
+
+def is_cheap_request() -> bool:
+    """
+    Tells whether the request will probably get a 304 (Not Modified) response or be served from the document store, in
+    which case it bypasses the admission control.
+    """
+
+    uri = request.args.get("target", "")
+    media_type = negotiate_media_type()
+    if request.if_none_match and prov_controller.is_probably_not_modified(uri, request.if_none_match.contains_weak, media_type):
+        return True
+    return prov_controller.is_stored(uri, media_type)
+
+def negotiate_media_type() -> str:
+    """
+    Chooses the representation of the provenance among those accepted by the client (`Accept` header), PROV-XML if the
+    client accepts any of them equally or none of them.
+    """
+
+    return request.accept_mimetypes.best_match(prov_formats.get_available_media_types(), default = prov_formats.XML_MEDIA_TYPE)
+
+def negotiate_encoding(stored_document : StoredDocument = None) -> str:
+    """
+    Chooses the content coding of a response among those accepted by the client (`Accept-Encoding` header): any available
+    coding if the compression of the responses is enabled, and otherwise only the gzip-encoded copy of a stored document,
+    if any.
+    """
+
+    if RESPONSE_COMPRESSION:
+        encodings = compression.get_available_encodings()
+    elif stored_document is not None and compression.GZIP_ENCODING in stored_document.variant_paths:
+        encodings = [compression.GZIP_ENCODING]
+    else:
+        return compression.IDENTITY_ENCODING
+    return compression.negotiate_encoding(request.accept_encodings, encodings)
+
+def is_weak_etag() -> bool:
+    """
+    Tells whether the entity tag of the responses to the client is weak, i.e. whether they may be compressed for it (the
+    bytes of the compressed responses differ from the uncompressed ones). It only depends on the request, so that the 200
+    and 304 responses to the same client have the same entity tag, whatever the size of the document.
+    """
+
+    encodings = compression.get_available_encodings() if RESPONSE_COMPRESSION else []
+    if DOCUMENT_STORE_FOLDER and DOCUMENT_STORE_GZIP and compression.GZIP_ENCODING not in encodings:
+        encodings.append(compression.GZIP_ENCODING)
+    return compression.negotiate_encoding(request.accept_encodings, encodings) != compression.IDENTITY_ENCODING
+
+def make_content_response(content : bytes, media_type : str) -> Response:
+    """
+    Creates a response which sends a document, compressed chunk by chunk while it is sent if the client accepts an
+    available content coding and the document is large enough.
+    """
+
+    encoding = compression.IDENTITY_ENCODING
+    if len(content) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        encoding = negotiate_encoding()
+
+    if encoding == compression.IDENTITY_ENCODING:
+        response = Response(status = 200, content_type = media_type, response = content)
+    else:
+        response = Response(status = 200, content_type = media_type, response = compression.compress_chunks(compression.split_chunks(content), encoding))
+        response.headers["Content-Encoding"] = encoding
+    response.vary.update(["Accept", "Accept-Encoding"])
+    return response
+
+def make_stored_document_response(stored_document : StoredDocument) -> Response:
+    """
+    Creates a response which sends a stored document from its file, or from its copy with the content coding negotiated
+    with the client, which is stored the first time that it is needed. The file is sent by the file wrapper of the WSGI
+    server, if any (e.g. with `sendfile`).
+    """
+
+    encoding = negotiate_encoding(stored_document)
+    path = None
+    if encoding != compression.IDENTITY_ENCODING:
+        path = stored_documents.get_variant_path(stored_document, encoding)
+
+    if path is None:
+        response = send_file(stored_document.path, mimetype = stored_document.media_type, conditional = False, etag = False)
+    else:
+        response = send_file(path, mimetype = stored_document.media_type, conditional = False, etag = False)
+        response.headers["Content-Encoding"] = encoding
+    # without the charset added by `send_file`, as in the responses which are not stored.
+    response.content_type = stored_document.media_type
+    response.vary.update(["Accept", "Accept-Encoding"])
+    return response
+
+def get_provenance_labels(response : Response) -> dict:
+    """
+    Gets the labels of a usage statistics sample of the provenance route from its response and the request-scoped context.
+    """
+
+    request_timing = request_timed.get_current()
+    return {
+        TARGET_TYPE_LABEL: request_timing.target_type,
+        STATUS_LABEL: response.status_code,
+        VERSIONS_LABEL: to_count_range(request_timing.version_count),
+        UPSTREAM_CALLS_LABEL: to_count_range(request_timing.get_upstream_call_count())
+    }
+
+def get_request_timeout() -> float:
+    """
+    Gets the time budget of the request from the `timeout` query parameter or the timeout header, capped by the configured
+    maximum.
+
+    Returns:
+        The time budget (in seconds), or `None` if the value is not a positive number.
+    """
+
+    value = request.args.get("timeout", request.headers.get(TIMEOUT_HEADER, None))
+    if value is None:
+        return min(DEFAULT_REQUEST_DEADLINE_SECONDS, MAX_REQUEST_DEADLINE_SECONDS)
+
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    if not timeout > 0:
+        return None
+    return min(timeout, MAX_REQUEST_DEADLINE_SECONDS)
+
+def make_client_disconnection_check(environ : dict):
+    """
+    Creates a function which tells whether the client of the request has disconnected, by peeking at its socket: a
+    readable socket without any data has been closed by the client.
+
+    The socket is only exposed by the Werkzeug server, and cannot be peeked at through TLS, so the function always returns
+    `False` otherwise.
+    """
+
+    connection = environ.get("werkzeug.socket", None)
+
+    def is_client_disconnected() -> bool:
+        if connection is None:
+            return False
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            return len(readable) > 0 and connection.recv(1, socket.MSG_PEEK) == b""
+        except ValueError:
+            # TLS sockets do not support peeking.
+            return False
+        except OSError:
+            return True
+
+    return is_client_disconnected
+
 @blueprint.route("/provenance/service", methods=["GET"])
-@timed.measure(GET_PROVENANCE_MEASUREMENT)
+@instrumented
 @auth.login_required
+@admission_controlled(is_cheap = is_cheap_request)
+@timed.measure(GET_PROVENANCE_MEASUREMENT, get_labels = get_provenance_labels)
 def get_provenance():
     """
     Gets the provenance of the resource identified by the URI on the 'target' query parameter.
@@ -17,21 +245,64 @@ def get_provenance():
 
     If the URI does not correspond to an EHR_STATUS, COMPOSITION or patient, this function returns a 404 (Not Found) response.
 
+    The request has a deadline, which the client can set (in seconds) with the 'timeout' query parameter or the
+    `X-Request-Timeout` header, up to a configured maximum. If the deadline passes, this function returns a 504 (Gateway
+    Timeout) response, unless the 'partial' query parameter is 'true': in that case, it returns the provenance of the
+    versions fetched so far, with the `X-Provenance-Truncated` header. If an invalid timeout is provided, this function
+    returns a 400 (Bad Request) response.
+
+    The complete responses have an `ETag` header, which only changes when the versioned object has new versions. If the
+    `If-None-Match` header of the request has the current entity tag, this function returns a 304 (Not Modified) response
+    without building the provenance.
+
+    The largest documents are stored on disk, if enabled, and served from their files while the versioned object has no
+    new versions.
+
+    The provenance is sent in the representation preferred by the client (`Accept` header) among PROV-XML (the
+    default), compact PROV-JSON (`application/json`), PROV-JSON encoded with MessagePack (`application/vnd.msgpack`),
+    Turtle (`text/turtle`) and N-Triples (`application/n-triples`).
+    The responses are compressed with the best content coding accepted by the client (`Accept-Encoding` header), if
+    enabled.
+
     Returns:
         The HTTP response.
     """
 
     uri = request.args.get("target", None)
+    timeout = get_request_timeout()
 
-    if uri is None:
+    if uri is None or timeout is None:
         return Response(status = 400)
 
+    allow_partial = request.args.get("partial", "false").lower() == "true"
+    token = deadlines.start(timeout, allow_partial, make_client_disconnection_check(request.environ))
     try:
-        prov_document = prov_controller.get_provenance(uri)
+        media_type = negotiate_media_type()
+        provenance, etag = prov_controller.get_provenance(uri, request.if_none_match.contains_weak, media_type)
+        truncated = deadlines.is_truncated()
     except (controller_exceptions.InvalidURIException, controller_exceptions.NoSuchVersionedObjectException):
         return Response(status = 404)
+    except controller_exceptions.DeadlineExceededException:
+        return Response(status = 504)
+    except controller_exceptions.RequestCancelledException:
+        return Response(status = CLIENT_CLOSED_REQUEST_STATUS)
     except controller_exceptions.InternalException:
         return Response(status = 500)
+    finally:
+        deadlines.stop(token)
+
+    if provenance is None:
+        response = Response(status = 304)
+        response.set_etag(etag, weak = is_weak_etag())
+        response.vary.update(["Accept", "Accept-Encoding"])
+        return response
 
-    xml = prov_document.serialize(format="xml")
-    return Response(status = 200, content_type="text/xml", response = xml)
+    if isinstance(provenance, StoredDocument):
+        response = make_stored_document_response(provenance)
+    else:
+        response = make_content_response(provenance, media_type)
+    if truncated:
+        response.headers[TRUNCATED_HEADER] = "true"
+    else:
+        response.set_etag(etag, weak = is_weak_etag())
+    return response
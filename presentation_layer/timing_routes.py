@@ -1,4 +1,4 @@
-from flask import Blueprint, Response
+from flask import Blueprint, request, Response
 import json
 
 from business_layer import timing_controller
@@ -7,8 +7,15 @@ blueprint = Blueprint("timing routes", __name__)
 
 @blueprint.route("/usage_statistics", methods=["GET"])
 def get_usage_statistics():
+    group_by = request.args.get("group_by", None)
+
+    try:
+        usage_statistics = timing_controller.get_usage_statistics(group_by)
+    except ValueError:
+        return Response(status = 400)
+
     report = {
-        "usage_statistics": timing_controller.get_usage_statistics()
+        "usage_statistics": usage_statistics
     }
 
     return Response(